@@ -6,6 +6,7 @@ from .settings import Settings
 from .state import State
 from .stats import Details, SortIndex, StatGroup, TimeUnit
 from .util.media_type import MediaType
+from .util.profiler import Profiler, span
 
 
 def init_logger(level):
@@ -136,6 +137,10 @@ def setup_subparsers(state, sub_parsers):
     clean_parser.add_argument("--remove-read", default=False, action="store_const", const=True, help="Removes all read chapters")
     clean_parser.add_argument("--url-cache", default=False, action="store_const", const=True, help="Clears url cache")
 
+    reconcile_parser = add_parser_helper(sub_parsers, "reconcile", help="Rebuilds the download manifests from what's on disk; needed if downloaded chapters are changed outside of amt")
+    reconcile_parser.add_argument("--checksums", default=False, action="store_const", const=True, help="Computes missing checksums of downloaded files")
+    reconcile_parser.add_argument("name", choices=state.get_all_names(), default=None, nargs="?", help="Reconcile only specified media")
+
     # external
 
     import_parser = add_parser_helper(sub_parsers, "import", func_str="import-media", help="Import local media into amt")
@@ -204,6 +209,11 @@ def setup_subparsers(state, sub_parsers):
     stats_update_parser.add_argument("--user-id", default=None, help="id to load tracking info of")
     stats_update_parser.add_argument("username", default=None, nargs="?", help="Username to load info of; defaults to the currently authenticated user")
 
+    stats_http_parser = add_parser_helper(sub_parsers, "stats-http", func_str="list_http_stats", help="Show request counts, errors, retries and latency per server and endpoint", parents=[readonly_parsers])
+    stats_http_parser.add_argument("--no-header", action="store_const", const=True, default=False)
+    stats_http_parser.add_argument("--prometheus", action="store_const", const=True, default=False, help="Output in the Prometheus text format")
+    stats_http_parser.add_argument("server_id", choices=state.get_server_ids(), default=None, nargs="?", help="Only show stats of this server")
+
     # trackers and progress
     load_parser = add_parser_helper(sub_parsers, "load_from_tracker", aliases=["load"], parents=[sub_search_parsers], help="Attempts to add all tracked media")
     load_parser.add_argument("--force", "-f", action="store_const", const=True, default=False, help="Force set of read chapters to be in sync with progress")
@@ -263,7 +273,7 @@ def setup_subparsers(state, sub_parsers):
 
 
 def parse_args(args=None, media_reader=None, already_upgraded=False):
-    SPECIAL_PARAM_NAMES = {"auto", "clear_cookies", "log_level", "no_save", "type", "func", "readonly", "func_str", "tmp_dir"}
+    SPECIAL_PARAM_NAMES = {"auto", "clear_cookies", "log_level", "no_save", "type", "func", "readonly", "func_str", "tmp_dir", "profile"}
     state = State(Settings()) if not media_reader else media_reader.state
 
     parser = argparse.ArgumentParser()
@@ -271,6 +281,7 @@ def parse_args(args=None, media_reader=None, already_upgraded=False):
     parser.add_argument("--clear-cookies", default=False, action="store_const", const=True, help="Clear all cached cookies")
     parser.add_argument("--log-level", default=None, choices=get_log_level_name(), help="Controls verbosity of logs")
     parser.add_argument("--no-save", default=False, action="store_const", const=True, help="Do not save state/cookies")
+    parser.add_argument("--profile", default=False, action="store_const", const=True, help="Profile the command and save a report to the cache dir")
     parser.add_argument("--tmp-dir", default=False, action="store_const", const=True, help="Save state to tmp-dir")
 
     sub_parsers = parser.add_subparsers(dest="type")
@@ -292,6 +303,7 @@ def parse_args(args=None, media_reader=None, already_upgraded=False):
 
     action = namespace.type
     kwargs = {k: v for k, v in vars(namespace).items() if k not in SPECIAL_PARAM_NAMES}
+    profiler = Profiler().start() if namespace.profile else None
     obj = state
     if not "readonly" in namespace:
         init_logger(namespace.log_level or "INFO")
@@ -321,4 +333,10 @@ def parse_args(args=None, media_reader=None, already_upgraded=False):
             return 1 if ret is False else 0
     finally:
         if not namespace.no_save and ("dry_run" not in namespace or not namespace.dry_run):
-            state.save()
+            with span("state_save"):
+                state.save()
+        if profiler:
+            profiler.stop()
+            profile_file = state.settings.get_profile_file(action)
+            print(profiler.save(profile_file), file=sys.stderr)
+            print(f"Saved profile to {profile_file}.txt", file=sys.stderr)
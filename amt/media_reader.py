@@ -4,17 +4,25 @@ import logging
 import os
 import pkgutil
 import shutil
+import time
+
+from queue import Empty, Queue
+from threading import Thread
 
 from requests import Session
+from requests.adapters import DEFAULT_POOLSIZE
 
 from . import servers, trackers
 from .job import Job
-from .server import Server, Tracker
+from .server import RequestServer, Server, Tracker
 from .servers.local import LocalServer
 from .settings import Settings
 from .state import State
+from .util.http_adapter import HTTP2Adapter, PooledHTTPAdapter
 from .util.media_type import MediaType
 from .util.name_parser import (find_media_with_similar_name_in_list, get_alt_names)
+from .util.page_store import PageStore
+from .util.profiler import span
 from .util.progress_type import ProgressType
 
 
@@ -47,21 +55,26 @@ class MediaReader:
         self._servers = {}
         self._trackers = {}
         self.tracker = None
-
-        for cls_list, instance_map in ((server_list, self._servers), (tracker_list, self._trackers)):
-            for cls in cls_list:
-                try:
-                    for instance in cls.get_instances(self.session, self.settings):
-                        if self.settings.is_server_enabled(instance.id, instance.alias, instance.official):
-                            assert instance.id not in instance_map, f"Duplicate server id: {instance.id}"
-                            instance_map[instance.id] = instance
-                except ImportError:
-                    logging.debug("Could not instantiate %s", cls)
+        # seconds each server took to respond to the last multi-server search; None if it didn't in time
+        self.search_timings = {}
+        RequestServer.cloudscraper_domains = self.state.cloudscraper_domains
+
+        with span("server_init"):
+            for cls_list, instance_map in ((server_list, self._servers), (tracker_list, self._trackers)):
+                for cls in cls_list:
+                    try:
+                        for instance in cls.get_instances(self.session, self.settings):
+                            if self.settings.is_server_enabled(instance.id, instance.alias, instance.official):
+                                assert instance.id not in instance_map, f"Duplicate server id: {instance.id}"
+                                instance_map[instance.id] = instance
+                    except ImportError:
+                        logging.debug("Could not instantiate %s", cls)
 
         self.session.headers.update({
             "Connection": "keep-alive",
             "User-Agent": self.settings.user_agent
         })
+        self.mount_http_adapters()
 
         if self._trackers:
             self.set_tracker(self._trackers.get(self.settings.tracker_id, list(self._trackers.values())[0]))
@@ -72,6 +85,30 @@ class MediaReader:
             for data in self.settings.get_cookies_to_inject(server):
                 server.session_set_cookies(data)
 
+    def get_http_pool_size(self, server_id=None):
+        """ Max number of concurrent requests to a server's domain: one per media being updated or per page being downloaded """
+        return self.settings.get_http_pool_size(server_id) or max(self.settings.threads, self.settings.get_threads(server_id), self.settings.get_page_fetch_threads(server_id), DEFAULT_POOLSIZE)
+
+    def mount_http_adapters(self):
+        """
+        Mounts a connection pool per server domain sized so no thread has to discard its keep-alive connection.
+        Other hosts, like image CDNs, share the default adapters which keep a pool for every server and CDN
+        """
+        pool_sizes = {}
+        for server in self._servers.values():
+            if server.domain:
+                pool_sizes[server.domain] = max(pool_sizes.get(server.domain, 0), self.get_http_pool_size(server.id))
+        max_pool_size = max(pool_sizes.values(), default=self.get_http_pool_size())
+        for prefix in ("https://", "http://"):
+            self.session.mount(prefix, PooledHTTPAdapter(pool_connections=max(DEFAULT_POOLSIZE, 2 * len(self._servers)), pool_maxsize=max_pool_size))
+            for domain, pool_size in pool_sizes.items():
+                self.session.mount(f"{prefix}{domain}/", PooledHTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        for domain in self.settings.http2_domains:
+            try:
+                self.session.mount(f"https://{domain}/", HTTP2Adapter(max_connections=max_pool_size))
+            except ImportError as e:
+                logging.debug("Not using HTTP/2 for %s: %s", domain, e)
+
     # Helper methods
     def select_media(self, term, results, prompt, no_print=False, auto_select_if_single=False):
         return results[0] if results else None
@@ -79,6 +116,41 @@ class MediaReader:
     def for_each(self, func, media_list, raiseException=False):
         return Job(self.settings.threads, [lambda x=media_data: func(x) for media_data in media_list], raiseException=raiseException).run()
 
+    def for_each_as_completed(self, func, server_list, timeout=None, raiseException=False):
+        """
+        Like for_each but lazily yields (server, results, seconds taken) as each server finishes instead of waiting on all of them.
+        Stops yielding after timeout seconds; servers that haven't finished by then are yielded with None results and time taken
+        """
+        server_list = list(server_list)
+        queue = Queue()
+
+        def wrapper(server):
+            start = time.time()
+            try:
+                results = func(server)
+            except Exception as e:
+                queue.put((server, e, time.time() - start))
+                raise
+            queue.put((server, results, time.time() - start))
+
+        # the job runs in the background so it can be abandoned once the deadline is hit
+        Thread(target=Job(self.settings.threads, [lambda x=server: wrapper(x) for server in server_list]).run, daemon=True).start()
+        deadline = time.time() + timeout if timeout else None
+        pending = set(server_list)
+        while pending:
+            try:
+                server, results, elapsed = queue.get(timeout=max(0, deadline - time.time()) if deadline else None)
+            except Empty:
+                break
+            pending.remove(server)
+            if isinstance(results, Exception):
+                if raiseException:
+                    raise results
+                results = []
+            yield server, results, elapsed
+        for server in pending:
+            yield server, None, None
+
     def get_servers(self):
         return self._servers.values()
 
@@ -127,20 +199,29 @@ class MediaReader:
 
     def search_add(self, term, server_id=None, media_type=None, limit=None, exact=False, servers_to_exclude=[], server_list=None, no_add=False, media_id=None, raiseException=False):
         def func(x): return x.search(term, literal=exact, limit=limit, media_type=media_type)
+
+        def is_match(x):
+            return (not exact or x["name"] == term) and (not media_id or str(x["id"]) == str(media_id) or x.global_id == media_id)
         if server_id:
             assert not server_list
             results = func(self.get_server(server_id))
         else:
-            results = self.for_each(func, filter(lambda x: x.id not in servers_to_exclude and (media_type is None or media_type & x.media_type), server_list if server_list is not None else self.get_servers()), raiseException=raiseException)
+            results = []
+            self.search_timings.clear()
+            for server, server_results, elapsed in self.for_each_as_completed(func, filter(lambda x: x.id not in servers_to_exclude and (media_type is None or media_type & x.media_type), server_list if server_list is not None else self.get_servers()), timeout=self.settings.search_timeout_sec, raiseException=raiseException):
+                self.search_timings[server.id] = elapsed
+                if server_results is None:
+                    logging.info("Server %s didn't respond to the search within %gs", server.id, self.settings.search_timeout_sec)
+                    continue
+                logging.debug("Server %s returned %d results in %.2fs", server.id, len(server_results), elapsed)
+                results.extend(server_results)
+                # a global id matches at most one media so there is no need to wait on the other servers once found
+                if any(x.global_id == media_id or (exact or media_id) and self.settings.search_stop_at_first_match and is_match(x) for _, x in server_results):
+                    break
 
         results.sort(key=lambda x: (x[0], self.settings.get_search_score(x[1])))
 
-        results = map(lambda x: x[1], results)
-        if exact:
-            results = filter(lambda x: x["name"] == term, results)
-        if media_id:
-            results = filter(lambda x: str(x["id"]) == str(media_id) or x.global_id == media_id, results)
-        results = list(results)[:limit]
+        results = list(filter(is_match, map(lambda x: x[1], results)))[:limit]
         if len(results) == 0:
             return None
         media_data = self.select_media(term, results[:limit], "Select media: ", auto_select_if_single=exact or media_id)
@@ -171,7 +252,8 @@ class MediaReader:
                 else:
                     for x in tracker_data["names"]:
                         alt_names.extend(get_alt_names(x))
-            known_matching_media = list(find_media_with_similar_name_in_list(alt_names, filter(lambda x: not self.get_tracker_info(x), self.get_media(media_type=media_type))))
+            # filter after matching so the name index of the media list can be reused as media gets tracked
+            known_matching_media = list(filter(lambda x: not self.get_tracker_info(x), find_media_with_similar_name_in_list(alt_names, self.get_media(media_type=media_type))))
             if known_matching_media:
                 logging.debug("Checking among known media")
                 media_data = self.select_media(name or tracker_data["name"], known_matching_media, "Select from known media: ")
@@ -248,6 +330,8 @@ class MediaReader:
                     shutil.move(file, dest)
             names.add(name)
 
+        if names and not dry_run:
+            server.clear_catalog()
         if not skip_add and not dry_run:
             media_list = list(self.get_media(name=server.id))
             for media_name in names:
@@ -323,7 +407,8 @@ class MediaReader:
         """
         server = self.get_server(media_data["server_id"])
         chapter_ids = set(media_data["chapters"].keys())
-        server.update(media_data, limit=limit)
+        with span("update_media", media_data.global_id):
+            server.update(media_data, limit=limit)
 
         if not self.settings.get_keep_unavailable(media_data):
             for chapter_id in chapter_ids:
@@ -502,13 +587,14 @@ class MediaReader:
     def set_tracker(self, tracker_id):
         self.tracker = self._trackers[tracker_id] if not isinstance(tracker_id, Tracker) else tracker_id
 
-    def get_tracked_media(self, tracker_id, tracking_id):
-        media_data_list = []
+    def get_tracked_media_index(self, tracker_id):
+        """ Returns a map of tracking id to the media tracked by it """
+        index = {}
         for media_data in self.get_media():
-            tacker_info = self.get_tracker_info(media_data, tracker_id)
-            if tacker_info and tacker_info[0] == tracking_id:
-                media_data_list.append(media_data)
-        return media_data_list
+            tracker_info = self.get_tracker_info(media_data, tracker_id)
+            if tracker_info:
+                index.setdefault(tracker_info[0], []).append(media_data)
+        return index
 
     def has_tracker_info(self, media_data, tracker_id=None):
         return self.get_tracker_info(media_data, tracker_id=tracker_id) is not None
@@ -544,7 +630,7 @@ class MediaReader:
             last_read_chapter = media_data.get_last_read_chapter()
             if last_read_chapter and (force or media_data["progress"] < last_read_chapter["number"]):
                 if tracker_info:
-                    media_to_sync.append((media_data, last_read_chapter["number"]))
+                    media_to_sync.append((media_data, tracker_info[0], last_read_chapter["number"]))
                     if media_data["media_type"] == MediaType.ANIME:
                         data.append((tracker_info[0], last_read_chapter["number"], False))
                     elif media_data["progress_type"] != ProgressType.CHAPTER_VOLUME:
@@ -554,10 +640,16 @@ class MediaReader:
                         data.append((tracker_info[0], last_read_chapter["volume_number"], True))
                     logging.info("Preparing to update %s from %d to %d", media_data["name"], media_data["progress"], last_read_chapter["number"])
 
+        num_requests, failed = 0, set()
         if data and not dry_run:
-            self.get_tracker().update(data)
-        for media_data, last_chapter_num in media_to_sync:
+            num_requests, failed = self.get_tracker().update(data)
+            logging.info("Updated %d entries with %d requests", len(data), num_requests)
+        for media_data, tracking_id, last_chapter_num in media_to_sync:
+            if tracking_id in failed:
+                logging.warning("Failed to update %s", media_data["name"])
+                continue
             media_data["progress"] = last_chapter_num
+        return num_requests
 
     def stats_update(self, username=None, user_id=None):
         data = list(self.get_tracker().get_full_list_data(id=user_id, user_name=username))
@@ -567,14 +659,24 @@ class MediaReader:
         tracker = self.get_tracker()
         data = tracker.get_tracker_list(user_name=user_name) if user_name else tracker.get_tracker_list(id=user_id)
         new_count = 0
+        snapshot = self.state.get_tracker_snapshot(tracker.id, user_name or user_id)
+        tracked_media_index = self.get_tracked_media_index(tracker.id)
 
         unknown_media = []
         tracked_media = []
+        num_unchanged = 0
         for entry in data:
             if media_type and not entry["media_type"] & media_type:
                 logging.debug("Skipping %s", entry)
                 continue
-            media_data_list = self.get_tracked_media(tracker.id, entry["id"])
+            media_data_list = tracked_media_index.get(entry["id"])
+            if media_data_list and not force and entry["updated_at"] is not None and snapshot.get(str(entry["id"])) == entry["updated_at"]:
+                # progress hasn't changed since the last load so only refresh what can change independently of it
+                tracked_media.extend(map(lambda x: x.global_id, media_data_list))
+                for media_data in media_data_list:
+                    media_data["nextTimeStampTracker"] = entry["nextTimeStamp"]
+                num_unchanged += 1
+                continue
             if not media_data_list:
                 if no_add:
                     continue
@@ -582,7 +684,7 @@ class MediaReader:
                 if media_data:
                     self.maybe_resolve_media_type(media_data, media_type_filter=media_type)
                     self.track(media_data, tracker.id, entry["id"], entry["name"])
-                    assert self.get_tracked_media(tracker.id, entry["id"])
+                    tracked_media_index[entry["id"]] = [media_data]
                     new_count += 1
                 else:
                     unknown_media.append(entry["name"])
@@ -596,6 +698,9 @@ class MediaReader:
                 if force or progress > media_data["progress"]:
                     media_data["progress"] = progress
                 media_data["nextTimeStampTracker"] = entry["nextTimeStamp"]
+            if entry["updated_at"] is not None:
+                snapshot[str(entry["id"])] = entry["updated_at"]
+        logging.info("Skipped %d tracker entries that haven't changed since the last load", num_unchanged)
         if unknown_media:
             logging.info("Could not find any of %s", unknown_media)
         if remove:
@@ -636,6 +741,18 @@ class MediaReader:
             if tag_name in media_data["tags"]:
                 media_data["tags"].remove(tag_name)
 
+    def reconcile(self, name=None, checksums=False):
+        """ Rebuilds the download manifests of media from what's on disk; returns the number of chapters whose state changed """
+        changes = 0
+        for media_data in self.get_media(name=name):
+            server = self.get_server(media_data["server_id"])
+            if not server.is_local_server():
+                num_changed = server.reconcile_download_manifest(media_data, checksums=checksums)
+                if num_changed:
+                    logging.info("Reconciled %d chapters of %s", num_changed, media_data["name"])
+                changes += num_changed
+        return changes
+
     def clean(self, remove_disabled_servers=False, include_local_servers=False, remove_read=False, remove_not_on_disk=False, url_cache=False):
         if remove_not_on_disk:
             for media_data in [x for x in self.get_media() if not os.path.exists(self.settings.get_chapter_metadata_file(x))]:
@@ -660,22 +777,30 @@ class MediaReader:
                     if media_path not in media_dirs:
                         logging.info("Removing %s because it has been removed", media_path)
                         shutil.rmtree(media_path)
+                        server.forget_download_manifest(media_path)
                         continue
                     media_data = media_dirs[media_path]
+                    chapter_dir_names = set(os.listdir(media_path))
                     for chapter_data in media_data.get_sorted_chapters():
-                        chapter_path = self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True)
-                        if not os.path.exists(chapter_path):
+                        chapter_dir = os.path.basename(self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True))
+                        if chapter_dir not in chapter_dir_names:
                             continue
+                        chapter_path = os.path.join(media_path, chapter_dir)
                         if remove_read and chapter_data["read"]:
                             logging.info("Removing %s because it has been read", chapter_path)
-                            shutil.rmtree(chapter_path)
+                            server.remove_chapter_download(media_data, chapter_data)
                         elif not server.is_fully_downloaded(media_data, chapter_data):
                             logging.info("Removing %s because it hasn't been fully downloaded", chapter_path)
-                            shutil.rmtree(chapter_path)
+                            server.remove_chapter_download(media_data, chapter_data)
 
-                    chapter_dirs = {self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True): chapter_data for chapter_data in media_data.get_sorted_chapters()}
-                    for chapter_dir in os.listdir(media_path):
+                    chapter_dirs = {os.path.basename(self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True)) for chapter_data in media_data.get_sorted_chapters()}
+                    for chapter_dir in chapter_dir_names - chapter_dirs:
                         chapter_path = os.path.join(media_path, chapter_dir)
-                        if chapter_path not in chapter_dirs and os.path.isdir(chapter_path):
+                        if os.path.isdir(chapter_path):
                             logging.info("Removing %s because chapter info has been removed", chapter_path)
                             shutil.rmtree(chapter_path)
+                    server.get_download_manifest(media_data).prune(media_data["chapters"])
+        if self.settings.page_store:
+            num_removed = PageStore.get(self.settings.get_page_store_dir()).prune()
+            if num_removed:
+                logging.info("Removed %d files from the page store that are no longer used", num_removed)
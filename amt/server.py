@@ -1,18 +1,26 @@
+import copy
+import importlib.util
 import json
 import os
 import re
+import shutil
 import time
 
 from requests.exceptions import ConnectionError, HTTPError, SSLError
 from requests.packages import urllib3
 from threading import Lock
+from urllib.parse import urlparse
 from urllib3.exceptions import InsecureRequestWarning
 import logging
 
 from .job import Job
 from .state import ChapterData, MediaData, TrackerEntry
+from .util.download_manifest import DownloadManifest, get_file_checksum
+from .util.http_stats import http_stats
 from .util.media_type import MediaType
-from .util.name_parser import (find_media_with_similar_name_in_list, get_alt_names)
+from .util.name_parser import (MediaNameIndex, find_media_with_similar_name_in_list, get_alt_names, get_name_tokens)
+from .util.page_store import PageStore
+from .util.profiler import span
 from .util.progress_type import ProgressType
 
 urllib3.disable_warnings(category=InsecureRequestWarning)
@@ -36,8 +44,14 @@ class RequestServer:
     need_cloud_scraper = False
     maybe_need_cloud_scraper = False
     _normal_session = None  # the normal session in case a wrapper is used
+    # domains that needed cloudscraper mapped to when to stop assuming they do; loaded and saved by State
+    cloudscraper_domains = {}
     domain = None
     global_lock = Lock()
+    # shared by all servers; see util.http_stats
+    http_stats = http_stats
+    # resolved on first use when the bs4_parser setting is empty
+    default_bs4_parser = None
 
     def __init__(self, session, settings=None):
         self.settings = settings
@@ -60,6 +74,15 @@ class RequestServer:
             })
         return RequestServer.cloudscraper
 
+    def is_cloudscraper_domain(self, url):
+        return self.cloudscraper_domains.get(urlparse(url).netloc, 0) > time.time()
+
+    def add_cloudscraper_domain(self, url):
+        domain = urlparse(url).netloc
+        if domain and self.settings.get_cloudscraper_domain_ttl_sec(self.id):
+            self.logger.info("Using cloudscraper for %s from now on", domain)
+            self.cloudscraper_domains[domain] = time.time() + self.settings.get_cloudscraper_domain_ttl_sec(self.id)
+
     @classmethod
     def get_instances(clazz, session, settings=None):
         return [clazz(session, settings)]
@@ -74,6 +97,12 @@ class RequestServer:
         value = self.get_backoff(c,r)
         self.logger.info(f"Sleeping for {value} seconds after seeing {c} failures")
         time.sleep(value)
+        return value
+
+    def record_request(self, url, r, latency, stream=False):
+        body = getattr(r.request, "body", None)
+        bytes_in = int(r.headers.get("Content-Length", 0)) if stream else len(r.content or b"")
+        self.http_stats.record_request(self.id, url, r.status_code, latency, bytes_in=bytes_in, bytes_out=len(body) if isinstance(body, (bytes, str)) else 0)
 
     def get_auth_headers(self):
         raise NotImplementedError
@@ -90,20 +119,25 @@ class RequestServer:
         session = self.session
         if not kwargs.get("verify", True):
             session = self._normal_session
-        elif force_cloud_scraper:
+        elif force_cloud_scraper or self.maybe_need_cloud_scraper and self.is_cloudscraper_domain(url):
+            # skip the normal request that is bound to fail if the domain recently needed cloudscraper
+            force_cloud_scraper = True
             session = self.get_cloudscraper_session(self.session)
         max_retries = self.settings.get_max_retries(self.id)
         for i in range(max_retries):
+            attempt_start = time.time()
+            self.http_stats.start_request()
             try:
                 r = session.post(url, **kwargs) if post_request else session.get(url, **kwargs)
-                if r.status_code != 200:
+                self.record_request(url, r, time.time() - attempt_start, stream=kwargs.get("stream", False))
+                if r.status_code not in (200, 206):
                     self.logger.warning("HTTPError: %d; Session class %s; headers %s;", r.status_code, type(session), kwargs.get("headers", {}))
                     self.logger.debug("HTTPError: %d; %s", r.status_code, r.text[:256])
                     if time.time() - start > self.get_backoff(max_retries, r):
                         break
                 if not r.status_code in self.settings.status_to_retry:
                     break
-                self.backoff(i + 1, r)
+                self.http_stats.record_retry(self.id, url, self.backoff(i + 1, r) or 0)
             except SSLError:
                 if self.settings.get_fallback_to_insecure_connection(self.id) and kwargs.get("verify", True):
                     self.logger.warning("Retry request insecurely %s", url)
@@ -114,12 +148,16 @@ class RequestServer:
                 raise
             except ConnectionError as e:
                 self.logger.warning("ConnectionError: %s Session class %s", str(e), type(session))
+                self.http_stats.record_request(self.id, url, "error", time.time() - attempt_start)
                 if i == self.settings.get_max_retries(self.id) - 1:
                     raise
+                self.http_stats.record_retry(self.id, url)
                 continue
         if self.maybe_need_cloud_scraper and not force_cloud_scraper and r.status_code in (403, 503):
             if session == self._normal_session:
-                return self._request(post_request, url, force_cloud_scraper=True, **kwargs)
+                r = self._request(post_request, url, force_cloud_scraper=True, **kwargs)
+                self.add_cloudscraper_domain(url)
+                return r
         r.raise_for_status()
         end = time.time()
 
@@ -158,17 +196,21 @@ class RequestServer:
         file = self.settings.get_web_cache(key)
         with self.global_lock:
             if key in self.mem_cache:
+                self.http_stats.record_cache(self.id, url, hit=True)
                 return self.mem_cache[key]
             if not mem_cache:
                 try:
                     if ttl < 0 or time.time() - os.path.getmtime(file) < ttl * 3600 * 24:
                         with open(file, "r") as f:
                             self.logger.debug("Returning cached value for %s", url)
-                            return json.load(f) if use_json else f.read()
+                            data = json.load(f) if use_json else f.read()
+                        self.http_stats.record_cache(self.id, url, hit=True)
+                        return data
                     else:
                         os.remove(file)
                 except (json.decoder.JSONDecodeError, FileNotFoundError):
                     pass
+        self.http_stats.record_cache(self.id, url, hit=False)
         r = self.session_get(url, **kwargs)
         text = output_format_func(r.text) if output_format_func else r.text
         data = json.loads(text) if use_json else text
@@ -189,8 +231,44 @@ class RequestServer:
     def session_get_cache_json(self, url, **kwargs):
         return self.session_get_cache(url, use_json=True, **kwargs)
 
-    def soupify(self, BeautifulSoup, r):
-        return BeautifulSoup(r if isinstance(r, str) else r.text, self.settings.bs4_parser)
+    def get_all_pages(self, get_page, get_remaining_pages):
+        """ Fetches the first page of a multi-page listing and then the rest concurrently
+        get_page is called with None for the first page and with each key returned by
+        get_remaining_pages(first_page) for the others. The pages are returned in order
+        """
+        first_page = get_page(None)
+        keys = list(get_remaining_pages(first_page))
+        pages = [first_page] + [None] * len(keys)
+
+        def fetch(index):
+            pages[index + 1] = get_page(keys[index])
+        if keys:
+            self.logger.debug("Fetching %d more pages", len(keys))
+            Job(min(self.settings.get_page_fetch_threads(self.id), len(keys)), [lambda i=i: fetch(i) for i in range(len(keys))], raiseException=True).run()
+        return pages
+
+    def get_bs4_parser(self):
+        parser = self.settings.get_bs4_parser(self.id)
+        if not parser:
+            if RequestServer.default_bs4_parser is None:
+                RequestServer.default_bs4_parser = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+            parser = RequestServer.default_bs4_parser
+        return parser
+
+    @staticmethod
+    def class_matcher(*class_names):
+        """
+        Returns a value for SoupStrainer's class_ that matches elements having any of class_names.
+        Unlike find, SoupStrainer may compare against the whole class attribute so a plain string won't match elements with multiple classes
+        """
+        return re.compile(r"(?:^|\s)(?:{})(?:\s|$)".format("|".join(map(re.escape, class_names))))
+
+    def soupify(self, BeautifulSoup, r, parse_only=None):
+        """
+        parse_only is an optional bs4.SoupStrainer; when given only the matching elements (and their children) are
+        parsed into the tree which is considerably faster for large pages where only a single table/list is needed
+        """
+        return BeautifulSoup(r if isinstance(r, str) else r.text, self.get_bs4_parser(), parse_only=parse_only)
 
     def get_extension(self, url, default=None):
         _, ext = os.path.splitext(url.split("?")[0])
@@ -203,7 +281,6 @@ class RequestServer:
 
 class MediaServer(RequestServer):
     remove_lang_regex = re.compile(r" \([^)]*\)")
-    non_word_char_regex = re.compile(r"\W+")
 
     # If true, always just search the literal title instead of also searching subsections
     fuzzy_search = False
@@ -229,8 +306,7 @@ class MediaServer(RequestServer):
         self.update_media_data(media_data, limit=limit)
 
     def score_results(self, term_parts, media_name):
-        media_name = self.remove_lang_regex.sub("", media_name)
-        parts = set(self.non_word_char_regex.split(media_name.lower()))
+        parts = get_name_tokens(self.remove_lang_regex.sub("", media_name))
         return -2 * len(parts.intersection(term_parts)) / (len(parts) + len(term_parts))
 
     def search(self, term, media_type=None, literal=False, limit=20):
@@ -247,9 +323,7 @@ class MediaServer(RequestServer):
                 alt_terms.extend(get_alt_names(name))
         media_list = self.search_helper(alt_terms, limit, media_type=media_type)
 
-        term_parts_arr = []
-        for name in terms:
-            term_parts_arr.append(set(self.non_word_char_regex.split(name.lower())))
+        term_parts_arr = list(map(get_name_tokens, terms))
 
         def score_result(media_name):
             return max((self.score_results(term_parts=term_parts, media_name=media_name) for term_parts in term_parts_arr))
@@ -362,6 +436,11 @@ class GenericServer(MediaServer):
     is_premium = False
     # Used to indicate that the download feature for the server is slow (for testing)
     slow_download = False
+    # If true the id of a page identifies its content so stored copies can be reused instead of downloading it again
+    stable_page_ids = False
+    # If true and the server doesn't have its own search, the full media list is cached and searched locally.
+    # Only for catalogs that are the same for everyone and don't change often
+    cache_catalog = False
 
     def get_media_list(self, limit=None, media_type=None):  # pragma: no cover
         """
@@ -374,7 +453,45 @@ class GenericServer(MediaServer):
         Searches for a media containing term
         Different servers will handle search differently. Some are very literal while others do prefix matching and some would match any word
         """
-        return find_media_with_similar_name_in_list(get_alt_names(term), self.get_media_list())
+        media_list, index = self.get_catalog()
+        # copy the matches so the cached catalog isn't modified by callers
+        return map(copy.deepcopy, find_media_with_similar_name_in_list(get_alt_names(term), media_list, index=index))
+
+    def get_catalog(self):
+        """
+        Returns the full media list of the server along with a MediaNameIndex over it.
+        Both are kept in memory and the media list on disk for catalog_cache_time_sec
+        so repeated searches don't have to refetch the catalog
+        """
+        ttl = self.settings.get_catalog_cache_time_sec(self.id) if self.cache_catalog else 0
+        if not ttl:
+            return list(self.get_media_list()), None
+        catalog = getattr(self, "_catalog", None)
+        if catalog and time.time() - catalog[0] < ttl:
+            return catalog[1:]
+        file = self.settings.get_catalog_cache_file(self.id)
+        try:
+            with open(file, "r") as f:
+                data = json.load(f)
+            if time.time() - data["time"] >= ttl:
+                raise ValueError("Catalog expired")
+            timestamp, media_list = data["time"], list(map(MediaData, data["media"]))
+            self.logger.debug("Loaded catalog of %d media from disk", len(media_list))
+        except (FileNotFoundError, KeyError, ValueError):
+            timestamp, media_list = time.time(), list(self.get_media_list())
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(file, "w") as f:
+                json.dump({"time": timestamp, "media": media_list}, f)
+        self._catalog = (timestamp, media_list, MediaNameIndex(tuple((media_data["name"], media_data["season_title"]) for media_data in media_list)))
+        return self._catalog[1:]
+
+    def clear_catalog(self):
+        """ Drops the cached catalog so the next search refetches it """
+        self._catalog = None
+        try:
+            os.remove(self.settings.get_catalog_cache_file(self.id))
+        except FileNotFoundError:
+            pass
 
     @property
     def fuzzy_search(self):
@@ -422,19 +539,58 @@ class GenericServer(MediaServer):
     def save_chapter_page(self, page_data, path):
         """ Save the page designated by page_data to path
         By default it blindly writes the specified url to disk, decrypting it
-        if needed.
+        if needed. Unencrypted pages are streamed to disk and, if path already
+        holds the start of the page, resumed with a Range request
         """
+        key = page_data["encryption_key"]
+        if not key:
+            return self.save_chapter_page_resumable(page_data, path)
         r = self.session_get(page_data["url"], headers=page_data["headers"], stream=page_data["stream"])
         content = r.content
-        key = page_data["encryption_key"]
-        if key:
-            from Crypto.Cipher import AES
-            key_bytes = self.session_get(key.uri, headers=page_data["headers"]).content
-            iv = int(key.iv, 16).to_bytes(16, "big") if key.iv else None
-            content = AES.new(key_bytes, AES.MODE_CBC, iv).decrypt(content)
+        from Crypto.Cipher import AES
+        key_bytes = self.session_get(key.uri, headers=page_data["headers"]).content
+        iv = int(key.iv, 16).to_bytes(16, "big") if key.iv else None
+        content = AES.new(key_bytes, AES.MODE_CBC, iv).decrypt(content)
         with open(path, 'wb') as fp:
             fp.write(content)
 
+    def save_chapter_page_resumable(self, page_data, path, retry=True):
+        """
+        Streams the page to path. If path is the start of the same page, as told by the ETag and length
+        recorded in page_data on the first attempt, only the rest of it is requested
+        """
+        offset = os.path.getsize(path) if os.path.exists(path) and page_data.get("resumable") else 0
+        if offset and offset == page_data.get("length"):
+            return
+        headers = dict(page_data["headers"])
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if page_data.get("etag"):
+                headers["If-Range"] = page_data["etag"]
+        r = self.session_get(page_data["url"], headers=headers, stream=True)
+        if r.status_code == 206:
+            total = r.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+            if not offset or total != str(page_data.get("length")):
+                r.close()
+                if not retry:
+                    raise HTTPError(f"Unexpected partial content for {page_data['url']}", response=r)
+                self.logger.info("Page %s changed since it was partially downloaded; starting over", page_data["url"])
+                # request the whole page again
+                page_data["resumable"] = False
+                open(path, "wb").close()
+                return self.save_chapter_page_resumable(page_data, path, retry=False)
+            self.logger.info("Resuming download of %s at byte %d", page_data["url"], offset)
+        else:
+            etag = r.headers.get("ETag")
+            length = r.headers.get("Content-Length")
+            # ranges index the encoded body so pages decoded on the fly can't be resumed
+            page_data["resumable"] = r.headers.get("Accept-Ranges") == "bytes" and bool(length) and r.headers.get("Content-Encoding", "identity") == "identity"
+            page_data["etag"] = etag if etag and not etag.startswith("W/") else None
+            page_data["length"] = int(length) if length else None
+        with open(path, "ab" if r.status_code == 206 else "wb") as fp:
+            for chunk in r.iter_content(1 << 16):
+                fp.write(chunk)
+
     def _get_media_id_from_url(self, url):
         """ Helper method to get the media_id from the url
         This method should be treated as "protected" and not called by outside classes
@@ -586,8 +742,16 @@ class Server(GenericServer):
     """
 
     _is_logged_in = False
+    # written to the dir of each downloaded chapter for older versions and other tools that predate the
+    # download manifest; only looked for when rebuilding the manifest
     DOWNLOAD_MARKER = ".downloaded"
 
+    def __init__(self, session, settings=None):
+        super().__init__(session, settings)
+        # keyed by media dir; see get_download_manifest
+        self._download_manifests = {}
+        self._download_manifests_lock = Lock()
+
     @property
     def is_logged_in(self):
         return self._is_logged_in
@@ -620,30 +784,154 @@ class Server(GenericServer):
             self.logger.warning("Could not login with username: %s", username)
         else:
             self.logger.info("Logged into %s; premium %s", self.id, self.is_premium)
+            # what's listed can depend on the account
+            self.clear_catalog()
         return self._is_logged_in
 
-    def get_download_marker(self, media_data, chapter_data):
-        dir_path = self.settings.get_chapter_dir(media_data, chapter_data)
-        return os.path.join(dir_path, self.DOWNLOAD_MARKER)
+    def get_download_manifest(self, media_data):
+        """ Returns the cached manifest of media_data, building it from what's on disk if it hasn't been saved before """
+        media_dir = self.settings.get_media_dir(media_data)
+        with self._download_manifests_lock:
+            manifest = self._download_manifests.get(media_dir)
+            if not manifest:
+                manifest = self._download_manifests[media_dir] = DownloadManifest(self.settings.get_download_manifest_file(media_data))
+                if not manifest.exists and not self.is_local_server():
+                    self.reconcile_download_manifest(media_data, manifest)
+        return manifest
+
+    def forget_download_manifest(self, media_dir):
+        """ Drops the cached manifest of the media in media_dir; needed if the dir is deleted """
+        with self._download_manifests_lock:
+            self._download_manifests.pop(media_dir, None)
+
+    def reconcile_download_manifest(self, media_data, manifest=None, checksums=False):
+        """
+        Rebuilds the download manifest of media_data from the chapter dirs on disk.
+        A chapter is complete if all the files recorded for it are still there or, for chapters without a record (like
+        those downloaded before there was a manifest), if its dir has a download marker. Missing checksums are computed if checksums is set.
+        Returns the number of chapters whose recorded state changed
+        """
+        manifest = manifest or self.get_download_manifest(media_data)
+        media_dir = self.settings.get_media_dir(media_data)
+        dir_names = set(os.listdir(media_dir)) if os.path.isdir(media_dir) else set()
+        changes = 0
+        for chapter_data in media_data["chapters"].values():
+            dir_name = os.path.basename(self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True))
+            entry = manifest.get_entry(chapter_data["id"])
+            was_complete = manifest.is_complete(chapter_data["id"], dir_name)
+            if dir_name not in dir_names:
+                if entry:
+                    manifest.remove(chapter_data["id"], save=False)
+                changes += was_complete
+                continue
+            chapter_dir = os.path.join(media_dir, dir_name)
+            names = os.listdir(chapter_dir)
+            sizes = {name: os.path.getsize(os.path.join(chapter_dir, name)) for name in names if name[0] != "."}
+            if was_complete:
+                complete = all(sizes.get(name) == info["size"] for name, info in entry["files"].items())
+            else:
+                complete = self.DOWNLOAD_MARKER in names
+            if complete:
+                recorded = entry["files"] if was_complete else {}
+                files = {name: {"size": size, "sha256": recorded[name]["sha256"] if name in recorded and recorded[name]["size"] == size else None} for name, size in sizes.items()}
+                if checksums:
+                    for name, info in files.items():
+                        if not info["sha256"]:
+                            info["sha256"] = get_file_checksum(os.path.join(chapter_dir, name))
+                manifest.set_complete(chapter_data["id"], dir_name, files, mtime=os.stat(chapter_dir).st_mtime_ns, save=False)
+            elif was_complete:
+                manifest.remove(chapter_data["id"], save=False)
+                self.remove_download_marker(media_data, chapter_data)
+            changes += complete != was_complete
+        # saved even if empty so the dirs aren't scanned again
+        manifest.save(force=bool(dir_names))
+        return changes
 
     def is_fully_downloaded(self, media_data, chapter_data):
-        return os.path.exists(self.get_download_marker(media_data, chapter_data))
+        """
+        True if the manifest says the chapter was downloaded and its dir hasn't changed since. If the dir was removed
+        or files were added to or removed from it outside of amt, the chapter is forgotten so it is downloaded again
+        """
+        dir_path = self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True)
+        manifest = self.get_download_manifest(media_data)
+        if not manifest.is_complete(chapter_data["id"], os.path.basename(dir_path)):
+            return False
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        recorded_mtime = manifest.get_entry(chapter_data["id"]).get("mtime")
+        if mtime is None or recorded_mtime is not None and recorded_mtime != mtime:
+            self.logger.info("%s was changed outside of amt; it will be downloaded again", dir_path)
+            manifest.remove(chapter_data["id"])
+            self.remove_download_marker(media_data, chapter_data)
+            return False
+        return True
+
+    def get_download_marker(self, media_data, chapter_data):
+        return os.path.join(self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True), self.DOWNLOAD_MARKER)
+
+    def remove_download_marker(self, media_data, chapter_data):
+        """ Removes the marker of a chapter that is no longer fully downloaded so it isn't trusted when rebuilding the manifest """
+        try:
+            os.remove(self.get_download_marker(media_data, chapter_data))
+        except FileNotFoundError:
+            pass
+
+    def get_page_store(self, media_data):
+        return PageStore.get(self.settings.get_page_store_dir()) if self.settings.get_page_store(media_data) else None
 
     def mark_download_complete(self, media_data, chapter_data):
-        open(self.get_download_marker(media_data, chapter_data), 'w').close()
+        dir_path = self.settings.get_chapter_dir(media_data, chapter_data)
+        manifest = self.get_download_manifest(media_data)
+        store = self.get_page_store(media_data)
+        checksums = self.settings.get_download_checksums(media_data) or store
+        entry = manifest.get_entry(chapter_data["id"])
+        page_ids = {os.path.basename(page_data["path"]): page_data["id"] for page_data in entry and entry.get("pages") or [] if page_data.get("id") is not None} if self.stable_page_ids else {}
+        files = {}
+        for name in os.listdir(dir_path):
+            if name[0] != ".":
+                path = os.path.join(dir_path, name)
+                checksum = get_file_checksum(path) if checksums else None
+                if store:
+                    store.add(path, checksum)
+                    if name in page_ids:
+                        store.set_id_checksum(self.id, page_ids[name], checksum)
+                files[name] = {"size": os.path.getsize(path), "sha256": checksum}
+        if store:
+            store.save()
+        open(os.path.join(dir_path, self.DOWNLOAD_MARKER), "w").close()
+        manifest.set_complete(chapter_data["id"], os.path.basename(dir_path), files, mtime=os.stat(dir_path).st_mtime_ns)
+
+    def remove_chapter_download(self, media_data, chapter_data):
+        shutil.rmtree(self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True), ignore_errors=True)
+        self.get_download_manifest(media_data).remove(chapter_data["id"])
 
     def download_if_missing(self, page_data, full_path):
         if os.path.exists(full_path):
             self.logger.debug("Page %s already download", full_path)
+        elif self.link_stored_page(page_data, full_path):
+            self.logger.info("Linked stored copy of %s", full_path)
         else:
             self.logger.info("downloading %s", full_path)
             temp_path = os.path.join(os.path.dirname(full_path), ".tmp-" + os.path.basename(full_path))
             self.save_chapter_page(page_data, temp_path)
             os.rename(temp_path, full_path)
 
+    def link_stored_page(self, page_data, full_path):
+        """ Hard links the stored copy of the page, if there is one, to full_path and returns True on success """
+        if not self.stable_page_ids or page_data.get("id") is None or not self.settings.get_page_store(self.id):
+            return False
+        store = PageStore.get(self.settings.get_page_store_dir())
+        checksum = store.get_id_checksum(self.id, page_data["id"])
+        return bool(checksum) and store.link(checksum, full_path)
+
     def get_children(self, media_data, chapter_data):
         dir_path = self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True)
-        return sorted(map(lambda x: os.path.join(dir_path, x), filter(lambda x: x[0] != ".", os.listdir(dir_path))))
+        names = self.get_download_manifest(media_data).get_files(chapter_data["id"], os.path.basename(dir_path)) if self.is_fully_downloaded(media_data, chapter_data) else None
+        if names is None:
+            names = sorted(filter(lambda x: x[0] != ".", os.listdir(dir_path)))
+        return [os.path.join(dir_path, name) for name in names]
 
     def relogin_on_error(self, func):
         try:
@@ -686,13 +974,14 @@ class Server(GenericServer):
 
         dir_path = self.settings.get_chapter_dir(media_data, chapter_data)
         os.makedirs(dir_path, exist_ok=True)
-        with self._lock:
-            self.logger.info("Starting download of %s %s", media_data["name"], chapter_data["title"])
-            self.pre_download(media_data, chapter_data)
-            page_paths = self.download_pages(media_data, chapter_data, **kwargs)
-            self.post_download(media_data, chapter_data, page_paths=page_paths)
+        with span("download_chapter", "{} {}".format(media_data.global_id, chapter_data["number"])):
+            with self._lock:
+                self.logger.info("Starting download of %s %s", media_data["name"], chapter_data["title"])
+                self.pre_download(media_data, chapter_data)
+                page_paths = self.download_pages(media_data, chapter_data, **kwargs)
+                self.post_download(media_data, chapter_data, page_paths=page_paths)
 
-        self.settings.post_process(media_data, page_paths, self.settings.get_media_dir(media_data))
+            self.settings.post_process(media_data, page_paths, self.settings.get_media_dir(media_data))
 
         self.mark_download_complete(media_data, chapter_data)
         self.logger.info("%s %d %s is downloaded; Total pages %d", media_data["name"], chapter_data["number"], chapter_data["title"], len(page_paths))
@@ -700,18 +989,50 @@ class Server(GenericServer):
         return True
 
     def download_pages(self, media_data, chapter_data, page_limit=None, offset=0, stream_index=0):
+        manifest = self.get_download_manifest(media_data)
+        dir_name = os.path.basename(self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True))
+        pages = manifest.get_pages(chapter_data["id"], dir_name, stream_index)
+        if pages:
+            self.logger.info("Resuming download of %s %s", media_data["name"], chapter_data["title"])
+            try:
+                return self._download_pages(media_data, chapter_data, pages, manifest, page_limit=page_limit, offset=offset)
+            except HTTPError as e:
+                # page urls can expire
+                self.logger.info("Listing pages of %s %s again after %s", media_data["name"], chapter_data["title"], e)
+                manifest.remove(chapter_data["id"])
+
+        pages = self.get_media_chapter_data(media_data, chapter_data, stream_index=stream_index)
+        if page_limit is None:
+            pages = list(pages)
+            if not manifest.set_pages(chapter_data["id"], dir_name, pages, stream_index):
+                manifest = None
+        else:
+            manifest = None
+        return self._download_pages(media_data, chapter_data, pages, manifest, page_limit=page_limit, offset=offset)
+
+    def _download_pages(self, media_data, chapter_data, pages, manifest, page_limit=None, offset=0):
         list_of_pages = []
         dir_path = self.settings.get_chapter_dir(media_data, chapter_data)
         # download pages
         job = Job(self.settings.get_threads(media_data), raiseException=True)
-        for i, page_data in enumerate(self.get_media_chapter_data(media_data, chapter_data, stream_index=stream_index)):
+        for i, page_data in enumerate(pages):
             if page_limit is not None and i == page_limit:
                 break
             if i >= offset:
                 list_of_pages.append(page_data)
                 page_data["path"] = os.path.join(dir_path, self.settings.get_page_file_name(media_data, chapter_data, ext=page_data["ext"], page_number=i))
+                if manifest:
+                    # download threads only change the values of these so the manifest can be saved while they run
+                    for key in ("resumable", "etag", "length"):
+                        page_data.setdefault(key, None)
                 job.add(lambda page_data=page_data: self.download_if_missing(page_data, page_data["path"]))
-        job.run()
+        try:
+            job.run()
+        except BaseException:
+            # keep what's needed to resume partially downloaded pages
+            if manifest:
+                manifest.save()
+            raise
         assert list_of_pages
         return [page_data["path"] for page_data in list_of_pages]
 
@@ -734,7 +1055,7 @@ class Tracker(RequestServer):
     official = True
     alias = None
 
-    def get_media_dict(self, id, media_type, names, progress, progress_volumes=None, score=0, nextTimeStamp=None, time_spent=0, year=0, year_end=0, season=None, genres=tuple(), tags=tuple(), studio=tuple(), external_links=tuple(), streaming_links=tuple()):
+    def get_media_dict(self, id, media_type, names, progress, progress_volumes=None, score=0, nextTimeStamp=None, time_spent=0, year=0, year_end=0, season=None, genres=tuple(), tags=tuple(), studio=tuple(), external_links=tuple(), streaming_links=tuple(), updated_at=None):
         m = TrackerEntry(locals())
         del m["self"]
         return m
@@ -747,15 +1068,17 @@ class Tracker(RequestServer):
         """ Updates progress to remote tracker
         list_of_updates is a list of tuples -- tracker_id, progress, progress_volumes
         where progress is the numerical value to update to and progress_volumes is
-        whether to treat this a chapter/episode progress or volume progress
+        whether to treat this a chapter/episode progress or volume progress.
+        Returns the number of requests made and the tracker ids that failed to update
         """
         raise NotImplementedError
 
     def get_full_list_data(self, user_name=None, id=None):
-        return self.get_tracker_list(user_name, id, status=None)
+        return self.get_tracker_list(user_name, id, status=None, full=True)
 
-    def get_tracker_list(self, user_name=None, id=None, status="CURRENT"):  # pragma: no cover
+    def get_tracker_list(self, user_name=None, id=None, status="CURRENT", full=False):  # pragma: no cover
         """ Returns a list of media dicts
-        See get_media_dict
+        See get_media_dict. Fields only used for stats (score, year, genres etc)
+        may be left as their defaults unless full is set
         """
         raise NotImplementedError
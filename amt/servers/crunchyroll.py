@@ -3,6 +3,7 @@ import json
 import re
 
 from ..server import Server
+from ..util.decryption import xor_bytes
 from ..util.media_type import MediaType
 from threading import RLock
 
@@ -129,7 +130,7 @@ class Crunchyroll(GenericCrunchyrollServer):
     @staticmethod
     def decode_image(buffer):
         # Don't know why 66 is special
-        return bytes(b ^ 66 for b in buffer)
+        return xor_bytes(buffer, [66])
 
     def get_media_list(self, **kwargs):
         media_data_map = {}
@@ -8,6 +8,7 @@ from ..server import Server
 
 class Dbmultiverse(Server):
     id = "dbmultiverse"
+    cache_catalog = True
 
     domain = "dragonball-multiverse.com"
     base_url = "https://www.dragonball-multiverse.com"
@@ -47,13 +47,17 @@ class Freewebnovel(Server):
             self.update_chapter_data(media_data, chapter_id, title, number)
 
     def update_media_data(self, media_data, limit=None, **kwargs):
-        r = self.session_get(self.chapters_url.format(media_data["id"]))
-        soup = self.soupify(BeautifulSoup, r)
-        relative_paths = soup.find("select", {"id": "indexselect"}).findAll("option")[:limit]
-        self._update_media_data(media_data, soup)
-        for relative_path in map(lambda x: x["value"], relative_paths[1:]):
-            r = self.session_get_cache(self.base_url + relative_path, ttl=30, skip_cache=relative_path == relative_paths[-1])
-            soup = self.soupify(BeautifulSoup, r)
+        def get_page(relative_path):
+            if relative_path is None:
+                return self.soupify(BeautifulSoup, self.session_get(self.chapters_url.format(media_data["id"])))
+            return self.soupify(BeautifulSoup, self.session_get_cache(self.base_url + relative_path, ttl=30, skip_cache=relative_path == relative_paths[-1]))
+
+        def get_remaining_pages(soup):
+            relative_paths.extend(option["value"] for option in soup.find("select", {"id": "indexselect"}).findAll("option")[:limit])
+            return relative_paths[1:]
+
+        relative_paths = []
+        for soup in self.get_all_pages(get_page, get_remaining_pages):
             self._update_media_data(media_data, soup)
 
     def get_media_chapter_data(self, media_data, chapter_data, **kwargs):
@@ -1,6 +1,6 @@
 import re
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from requests.exceptions import JSONDecodeError
 
 from ..server import Server
@@ -29,7 +29,7 @@ class GenericFunimation(Server):
 
     def _get_csrf(self):
         r = self.session_get(self.login_url)
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("input", attrs={"name": self.CSRF_NAME}))
         return soup.find("input", {"name": self.CSRF_NAME})["value"]
 
     def needs_authentication(self):
@@ -84,7 +84,7 @@ class GenericFunimation(Server):
                 r.raise_for_status()
         except JSONDecodeError:
             pass
-        super().backoff(c, r)
+        return super().backoff(c, r)
 
 
 class Funimation(GenericFunimation):
@@ -112,20 +112,19 @@ class Funimation(GenericFunimation):
         return media_data
 
     def get_media_list(self, limit=2, **kwargs):
-        soup = self.soupify(BeautifulSoup, self.session_get(self.list_url))
+        soup = self.soupify(BeautifulSoup, self.session_get(self.list_url), parse_only=SoupStrainer("div", class_=self.class_matcher("slide")))
         ids = []
         for item in soup.findAll("div", {"class": "slide"})[:limit]:
             ids.append(item["data-id"])
         return self._get_media_list(ids, limit=limit)
 
     def search_for_media(self, term, alt_id=None, limit=2, **kwargs):
-        soup = self.soupify(BeautifulSoup, self.session_get(self.search_url.format(str(1), term)))
         show_url_regex = re.compile("/shows/([^/]*)/")
 
         chapter_ids = []
         for i in range(1, 10):
             starting_len = len(chapter_ids)
-            soup = self.soupify(BeautifulSoup, self.session_get(self.search_url.format(str(i), term)))
+            soup = self.soupify(BeautifulSoup, self.session_get(self.search_url.format(str(i), term)), parse_only=SoupStrainer("div", class_=self.class_matcher("product-results")))
             for div in soup.findAll("div", {"class": "product-results"}):
                 title_id = div["data-id"]
                 item = div.find("a", {"class": "show-title"})
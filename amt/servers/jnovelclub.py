@@ -1,6 +1,5 @@
 import os
 import re
-import shutil
 import time
 
 from datetime import datetime
@@ -140,7 +139,7 @@ class JNovelClubParts(GenericJNovelClub):
         for chapter_data in media_data["chapters"].values():
             chapter_path = self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True)
             if (not last_chapter or last_chapter["volume_number"] % 1 == 0 or last_chapter["volume_number"] != chapter_data["volume_number"]) and os.path.exists(chapter_path) and (time.time() - os.path.getmtime(chapter_path)) >= self.time_to_live_sec:
-                shutil.rmtree(chapter_path)
+                self.remove_chapter_download(media_data, chapter_data)
         volumes = r.json()["volumes"]
         for i, volume in enumerate(volumes):
             part_data = self.session_get_cache_json(self.parts_url.format(volume["slug"]), skip_cache=i == len(volumes) - 1, ttl=-1)
@@ -210,7 +209,7 @@ class JNovelClubParts(GenericJNovelClub):
     def save_chapter_page_manga(self, page_data, path):
         r = self.session_get(page_data["url"], stream=True)
         max_iterations = 300 if not page_data.get("retry", False) else None
-        success = GenericDecoder.descramble_and_save_img(r.raw, path, key=page_data["encryption_key"], max_iters=max_iterations)
+        success = GenericDecoder.descramble_and_save_img(r.raw, path, key=page_data["encryption_key"], max_iters=max_iterations, processes=self.settings.decoder_processes, cache_file=self.settings.get_decoder_cache_file())
         if not success:
             page_data["retry"] = True
             self.logger.debug("Failed to descramble %s", page_data["url"])
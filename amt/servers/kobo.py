@@ -4,13 +4,15 @@ import hashlib
 import re
 
 from ..server import Server
+from ..util.decryption import CHUNK_SIZE, decrypt_stream
 from ..util.media_type import MediaType
 from ..util.name_parser import get_media_name_from_volume_name, get_number_from_file_name
 
 from Crypto.Cipher import AES
-from Crypto.Util import Padding
 from requests.exceptions import HTTPError
 
+COMPRESSED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
 
 def decrypt_key(key, encoded_content_key):
     keyAes = AES.new(key, AES.MODE_ECB)
@@ -140,18 +142,30 @@ class Kobo(Server):
         return [self.create_page_data(url=url, encryption_key=keys)]
 
     def save_chapter_page(self, page_data, path):
-        r = self.session_get(page_data["url"], headers=page_data["headers"])
+        r = self.session_get(page_data["url"], headers=page_data["headers"], stream=True)
         keys = page_data["encryption_key"]
-        from io import BytesIO
+        import shutil
+        import tempfile
         import zipfile
-        with zipfile.ZipFile(BytesIO(r.content), "r") as inputZip, zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as outputZip:
-            for filename in inputZip.namelist():
-                zipped_file = inputZip.read(filename)
-                content_key = keys.get(filename)
-                if content_key is not None:
-                    contentAes = AES.new(content_key, AES.MODE_ECB)
-                    zipped_file = Padding.unpad(contentAes.decrypt(zipped_file), AES.block_size, "pkcs7")
-                outputZip.writestr(filename, zipped_file)
+        with tempfile.TemporaryFile() as fp:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                fp.write(chunk)
+            with zipfile.ZipFile(fp, "r") as inputZip, zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as outputZip:
+                for info in inputZip.infolist():
+                    if info.is_dir():
+                        outputZip.writestr(info.filename, b"")
+                        continue
+                    # Images are already compressed so deflating them again just costs time
+                    compress_type = zipfile.ZIP_STORED if info.compress_type == zipfile.ZIP_STORED or info.filename.lower().endswith(COMPRESSED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+                    output_info = zipfile.ZipInfo(info.filename, info.date_time)
+                    output_info.compress_type = compress_type
+                    with inputZip.open(info) as src, outputZip.open(output_info, "w") as dest:
+                        content_key = keys.get(info.filename)
+                        if content_key is not None:
+                            for chunk in decrypt_stream(src, AES.new(content_key, AES.MODE_ECB), AES.block_size):
+                                dest.write(chunk)
+                        else:
+                            shutil.copyfileobj(src, dest, CHUNK_SIZE)
 
     def get_chapter_id_for_url(self, url):
         return self.stream_url_regex.search(url).group(1)
@@ -1,4 +1,8 @@
+import math
 import re
+import time
+
+from collections import Counter
 
 from ..server import Server
 
@@ -14,16 +18,20 @@ class Mangadex(Server):
 
     api_base_url = "https://api.mangadex.org"
     domain = "mangadex.org"
+    stable_page_ids = True
 
     list_url = api_base_url + "/manga?limit={limit}&offset={offset}"
     search_url = api_base_url + "/manga?title={title}&limit={limit}&offset={offset}"
-    manga_chapters_url = api_base_url + "/chapter?manga={}&limit=100&offset={}"
+    manga_chapters_url = api_base_url + "/chapter?manga={id}&translatedLanguage[]={lang}&order[updatedAt]=asc&limit=100&offset={offset}"
     server_url = api_base_url + "/at-home/server/{}"
     chapter_url = api_base_url + "/chapter/{}"
 
     manga_url = api_base_url + "/manga/{}"
     stream_url_regex = re.compile(r"mangadex.org/chapter/([^/]*)")
 
+    # number of full/incremental chapter feed updates and the requests they made or saved
+    feed_stats = Counter()
+
     def _get_media_list(self, data, target_lang=None):
         results = []
         for result in data:
@@ -34,14 +42,16 @@ class Mangadex(Server):
         return results
 
     def _list_or_search_get_media_list(self, url, limit=100):
-        offset = 0
-        while True:
-            r = self.session_get(url.format(limit=min(limit or 100, 100), offset=offset))
-            data = r.json()
+        page_limit = min(limit or 100, 100)
+
+        def get_page(offset):
+            return self.session_get(url.format(limit=page_limit, offset=offset or 0)).json()
+
+        def get_remaining_pages(data):
+            return (offset for offset in range(data["limit"], data["total"], data["limit"]) if not limit or offset <= limit)
+
+        for data in self.get_all_pages(get_page, get_remaining_pages):
             yield from self._get_media_list(data["data"])
-            offset += data["limit"]
-            if offset >= data["total"] or (limit and offset > limit):
-                break
 
     def get_media_list(self, limit=100, **kwargs):
         yield from self._list_or_search_get_media_list(self.list_url, limit)
@@ -63,20 +73,37 @@ class Mangadex(Server):
         return self.stream_url_regex.search(url).group(1)
 
     def update_media_data(self, media_data, **kwargs):
-
-        offset = 0
-        while True:
-            r = self.session_get(self.manga_chapters_url.format(media_data["id"], offset))
-            data = r.json()
-
+        """ Fetches the chapters updated since the last update; everything is refetched periodically
+        to pick up removed chapters and anything the cursor missed
+        """
+        cursor = media_data.get("feed_cursor")
+        full_sync = not cursor or time.time() - media_data.get("last_full_sync", 0) > self.settings.get_full_chapter_sync_interval_sec(media_data)
+        url = self.manga_chapters_url.format_map(SafeDict(id=media_data["id"], lang=media_data["lang"]))
+        if not full_sync:
+            url += "&updatedAtSince=" + cursor[:19]
+            # chapters that weren't returned are unchanged so don't let them be treated as removed
+            for chapter_data in media_data["chapters"].values():
+                chapter_data.update_state = True
+
+        pages = self.get_all_pages(lambda offset: self.session_get(url.format(offset=offset or 0)).json(), lambda data: range(data["limit"], data["total"], data["limit"]))
+        for data in pages:
             for chapter_data in sorted(data["data"], key=lambda x: x["attributes"]["publishAt"], reverse=True):
                 attr = chapter_data["attributes"]
+                cursor = max(cursor or "", attr["updatedAt"])
                 if attr["translatedLanguage"] == media_data["lang"]:
                     if attr["pages"]:
                         self.update_chapter_data(media_data, id=chapter_data["id"], number=attr["chapter"], title=attr["title"], volume_number=attr.get("volume"))
-            offset += data["limit"]
-            if offset > data["total"]:
-                break
+        media_data["feed_cursor"] = cursor
+        if full_sync:
+            media_data["last_full_sync"] = time.time()
+            self.feed_stats["full"] += 1
+        else:
+            # a full sync would need at least a request per 100 known chapters
+            saved = max(math.ceil(len(media_data["chapters"]) / 100), 1) - len(pages)
+            self.feed_stats["incremental"] += 1
+            self.feed_stats["requests_saved"] += max(saved, 0)
+            self.logger.info("Incrementally updated %s with %d requests; saved ~%d", media_data["name"], len(pages), saved)
+        self.feed_stats["requests"] += len(pages)
 
     def get_media_chapter_data(self, media_data, chapter_data, stream_index=0):
         r = self.session_get(self.server_url.format(chapter_data["id"]))
@@ -85,4 +112,5 @@ class Mangadex(Server):
         formats = ["data", "dataSaver"][stream_index]
         pages = data["chapter"][formats]
         base_url = r.json()["baseUrl"]
-        return [self.create_page_data(url="{}/data/{}/{}".format(base_url, h, page)) for page in pages]
+        # the base url changes between requests but the rest of the path is the same for the same image
+        return [self.create_page_data(url="{}/data/{}/{}".format(base_url, h, page), id="{}/{}".format(h, page)) for page in pages]
@@ -1,12 +1,14 @@
 import re
 
 from ..server import Server
+from ..util.decryption import CHUNK_SIZE, xor_stream
 
 RE_ENCRYPTION_KEY = re.compile(".{1,2}")
 
 
 class Mangaplus(Server):
     id = "mangaplus"
+    cache_catalog = True
 
     domain = "mangaplus.shueisha.co.jp"
     base_url = f"https://{domain}"
@@ -50,15 +52,13 @@ class Mangaplus(Server):
         return [self.create_page_data(url=page["mangaPage"]["imageUrl"], encryption_key=page["mangaPage"].get("encryptionKey")) for page in r.json()["success"]["mangaViewer"]["pages"] if "mangaPage" in page]
 
     def save_chapter_page(self, page_data, path):
-        r = self.session_get(page_data["url"])
+        r = self.session_get(page_data["url"], stream=True)
 
-        content = r.content
+        content = r.iter_content(chunk_size=CHUNK_SIZE)
         if page_data["encryption_key"] is not None:
-            # Decryption
-            key_stream = [int(v, 16) for v in RE_ENCRYPTION_KEY.findall(page_data["encryption_key"])]
-            block_size_in_bytes = len(key_stream)
-
-            content = bytes([int(v) ^ key_stream[index % block_size_in_bytes] for index, v in enumerate(r.content)])
+            key_stream = bytes(int(v, 16) for v in RE_ENCRYPTION_KEY.findall(page_data["encryption_key"]))
+            content = xor_stream(content, key_stream)
 
         with open(path, "wb") as fp:
-            fp.write(content)
+            for chunk in content:
+                fp.write(chunk)
@@ -9,6 +9,7 @@ class Mangasee(Server):
     id = "mangasee"
     official = False
     need_cloud_scraper = True
+    cache_catalog = True
 
     domain = "mangasee123.com"
     base_url = f"https://{domain}"
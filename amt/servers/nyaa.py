@@ -1,4 +1,4 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import re
 
 from ..util.media_type import MediaType
@@ -42,7 +42,7 @@ class Nyaa(GenericTorrentServer):
         if not url:
             url = self.search_url.format(media_type_to_category(media_type), term)
         r = self.session_get_cache(url)
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("table", class_=self.class_matcher("torrent-list")))
         table = soup.find("table", {"class": "torrent-list"})
         row_num_to_media_type = {}
         for row_num, row, link in ((row_num, row, link) for row_num, row in enumerate(table.findAll("tr")) for link in row.findAll("a")) if table else []:
@@ -64,7 +64,7 @@ class Nyaa(GenericTorrentServer):
     def get_media_data_from_url(self, url):
         slug = self.stream_url_regex.search(url).group(1)
         r = self.session_get(url)
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer(["h3", "a"]))
         title = soup.find("h3", class_="panel-title").getText().strip()
         for link in soup.findAll("a"):
             if link["href"].startswith("/?c="):
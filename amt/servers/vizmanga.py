@@ -2,7 +2,7 @@ import re
 import time
 
 from PIL import Image
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from datetime import datetime, timedelta
 
 from ..server import Server
@@ -31,7 +31,7 @@ class GenericVizManga(Server):
 
     def needs_authentication(self):
         r = self.session_get(self.refresh_login_url)
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("div", id="o_account-links-content"))
         account = soup.find("div", id="o_account-links-content")
         match = self.wsj_subscriber_regex.search(r.text)
         self.is_premium = match and match.group(1) == "true" if self.has_free_chapters else True
@@ -135,6 +135,7 @@ class GenericVizManga(Server):
 
 class VizManga(GenericVizManga):
     id = "vizmanga"
+    cache_catalog = True
 
     base_url = "http://www.viz.com"
     api_series_url = base_url + "/shonenjump"
@@ -174,7 +175,7 @@ class VizManga(GenericVizManga):
     def get_media_list(self, **kwargs):
         r = self.session_get(self.api_series_url)
 
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("a", class_=self.class_matcher("o_chapters-link")))
         divs = soup.findAll("a", {"class": "o_chapters-link"})
         for div in divs:
             id = div["href"].split("/")[-1]
@@ -183,7 +184,7 @@ class VizManga(GenericVizManga):
 
     def update_media_data(self, media_data, **kwargs):
         r = self.session_get(self.api_chapters_url.format(media_data["id"]))
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer(class_=self.class_matcher("o_chapter-container", "section_future_chapter")))
 
         # Chapters
         chapters = soup.findAll("a", {"class": "o_chapter-container"})
@@ -254,7 +255,7 @@ class VizMangaLibrary(GenericVizManga):
 
     def get_media_list(self, **kwargs):
         r = self.session_get(self.list_series_url)
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("table", class_=self.class_matcher("purchase-table", "product-table")))
         table = soup.find("table", {"class": "purchase-table"})
         if table:
             for link in table.findAll("a"):
@@ -273,7 +274,7 @@ class VizMangaLibrary(GenericVizManga):
 
     def _update_media_data(self, url, media_id=None):
         r = self.session_get(url)
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("table", class_=self.class_matcher("product-table")))
         table = soup.find("table", {"class": "product-table"})
         for link in table.findAll("a"):
             url = link["href"]
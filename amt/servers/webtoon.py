@@ -1,4 +1,4 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import re
 
 from ..server import Server
@@ -38,23 +38,23 @@ class Webtoons(Server):
 
     def get_media_list(self, **kwargs):
         r = self.session_get(self.list_series_url)
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("ul", class_=self.class_matcher("lst_type1")))
         return self.get_media_list_helper(soup.find("ul", class_="lst_type1").find_all("li"))
 
     def search_for_media(self, term, **kwargs):
         r = self.session_get(self.search_url.format(term))
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("ul", class_=self.class_matcher("card_lst")))
         element = soup.find("ul", class_="card_lst")
         return self.get_media_list_helper(element.find_all("li")) if element else []
 
     def update_media_data(self, media_data, **kwargs):
         if not media_data.get("url"):
             r = self.session_get(self.chapters_url.format(media_data["id"]))
-            soup = self.soupify(BeautifulSoup, r)
+            soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("a", id="_btnEpisode"))
             href = soup.find("a", {"id": "_btnEpisode"})
             media_data["url"] = href.get("href")
         r = self.session_get(media_data["url"])
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("div", class_=self.class_matcher("episode_lst")))
         element = soup.find("div", {"class": "episode_lst"})
         for li in element.findAll("li"):
             chapter_number = li.get("data-episode-no")
@@ -63,7 +63,7 @@ class Webtoons(Server):
 
     def get_media_chapter_data(self, media_data, chapter_data, stream_index=0):
         r = self.session_get(media_data["url"])
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("div", id="_imageList"))
         element = soup.find("div", {"id": "_imageList"})
         pages = []
         for img in element.findAll("img"):
@@ -76,6 +76,6 @@ class Webtoons(Server):
     def get_media_data_from_url(self, url):
         media_id = self._get_media_id_from_url(url)
         r = self.session_get(self.chapters_url.format(media_id))
-        soup = self.soupify(BeautifulSoup, r)
+        soup = self.soupify(BeautifulSoup, r, parse_only=SoupStrainer("div", class_=self.class_matcher("info")))
         element = soup.find("div", {"class": "info"})
         return self.get_media_data_from_element(element, media_id=media_id)
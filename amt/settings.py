@@ -1,6 +1,7 @@
 import json
 import os
 import re
+import time
 
 from .util.media_type import MediaType
 
@@ -38,7 +39,7 @@ class Settings:
     password_override_prefix = "PASSWORD_OVERRIDE_"
 
     # HTTP related; Generally used as args to requests
-    bs4_parser = "html.parser"
+    bs4_parser = ""  # empty to use lxml if it is installed and html.parser otherwise
     max_retries = 3
     backoff_factor = 1
     status_to_retry = [403, 429, 500, 502, 503, 504]
@@ -49,9 +50,13 @@ class Settings:
 
     # cache
     search_cache_time_sec = 14 * 24 * 3600
+    # How long the full media list of servers without a native search is kept (in memory and on disk) to search against; 0 disables
+    catalog_cache_time_sec = 3600 * 24
     # If the available date of the last chapter of the last chapter is over this many seconds old, assume the season has been completed
     # and cache queries. Servers may ignore this value if they have better ways to detect completed seasons and/or requests are fast
     assume_season_completed_after_n_sec = 3600 * 24 * 7 * 2
+    # Servers that can fetch just the chapters changed since the last update will still refetch everything after this many seconds
+    full_chapter_sync_interval_sec = 3600 * 24 * 7
 
     # Servers/Tracker
     enabled_servers = []  # empty means all servers all enabled
@@ -89,6 +94,8 @@ class Settings:
         }
     }
     search_score = [["official", True, -10], ["lang", ["en", "en-us", "english", ""], -1]]
+    search_timeout_sec = 0  # stop waiting on servers that haven't responded to a search after this long; 0 to wait for all of them
+    search_stop_at_first_match = False  # exact and media id searches stop at the first server with a match instead of waiting on the rest
 
     chapter_dir_name_format = "{chapter_number:07.2f}"
     chapter_page_format = "{page_number:04d}.{ext}"
@@ -97,11 +104,22 @@ class Settings:
     disable_ssl_verification = False
     fallback_to_insecure_connection = False
     keep_unavailable = False
+    download_checksums = False  # record the sha256 of every downloaded file in the media's download manifest
+    page_store = False  # keep every downloaded file once, by checksum, in the page store and hard link it into chapter dirs; files must not be edited in place
     post_process_cmd = ""
     threads = 8  # per server thread count
+    page_fetch_threads = 4  # concurrent requests used to fetch the rest of a multi-page listing; 0 to fetch them one at a time
+    decoder_processes = -1  # processes used to descramble images; -1 for one per cpu and 0 to use the calling thread
     viewer = ""
     tmp_dir = "/tmp/.amt"
     always_use_cloudscraper = False  # server setting to force cloudscraper
+    cloudscraper_domain_ttl_sec = 3600 * 24 * 7  # how long a domain that needed cloudscraper is sent straight to it by servers that may need it; 0 to always try a normal request first
+    http_pool_size = 0  # server setting; connections kept alive to the server's domain; 0 to size the pool from the thread settings
+    http2_domains = []  # hosts (like image CDNs) to talk to over HTTP/2; needs httpx[http2] and falls back to HTTP/1.1 without it
+    http_stats_prometheus_file = ""  # if set, the http stats are also written here in the Prometheus text format whenever they are saved
+
+    # incremented whenever a field changes; used to invalidate resolved fields
+    _field_cache_generation = 0
 
     def __init__(self, no_save_session=False, no_load=False, skip_env_override=False):
         home = os.getenv("AMT_HOME", os.getenv("HOME"))
@@ -123,6 +141,12 @@ class Settings:
     def get_server_cache_file(self):
         return os.path.join(self.cache_dir, "server_cache.json")
 
+    def get_decoder_cache_file(self):
+        return os.path.join(self.cache_dir, "decoder_cache.json")
+
+    def get_tracker_snapshot_file(self):
+        return os.path.join(self.cache_dir, "tracker_snapshot.json")
+
     def get_cookie_file(self):
         return os.path.join(self.cache_dir, "cookies.txt")
 
@@ -146,9 +170,22 @@ class Settings:
     def get_stats_file(self):
         return os.path.join(self.cache_dir, "stats.json")
 
+    def get_cloudscraper_domains_file(self):
+        return os.path.join(self.cache_dir, "cloudscraper_domains.json")
+
+    def get_http_stats_file(self):
+        return os.path.join(self.cache_dir, "http_stats.json")
+
+    def get_profile_file(self, name):
+        """ Returns the path, minus the extension, to save the profile of the command name to """
+        return os.path.join(self.cache_dir, "profiles", "{}-{}".format(name, time.strftime("%Y%m%d-%H%M%S")))
+
     def get_web_cache_dir(self):
         return os.path.join(self.cache_dir, "web_cache")
 
+    def get_catalog_cache_file(self, server_id):
+        return os.path.join(self.get_web_cache_dir(), f"catalog_{server_id}.json")
+
     def get_web_cache(self, url):
         return os.path.join(self.get_web_cache_dir(), url.replace("/", "_"))
 
@@ -158,8 +195,27 @@ class Settings:
 
     def __getattr__(self, key):
         if key.startswith("get_"):
-            key = key[len("get_"):]
-            return lambda x: self.get_field(key, x)
+            name = key[len("get_"):]
+            getter = lambda x: self.get_field(name, x)
+            # store the getter directly on the instance so __getattr__ is only hit once per field
+            self.__dict__[key] = getter
+            return getter
+
+    def __setattr__(self, key, value):
+        super().__setattr__(key, value)
+        if key == "_specific_settings" or key in Settings.get_members():
+            self.clear_field_cache()
+
+    @staticmethod
+    def clear_field_cache():
+        # _specific_settings may be shared between instances so any change invalidates every cache
+        Settings._field_cache_generation += 1
+
+    def _get_field_cache(self):
+        cache = self.__dict__.get("_field_cache")
+        if cache is None or cache[0] != Settings._field_cache_generation:
+            cache = self.__dict__["_field_cache"] = (Settings._field_cache_generation, {})
+        return cache[1]
 
     def set_field(self, name, value, server_or_media_id=None, convert=False):
         assert name in Settings.get_members()
@@ -181,6 +237,7 @@ class Settings:
             if not name in self._specific_settings:
                 self._specific_settings[name] = {}
             self._specific_settings[name][server_or_media_id] = value
+            self.clear_field_cache()
         else:
             setattr(self, name, value)
 
@@ -190,8 +247,21 @@ class Settings:
                 yield self._specific_settings[name][key]
         yield getattr(self, name)
 
+    @staticmethod
+    def _get_cache_key(media_data):
+        # identifies the labels get_field_values would use without building them; they are only built on a cache miss
+        if isinstance(media_data, dict):
+            return media_data.global_id, media_data["media_type"]
+        return media_data if isinstance(media_data, (str, int)) or not media_data else (media_data.id, media_data.media_type)
+
     def get_field(self, name, media_data=None):
-        return next(self.get_field_values(name, media_data=media_data))
+        cache = self._get_field_cache()
+        key = name, self._get_cache_key(media_data)
+        try:
+            return cache[key]
+        except KeyError:
+            value = cache[key] = next(self.get_field_values(name, media_data))
+            return value
 
     def save(self):
         data = {}
@@ -244,6 +314,12 @@ class Settings:
     def get_media_dir(self, media_data):
         return os.path.join(self.get_server_dir(media_data["server_id"]), media_data["dir_name"])
 
+    def get_download_manifest_file(self, media_data):
+        return os.path.join(self.get_media_dir(media_data), ".manifest.json")
+
+    def get_page_store_dir(self):
+        return os.path.join(self.data_dir, "store")
+
     def get_chapter_dir_name(self, media_data, chapter_data):
         fmt_str = (self.get_special_chapter_dir_name_format if chapter_data["special"] else self.get_chapter_dir_name_format)(media_data)
         chapter_dir_name = fmt_str.format(media_name=media_data["name"], chapter_number=chapter_data["number"], chapter_title=chapter_data["title"], chapter_id=chapter_data["id"])
@@ -285,8 +361,8 @@ class Settings:
     def get_logger(self):
         if not self._logger:
             import logging
-            self.logger = logging.getLogger("settings")
-        return self.logger
+            self._logger = logging.getLogger("settings")
+        return self._logger
 
     def get_runner(self):
         if not self._runner:
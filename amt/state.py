@@ -4,7 +4,9 @@ import time
 
 from . import stats
 from .stats import Details, SortIndex, StatGroup
+from .util.http_stats import HTTPStats, http_stats
 from .util.media_type import MediaType
+from .util.profiler import span
 from .util.progress_type import ProgressType
 
 
@@ -28,6 +30,9 @@ class State:
         self.hashes = {}
         self.cookie_hash = None
         self.server_cache = {}
+        # shared with RequestServer.cloudscraper_domains
+        self.cloudscraper_domains = {}
+        self._tracker_snapshot = None
 
         self.load()
 
@@ -64,6 +69,10 @@ class State:
         self.save_session_cookies()
         self.save_to_file(self.settings.get_metadata_file(), self.all_media)
         self.save_to_file(self.settings.get_server_cache_file(), self.server_cache)
+        self.save_cloudscraper_domains()
+        if self._tracker_snapshot is not None:
+            self.save_to_file(self.settings.get_tracker_snapshot_file(), self._tracker_snapshot)
+        self.save_http_stats()
         for media_data in self.media.values():
             self.save_to_file(self.settings.get_chapter_metadata_file(media_data), media_data.chapters)
 
@@ -74,10 +83,19 @@ class State:
         self._set_session_hash()
 
     def load(self):
-        self.load_media()
-        self.server_cache = self.read_file_as_dict(self.settings.get_server_cache_file())
-        if not self.server_cache or self.server_cache.get("version") != self.cache_version:
-            self.update_server_cache()
+        with span("state_load"):
+            self.load_media()
+            self.server_cache = self.read_file_as_dict(self.settings.get_server_cache_file())
+            self.cloudscraper_domains.update(self.read_file_as_dict(self.settings.get_cloudscraper_domains_file(), object_hook=None))
+            if not self.server_cache or self.server_cache.get("version") != self.cache_version:
+                self.update_server_cache()
+
+    def save_cloudscraper_domains(self):
+        now = time.time()
+        for domain, expiry in list(self.cloudscraper_domains.items()):
+            if expiry < now:
+                del self.cloudscraper_domains[domain]
+        self.save_to_file(self.settings.get_cloudscraper_domains_file(), self.cloudscraper_domains)
 
     def load_chapter_data(self, media_data):
         media_data.chapters = self.read_file_as_dict(self.settings.get_chapter_metadata_file(media_data))
@@ -136,6 +154,8 @@ class State:
         with open(self.settings.get_cookie_file(), "w") as f:
             f.write("# Netscape HTTP Cookie File\n")
             for cookie in self.session.cookies:
+                if cookie.is_expired():
+                    continue
                 l = [cookie.domain, str(cookie.domain_specified and cookie.domain.startswith(".")).upper(), cookie.path, str(cookie.secure).upper(), str(cookie.expires) if cookie.expires else "", cookie.name, cookie.value]
                 f.write("\t".join(l) + "\n")
         return True
@@ -246,12 +266,35 @@ class State:
         for chapter in media_data.get_sorted_chapters():
             yield "{:4}{}:{}{}".format(chapter["number"], "*" if chapter["special"] else " ", chapter["title"], ":" + chapter["id"] if show_ids else "")
 
+    def get_tracker_snapshot(self, tracker_id, identifier):
+        """ Returns the map of tracker entry id to when it was last updated as of the last time the list was loaded """
+        if self._tracker_snapshot is None:
+            self._tracker_snapshot = self.read_file_as_dict(self.settings.get_tracker_snapshot_file())
+        return self._tracker_snapshot.setdefault(f"{tracker_id}:{identifier or ''}", {})
+
     def save_stats(self, identifier, stats):
         stats_file = self.settings.get_stats_file()
         saved_data = self.read_file_as_dict(stats_file, object_hook=lambda obj: TrackerEntry(obj))
         saved_data.update({identifier or "": stats})
         self.save_to_file(stats_file, saved_data)
 
+    def save_http_stats(self):
+        """ Merges the http stats recorded since the last save into the saved totals """
+        data = http_stats.pop()
+        if not data:
+            return
+        saved_data = HTTPStats.merge(self.read_file_as_dict(self.settings.get_http_stats_file(), object_hook=None), data)
+        self.save_to_file(self.settings.get_http_stats_file(), saved_data)
+        if self.settings.http_stats_prometheus_file:
+            with open(self.settings.http_stats_prometheus_file, "w") as f:
+                f.write(HTTPStats.to_prometheus(saved_data))
+
+    def list_http_stats(self, server_id=None, prometheus=False, no_header=False):
+        saved_data = self.read_file_as_dict(self.settings.get_http_stats_file(), object_hook=None)
+        if prometheus:
+            return HTTPStats.to_prometheus(saved_data)
+        return ([] if no_header else [HTTPStats.get_headers()]) + list(HTTPStats.get_rows(saved_data, server_id=server_id))
+
     def list_stats(self, username=None, media_type=None, stat_group=StatGroup.NAME, sort_index=SortIndex.NAME, reverse=False, min_count=0, min_score=1, time_unit=0, no_header=False, details_type=Details.NAME, details_limit=None):
         saved_data = self.read_file_as_dict(self.settings.get_stats_file(), object_hook=lambda obj: TrackerEntry(obj))
         data = saved_data.get(username if username else "", {})
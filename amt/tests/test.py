@@ -1,4 +1,7 @@
+import hashlib
+import importlib.util
 import inspect
+import io
 import json
 import logging
 import os
@@ -6,27 +9,34 @@ import requests
 import shutil
 import subprocess
 import sys
+import threading
 import time
 import unittest
 
-from contextlib import contextmanager
+from collections import Counter
+from contextlib import contextmanager, nullcontext
 from inspect import findsource
 from requests.exceptions import ConnectionError
 from subprocess import CalledProcessError
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from .. import servers, tests
 from ..args import parse_args, setup_subparsers, init_logger
 from ..job import Job, RetryException
 from ..media_reader import SERVERS, MediaReader, import_sub_classes
 from ..media_reader_cli import MediaReaderCLI
-from ..server import RequestServer
+from ..server import RequestServer, Server
 from ..servers.local import LocalServer
 from ..servers.remote import RemoteServer
 from ..settings import Settings
 from ..state import ChapterData, MediaData, State
+from ..util.download_manifest import DownloadManifest, get_file_checksum
 from ..util.exceptions import ChapterLimitException
+from ..util.http_adapter import CountingHTTPConnectionPool, CountingHTTPSConnectionPool, HTTP2Adapter, PooledHTTPAdapter
+from ..util.http_stats import HTTPStats, create_entry
 from ..util.media_type import MediaType
+from ..util.page_store import PageStore
+from ..util.profiler import Profiler
 from .test_server import (TestAnimeServer, TestServer, TestUnofficialServer, TestServerLogin, TestServerLoginAnime)
 from .test_tracker import TestTracker
 
@@ -35,12 +45,16 @@ HAS_PIL = True
 try:
     from PIL import Image
 
+    from ..util import decoder
     from ..util.decoder import GenericDecoder
     # Make the tests faster for certain servers
     GenericDecoder.PENDING_CACHE_NUM = 1
 except:
     HAS_PIL = False
 
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+HAS_HTTP2 = importlib.util.find_spec("httpx") is not None and importlib.util.find_spec("h2") is not None
+
 
 TEST_BASE = "/tmp/amt/"
 TEST_HOME = os.path.join(TEST_BASE, "test_home/")
@@ -326,6 +340,45 @@ class UtilTest(BaseUnitTestClass):
             with self.subTest(name=name):
                 self.assertEqual(get_number_from_file_name(name), chapter_number)
 
+    def test_xor_decryption(self):
+        from ..util.decryption import xor_bytes, xor_stream
+        data = bytes(range(256)) * 5 + b"tail"
+        key = b"\x01\x7f\xff"
+        expected = bytes(v ^ key[i % len(key)] for i, v in enumerate(data))
+        for has_numpy in (True, False):
+            with self.subTest(has_numpy=has_numpy), (nullcontext() if has_numpy else patch.dict(sys.modules, {"numpy": None})):
+                self.assertEqual(xor_bytes(data, key), expected)
+                self.assertEqual(xor_bytes(b"", key), b"")
+                self.assertEqual(b"".join(xor_stream((data[i:i + 100] for i in range(0, len(data), 100)), key)), expected)
+
+    def test_decrypt_stream(self):
+        from io import BytesIO
+        from Crypto.Cipher import AES
+        from Crypto.Util import Padding
+        from ..util.decryption import decrypt_stream
+        key = bytes(range(16))
+        for size in (0, 15, 16, 64, 100):
+            with self.subTest(size=size):
+                data = os.urandom(size)
+                encrypted = AES.new(key, AES.MODE_ECB).encrypt(Padding.pad(data, AES.block_size, "pkcs7"))
+                self.assertEqual(b"".join(decrypt_stream(BytesIO(encrypted), AES.new(key, AES.MODE_ECB), chunk_size=40)), data)
+
+    def test_find_media_with_similar_name_in_list(self):
+        from ..util.name_parser import find_media_with_similar_name_in_list
+        media_list = [{"name": name, "season_title": season_title} for name, season_title in [("Brown Fox", ""), ("The Brown Fox Jumps", "Season 2"), ("Fox", "Over the dog"), ("ab", ""), ("", "")]]
+        for names, expected in [
+            (["brown fox"], [0, 1, 2, 4]),
+            (["BROWN"], [0, 1, 4]),
+            (["The Quick Brown Fox"], [0, 2, 4]),
+            (["dog"], [2, 4]),
+            (["a"], [1, 3, 4]),
+            (["ab", "cat"], [3, 4]),
+        ]:
+            with self.subTest(names=names):
+                self.assertEqual(list(find_media_with_similar_name_in_list(names, media_list)), [media_list[i] for i in expected])
+        # season_title is optional
+        self.assertEqual(list(find_media_with_similar_name_in_list(["fox"], [{"name": "Fox"}])), [{"name": "Fox"}])
+
     def test_get_alt_names_remove_dub(self):
         from ..util.name_parser import get_alt_names
         suffixes = ["(Dub)", "(Dubbed)", "(English Dub)", "(Spanish Dub)"]
@@ -336,6 +389,15 @@ class UtilTest(BaseUnitTestClass):
             self.assertEqual(list(get_alt_names(title.lower())), [name.lower()])
             self.assertEqual(list(get_alt_names(title.upper())), [name.upper()])
 
+    def test_normalize_name(self):
+        from ..util.name_parser import get_alt_names, get_name_tokens, normalize_name
+        name = "The Brown-Fox: Season 2 (Dub)"
+        self.assertEqual(frozenset(["the", "brown", "fox", "season", "2", "dub", ""]), get_name_tokens(name))
+        alt_names = get_alt_names(name)
+        alt_names.append("modified")
+        self.assertNotIn("modified", get_alt_names(name))
+        self.assertIs(normalize_name(name), normalize_name(name))
+
 
 @unittest.skipIf(not HAS_PIL, "PIL is needed to test")
 class DecoderTest(BaseUnitTestClass):
@@ -373,6 +435,11 @@ class DecoderTest(BaseUnitTestClass):
         [9, 9, 9, 9, 9, 9],
     ]
 
+    def setUp(self):
+        super().setUp()
+        GenericDecoder._cache, GenericDecoder._pending_cache, GenericDecoder._tile_sizes, GenericDecoder._cache_last_used = {}, {}, {}, {}
+        GenericDecoder._unsaved_changes = 0
+
     def assert_img_eq(self, img1, img2):
         self.assertEqual(img1.size, img2.size)
         pixels1, pixels2 = img1.load(), img2.load()
@@ -428,6 +495,130 @@ class DecoderTest(BaseUnitTestClass):
         for i in range(1000):
             self.assertTrue(GenericDecoder.solve_image(img, key="key", branch_factor=1, W=29, H=21))
 
+    def test_descramble_and_save_img(self):
+        from io import BytesIO
+        data = BytesIO()
+        Image.new("RGB", (108, 72)).save(data, format="png")
+        expected = GenericDecoder.solve_image(Image.new("RGB", (108, 72)), W=29, H=21)
+        for processes in (0, 2):
+            with self.subTest(processes=processes):
+                path = os.path.join(TEST_HOME, f"{processes}.png")
+                data.seek(0)
+                self.assertTrue(GenericDecoder.descramble_and_save_img(data, path, key="key", branch_factor=1, W=29, H=21, processes=processes))
+                with Image.open(path) as img:
+                    self.assert_img_eq(img, expected)
+        self.assertTrue(GenericDecoder.get_cached_solution(("key", (108, 72))))
+
+    def test_decoder_processes_get_toggles(self):
+        try:
+            GenericDecoder.RANK_TILE_SIZES = False
+            executor = GenericDecoder.get_executor(1)
+            self.assertEqual(decoder.get_toggles(), executor.submit(decoder.get_toggles).result())
+            # a new pool is started when a toggle changes and the old one is shut down
+            GenericDecoder.RANK_TILE_SIZES = True
+            self.assertEqual(decoder.get_toggles(), GenericDecoder.get_executor(1).submit(decoder.get_toggles).result())
+            self.assertRaises(RuntimeError, executor.submit, decoder.get_toggles)
+        finally:
+            GenericDecoder.RANK_TILE_SIZES = True
+        executor = GenericDecoder.get_executor(1)
+        GenericDecoder.shutdown_executor()
+        self.assertRaises(RuntimeError, executor.submit, decoder.get_toggles)
+        self.assertIsNot(executor, GenericDecoder.get_executor(1))
+
+    def test_persistent_solution_cache(self):
+        cache_file = self.settings.get_decoder_cache_file()
+        sizes = [(108, 72), (109, 72)]
+        try:
+            GenericDecoder.MAX_PERSISTED_SOLUTIONS = 1
+            GenericDecoder.load_cache(cache_file)
+            for size in sizes:
+                self.assertTrue(GenericDecoder.solve_image(Image.new("RGB", size), key="persistent_key", branch_factor=1, W=29, H=21))
+            self.assertEqual(1, len(GenericDecoder._tile_sizes))
+            # changes are batched
+            self.assertFalse(os.path.exists(cache_file))
+            GenericDecoder.save_cache()
+            GenericDecoder._cache, GenericDecoder._tile_sizes, GenericDecoder._cache_file = {}, {}, None
+            GenericDecoder.load_cache(cache_file)
+            # only the most recent solution and tile size are kept
+            self.assertFalse(GenericDecoder.get_cached_solution(("persistent_key", sizes[0])))
+            self.assertTrue(GenericDecoder.get_cached_solution(("persistent_key", sizes[1])))
+            self.assertFalse(GenericDecoder.get_cached_tile_size(sizes[0]))
+            self.assertTrue(GenericDecoder.get_cached_tile_size(sizes[1]))
+        finally:
+            GenericDecoder.MAX_PERSISTED_SOLUTIONS = 1000
+            GenericDecoder._cache_file = None
+
+    def test_malformed_solution_cache(self):
+        cache_file = self.settings.get_decoder_cache_file()
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        try:
+            for data in ("{", "{}", "[]", '{"solutions": [[1]], "tile_sizes": []}'):
+                with self.subTest(data=data):
+                    with open(cache_file, "w") as f:
+                        f.write(data)
+                    GenericDecoder._cache_file = None
+                    GenericDecoder.load_cache(cache_file)
+                    self.assertFalse(GenericDecoder._cache)
+            # the file is replaced once a new solution is found and saved
+            self.assertTrue(GenericDecoder.solve_image(Image.new("RGB", (108, 72)), key="key", branch_factor=1, W=29, H=21))
+            GenericDecoder.save_cache()
+            with open(cache_file) as f:
+                self.assertEqual(1, len(json.load(f)["solutions"]))
+            self.assertFalse([name for name in os.listdir(os.path.dirname(cache_file)) if name.startswith(".decoder_cache")])
+        finally:
+            GenericDecoder._cache_file = None
+
+    def test_rank_tile_sizes(self):
+        import random
+        random.seed(0)
+        W, H = 29, 21
+        img = Image.new("RGB", (4 * W + 5, 3 * H + 5))
+        for x in range(0, img.width, W):
+            for y in range(0, img.height, H):
+                img.paste(tuple(random.randint(0, 255) for _ in range(3)), (x, y, x + W, y + H))
+        candidates = [(w, h) for w in range(W - 8, W + 17, 8) for h in range(H - 8, H + 17, 8)]
+        self.assertEqual(GenericDecoder.rank_tile_sizes(img, candidates)[0], (W, H))
+        # a blank image gives no information so the order is unchanged
+        self.assertEqual(GenericDecoder.rank_tile_sizes(Image.new("RGB", img.size), candidates), candidates)
+
+    def test_solve_image_records_candidates_tried(self):
+        GenericDecoder.candidates_tried.clear()
+        self.assertTrue(GenericDecoder.solve_image(Image.new("RGB", (108, 72)), key="key", W=29, H=21))
+        self.assertEqual(sum(GenericDecoder.candidates_tried.values()), 1)
+        # the tile size is remembered so the next image of the same size is solved on the first try
+        self.assertTrue(GenericDecoder.solve_image(Image.new("RGB", (108, 72)), key="other_key", W=29, H=21))
+        self.assertEqual(GenericDecoder.candidates_tried[1], 1)
+
+    @unittest.skipUnless(HAS_NUMPY, "numpy is needed to test")
+    def test_edge_costs_match_pixel_costs(self):
+        import random
+        random.seed(0)
+        for mode, pixel_func in (("I", lambda: random.randint(0, 255)), ("RGB", lambda: tuple(random.randint(0, 255) for _ in range(3)))):
+            with self.subTest(mode=mode):
+                img = Image.new(mode, (40, 30))
+                img.putdata([pixel_func() for _ in range(40 * 30)])
+                num_rows, num_cols, W, H, offset = 2, 3, 11, 12, (4, 4)
+                cells = GenericDecoder.load_cells(img.load(), num_rows, num_cols, W, H)
+                array_cells = GenericDecoder.load_array_cells(img, num_rows, num_cols, W, H, offset)
+                for cell, array_cell in zip(cells, array_cells):
+                    for other in cells:
+                        self.assertAlmostEqual(cell.get_hor_diff(other.x, other.y, offset[1]), array_cell.get_hor_diff(other.x, other.y, offset[1]))
+                        vert_cost = cell.get_vert_diff(other.x, other.y, offset[0])
+                        if vert_cost <= decoder.MAX_INDIVIDUAL_COST:
+                            self.assertAlmostEqual(vert_cost, array_cell.get_vert_diff(other.x, other.y, offset[0]))
+                        else:
+                            self.assertGreater(array_cell.get_vert_diff(other.x, other.y, offset[0]), decoder.MAX_INDIVIDUAL_COST)
+
+
+class DecoderPurePythonTest(DecoderTest):
+    def setUp(self):
+        super().setUp()
+        GenericDecoder.USE_NUMPY = False
+
+    def tearDown(self):
+        GenericDecoder.USE_NUMPY = True
+        super().tearDown()
+
 
 class SettingsTest(BaseUnitTestClass):
 
@@ -487,6 +678,27 @@ class SettingsTest(BaseUnitTestClass):
         self.settings.load()
         self.assertEqual(self.settings.status_to_retry, [1, 2, 3])
 
+    def test_settings_field_cache_invalidation(self):
+        media_data = self.add_test_media(limit=1)[0]
+        self.assertEqual(self.settings.get_threads(media_data), self.settings.threads)
+        self.settings.set_field("threads", 3, media_data["server_id"])
+        self.assertEqual(self.settings.get_threads(media_data), 3)
+        self.settings.set_field("threads", 5, media_data.global_id)
+        self.assertEqual(self.settings.get_threads(media_data), 5)
+        self.settings._specific_settings = {}
+        self.assertEqual(self.settings.get_threads(media_data), self.settings.threads)
+        self.settings.threads = 7
+        self.assertEqual(self.settings.get_threads(media_data), 7)
+        self.assertIs(self.settings.get_threads, self.settings.get_threads)
+        with patch.object(MediaData, "get_labels") as get_labels:
+            self.assertEqual(self.settings.get_threads(media_data), 7)
+            get_labels.assert_not_called()
+
+        generation = Settings._field_cache_generation
+        self.settings.get_logger()
+        self.settings.config_dir = self.settings.config_dir
+        self.assertEqual(generation, Settings._field_cache_generation)
+
     def test_settings_env_inject(self):
         KEY, VALUE = "SOME_ARBITRARY_TEST_KEY", "123"
         self.settings.env = {KEY: VALUE}
@@ -587,6 +799,159 @@ class ServerWorkflowsTest(BaseUnitTestClass):
         self.test_server.session_get_cache("some_url", mem_cache=False)
         self.test_anime_server.session_get_cache("some_url", mem_cache=True)
 
+    def test_get_all_pages(self):
+        def get_page(key):
+            time.sleep(.001 * (10 - (key or 0)))
+            return key
+        for threads in (0, 1, 4):
+            with self.subTest(threads=threads):
+                self.settings.page_fetch_threads = threads
+                self.assertEqual(self.test_server.get_all_pages(get_page, lambda first_page: range(1, 10)), [None] + list(range(1, 10)))
+                self.assertEqual(self.test_server.get_all_pages(get_page, lambda first_page: []), [None])
+
+    def test_resume_partial_page_download(self):
+        content = bytes(range(100))
+        headers_sent = []
+
+        class InterruptedRaw(io.BytesIO):
+            def read(self, *args):
+                data = super().read(*args)
+                if not data:
+                    raise ConnectionError()
+                return data
+
+        def fake_get(url, headers=None, **kwargs):
+            headers_sent.append(headers)
+            r = requests.Response()
+            r.headers.update({"Accept-Ranges": "bytes", "ETag": '"v1"'})
+            if "Range" in headers:
+                start = int(headers["Range"][len("bytes="):-1])
+                r.status_code = 206
+                r.headers["Content-Range"] = f"bytes {start}-99/100"
+                r.raw = io.BytesIO(content[start:])
+            else:
+                r.status_code = 200
+                r.headers["Content-Length"] = "100"
+                r.raw = InterruptedRaw(content[:40])
+            return r
+        self.test_server.session.get = fake_get
+        page_data = self.test_server.create_page_data(url="https://example.com/1.jpg")
+        path = os.path.join(TEST_HOME, "1.jpg")
+        self.assertRaises(ConnectionError, self.test_server.save_chapter_page_resumable, page_data, path)
+        self.test_server.save_chapter_page_resumable(page_data, path)
+        self.assertEqual({"Range": "bytes=40-", "If-Range": '"v1"'}, headers_sent[-1])
+        with open(path, "rb") as f:
+            self.assertEqual(content, f.read())
+
+    def test_resume_changed_page_download(self):
+        headers_sent = []
+
+        def fake_get(url, headers=None, **kwargs):
+            headers_sent.append(headers)
+            r = requests.Response()
+            r.status_code = 206
+            r.headers.update({"Accept-Ranges": "bytes", "Content-Length": "10", "Content-Range": "bytes 0-9/10"})
+            r.raw = io.BytesIO(bytes(10))
+            return r
+        self.test_server.session.get = fake_get
+        path = os.path.join(TEST_HOME, "1.jpg")
+        with open(path, "wb") as f:
+            f.write(bytes(40))
+        page_data = self.test_server.create_page_data(url="https://example.com/1.jpg")
+        page_data.update(resumable=True, length=100)
+        # the partial page is from a different version of the page so it's downloaded again but only once
+        self.assertRaises(requests.exceptions.HTTPError, self.test_server.save_chapter_page_resumable, page_data, path)
+        self.assertEqual(2, len(headers_sent))
+        self.assertIn("Range", headers_sent[0])
+        self.assertNotIn("Range", headers_sent[1])
+        self.assertEqual(0, os.path.getsize(path))
+
+        # partial content to a request without a range doesn't need an existing file
+        os.remove(path)
+        headers_sent.clear()
+        self.assertRaises(requests.exceptions.HTTPError, self.test_server.save_chapter_page_resumable, self.test_server.create_page_data(url="https://example.com/1.jpg"), path)
+        self.assertEqual(2, len(headers_sent))
+
+    def test_download_manifest(self):
+        path = os.path.join(TEST_HOME, "new_dir", ".manifest.json")
+        manifest = DownloadManifest(path)
+        self.assertFalse(manifest.exists)
+        self.assertFalse(manifest.set_pages(1, "dir", [{"key": object()}]))
+        self.assertTrue(manifest.set_pages(1, "dir", [{"url": "url"}]))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual([{"url": "url"}], DownloadManifest(path).get_pages(1, "dir"))
+        self.assertEqual([os.path.basename(path)], os.listdir(os.path.dirname(path)))
+
+        with open(path, "w") as f:
+            f.write("{")
+        self.assertFalse(DownloadManifest(path).chapters)
+
+    def test_file_checksum(self):
+        path = os.path.join(TEST_HOME, "file")
+        data = bytes(range(256)) * 1024
+        with open(path, "wb") as f:
+            f.write(data)
+        self.assertEqual(hashlib.sha256(data).hexdigest(), get_file_checksum(path))
+
+    def test_resume_chapter_download_without_listing_pages(self):
+        media_data = self.add_test_media(self.test_server.id, limit=1, no_update=False)[0]
+        chapter_data = media_data.get_sorted_chapters()[0]
+        save_chapter_page = self.test_server.save_chapter_page
+
+        def fail_on_last_page(page_data, path):
+            if page_data["path"].endswith("2.text"):
+                raise ConnectionError()
+            save_chapter_page(page_data, path)
+        self.test_server.save_chapter_page = fail_on_last_page
+        self.assertRaises(ConnectionError, self.test_server.download_chapter, media_data, chapter_data)
+        manifest_file = self.settings.get_download_manifest_file(media_data)
+        self.assertTrue(os.path.exists(manifest_file))
+
+        # pages that were downloaded but have since been removed are downloaded again
+        removed_page = self.test_server.get_download_manifest(media_data).get_entry(chapter_data["id"])["pages"][0]["path"]
+        os.remove(removed_page)
+        self.test_server.save_chapter_page = save_chapter_page
+        with patch.object(self.test_server, "get_media_chapter_data", side_effect=AssertionError("Pages were listed again")):
+            self.assertTrue(self.test_server.download_chapter(media_data, chapter_data))
+        self.verify_download(media_data, chapter_data)
+        self.assertTrue(os.path.exists(removed_page))
+        self.assertFalse(self.test_server.get_download_manifest(media_data).get_entry(chapter_data["id"]).get("pages"))
+
+    def test_catalog_cache(self):
+        calls = []
+        get_media_list = self.test_server.get_media_list
+        self.test_server.get_media_list = lambda **kwargs: calls.append(1) or get_media_list(**kwargs)
+        results = list(self.test_server.search_for_media("Unique Manga"))
+        self.assertTrue(results)
+        self.assertEqual(results, list(self.test_server.search_for_media("Unique Manga")))
+        results[0]["progress"] = 10
+        self.assertNotEqual(10, list(self.test_server.search_for_media("Unique Manga"))[0]["progress"])
+        self.assertEqual(1, len(calls))
+
+        # a new instance loads the catalog from disk
+        server = type(self.test_server)(self.test_server.session, settings=self.settings)
+        server.get_media_list = None
+        self.assertEqual([media_data["id"] for media_data in results], [media_data["id"] for media_data in server.search_for_media("Unique Manga")])
+
+        results[0]["tags"].append("tag")
+        self.assertFalse(list(self.test_server.search_for_media("Unique Manga"))[0]["tags"])
+        self.assertEqual(1, len(calls))
+
+        self.settings.catalog_cache_time_sec = 0
+        list(self.test_server.search_for_media("Unique Manga"))
+        self.assertEqual(2, len(calls))
+
+    def test_catalog_cache_cleared_on_login(self):
+        server = self.media_reader.get_server(TestServerLogin.id)
+        self.assertTrue(list(server.search_for_media("Unique Manga")))
+        with patch.object(server, "get_media_list", side_effect=AssertionError("Catalog was fetched again")):
+            list(server.search_for_media("Unique Manga"))
+        # what is listed can depend on the account
+        self.assertTrue(server.relogin())
+        with patch.object(server, "get_media_list", return_value=[]) as get_media_list:
+            self.assertFalse(list(server.search_for_media("Unique Manga")))
+            get_media_list.assert_called_once()
+
     def test_session_permanent_ssl_error(self):
         def fake_request(*args, **kwargs):
             raise requests.exceptions.SSLError()
@@ -614,10 +979,60 @@ class ServerWorkflowsTest(BaseUnitTestClass):
         self.test_server.session_get("some_url")
         self.test_server.session_post("some_url")
 
+    def test_soupify_parse_only(self):
+        from bs4 import BeautifulSoup, SoupStrainer
+        html = '<div><table class="list big"><tr><td>1</td></tr></table><table class="other"><tr><td>2</td></tr></table></div>'
+        self.assertEqual(2, len(self.test_server.soupify(BeautifulSoup, html).find_all("td")))
+        soup = self.test_server.soupify(BeautifulSoup, html, parse_only=SoupStrainer("table", class_=self.test_server.class_matcher("list", "missing")))
+        self.assertEqual(["1"], [td.getText() for td in soup.find_all("td")])
+        self.assertIn(self.test_server.get_bs4_parser(), ("lxml", "html.parser"))
+        self.settings.bs4_parser = "html.parser"
+        self.assertEqual("html.parser", self.test_server.get_bs4_parser())
+
+    def test_http_stats(self):
+        self.test_server.http_stats.pop()
+        self.counter = 0
+
+        def fake_request(*args, **kwargs):
+            self.counter = self.counter + 1
+            if self.counter == 1:
+                raise requests.exceptions.ConnectionError()
+            r = requests.Response()
+            r.status_code = 200
+            r._content = b"{}"
+            return r
+        self.test_server.session.get = fake_request
+        self.test_server.session_get("https://example.com/api/1")
+        self.test_server.session_get_cache("https://example.com/cache/1", mem_cache=True)
+        self.test_server.session_get_cache("https://example.com/cache/1", mem_cache=True)
+        self.media_reader.state.save()
+
+        self.assertFalse(self.test_server.http_stats.pop())
+        rows = self.media_reader.state.list_http_stats(server_id=self.test_server.id, no_header=True)
+        server_id = self.test_server.id
+        self.assertEqual([[server_id, "example.com/api", "2", "1", "1"], [server_id, "example.com/cache", "1", "0", "0"]], [row.split("\t")[:5] for row in rows])
+        metrics = self.media_reader.state.list_http_stats(prometheus=True)
+        self.assertIn(f'amt_http_requests_total{{server="{server_id}",endpoint="example.com/api",status="error"}} 1', metrics)
+        self.assertIn(f'amt_http_cache_requests_total{{server="{server_id}",endpoint="example.com/cache",result="hit"}} 1', metrics)
+        self.assertIn(f'amt_http_request_duration_seconds_count{{server="{server_id}",endpoint="example.com/api"}} 2', metrics)
+
+        # saved stats accumulate across saves
+        self.test_server.session_get("https://example.com/api/2")
+        self.settings.http_stats_prometheus_file = os.path.join(TEST_HOME, "metrics.prom")
+        self.media_reader.state.save()
+        with open(self.settings.http_stats_prometheus_file) as f:
+            self.assertIn(f'amt_http_requests_total{{server="{server_id}",endpoint="example.com/api",status="200"}} 2', f.read())
+
+        # other servers are filtered out and endpoints without requests have no latency
+        saved_data = {"other_server": {"example.com/api": create_entry()}}
+        self.assertFalse(list(HTTPStats.get_rows(saved_data, server_id=server_id)))
+        self.assertEqual(0, HTTPStats.get_latency_percentile(saved_data["other_server"]["example.com/api"], .5))
+
     def test_session_get_post_with_failed_http_status(self):
         self.media_reader.settings.status_to_retry = [429]
         self.media_reader.settings.max_retries = 2
-        self.media_reader.settings.backoff_factor = .01
+        # TestServer doesn't sleep; a tiny factor would make giving up depend on how fast the request was
+        self.media_reader.settings.backoff_factor = 1
         always_fail = False
         self.counter = 0
 
@@ -652,6 +1067,86 @@ class ServerWorkflowsTest(BaseUnitTestClass):
         except ImportError:
             self.skipTest("cloudscraper not installed")
 
+    @unittest.skipUnless(importlib.util.find_spec("cloudscraper"), "cloudscraper not installed")
+    def test_session_remembers_cloudscraper_domains(self):
+        def create_response(status_code):
+            r = requests.Response()
+            r.status_code = status_code
+            return r
+
+        def set_up_sessions():
+            self.test_server.session.get = Mock(return_value=create_response(403))
+            RequestServer.cloudscraper = requests.Session()
+            RequestServer.cloudscraper.get = Mock(return_value=create_response(200))
+            self.test_server.maybe_need_cloud_scraper = True
+        url = "https://protected.example.com/api"
+        self.settings.max_retries = 1
+        set_up_sessions()
+        self.test_server.session_get(url)
+        self.test_server.session.get.assert_called()
+        self.assertTrue(self.test_server.is_cloudscraper_domain(url))
+
+        # the first request after a reload goes straight to cloudscraper
+        self.reload(save_state=True)
+        self.test_server = self.media_reader.get_server(TestServer.id)
+        self.assertTrue(self.test_server.is_cloudscraper_domain(url))
+        set_up_sessions()
+        self.test_server.session_get(url)
+        self.test_server.session.get.assert_not_called()
+        RequestServer.cloudscraper.get.assert_called_once()
+
+        self.settings.cloudscraper_domain_ttl_sec = 0
+        self.media_reader.state.cloudscraper_domains.clear()
+        set_up_sessions()
+        self.test_server.session_get(url)
+        self.assertFalse(self.test_server.is_cloudscraper_domain(url))
+
+    def test_save_cloudscraper_domains_drops_expired(self):
+        self.media_reader.state.cloudscraper_domains.update({"old.example.com": time.time() - 1, "new.example.com": time.time() + 100})
+        self.media_reader.state.save_cloudscraper_domains()
+        self.reload()
+        self.assertEqual(["new.example.com"], list(self.media_reader.state.cloudscraper_domains))
+
+    def test_mangadex_incremental_chapter_feed(self):
+        from ..servers.mangadex import Mangadex
+        server = Mangadex(self.media_reader.session, settings=self.settings)
+        urls, feed = [], []
+
+        def create_chapter(i):
+            return {"id": f"c{i}", "attributes": {"chapter": str(i), "title": f"Chapter {i}", "volume": None, "pages": 10, "translatedLanguage": "en", "publishAt": f"2024-01-0{i}T00:00:00+00:00", "updatedAt": f"2024-01-0{i}T00:00:00+00:00"}}
+
+        def get_feed(url, **kwargs):
+            urls.append(url)
+            since = url.split("updatedAtSince=")[1] if "updatedAtSince=" in url else ""
+            data = [chapter for chapter in feed if chapter["attributes"]["updatedAt"] > since]
+            return Mock(json=Mock(return_value={"data": data, "limit": 100, "total": len(data)}))
+        media_data = server.create_media_data(id="m1", name="Manga", lang="en")
+        stats = Counter(server.feed_stats)
+        with patch.object(server, "session_get", side_effect=get_feed):
+            feed.extend(map(create_chapter, (1, 2)))
+            server.update_media_data(media_data)
+            self.assertNotIn("updatedAtSince", urls[-1])
+            self.assertEqual(2, len(media_data["chapters"]))
+            self.assertEqual("2024-01-02T00:00:00+00:00", media_data["feed_cursor"])
+            self.assertEqual(1, server.feed_stats["full"] - stats["full"])
+
+            # only chapters updated since the last update are fetched
+            feed.append(create_chapter(3))
+            server.update_media_data(media_data)
+            self.assertIn("updatedAtSince=2024-01-02T00:00:00", urls[-1])
+            self.assertEqual(3, len(media_data["chapters"]))
+            self.assertEqual("2024-01-03T00:00:00+00:00", media_data["feed_cursor"])
+            self.assertEqual(1, server.feed_stats["incremental"] - stats["incremental"])
+            # chapters that weren't refetched aren't treated as removed
+            self.assertTrue(all(media_data["chapters"][chapter_id].update_state for chapter_id in ("c1", "c2")))
+
+            # everything is periodically refetched
+            media_data["last_full_sync"] = 0
+            server.update_media_data(media_data)
+            self.assertNotIn("updatedAtSince", urls[-1])
+            self.assertEqual(2, server.feed_stats["full"] - stats["full"])
+            self.assertEqual(3, server.feed_stats["requests"] - stats["requests"])
+
     def test_session_get_set_cookies(self):
         cookies = {"k1": "v1", "k2": "v2"}
         self.test_server.session_set_cookies(cookies)
@@ -887,6 +1382,15 @@ class MediaReaderTest(BaseUnitTestClass):
         self.media_reader.state.load_session_cookies()
         assert not self.media_reader.state.save_session_cookies()
 
+    def test_save_cookies_skips_expired(self):
+        self.media_reader.settings.no_save_session = False
+        self.media_reader.session.cookies.set("Expired", "value", expires=time.time() - 1)
+        self.media_reader.session.cookies.set("Key", "value", expires=time.time() + 100)
+        assert self.media_reader.state.save_session_cookies()
+        with open(self.settings.get_cookie_file()) as f:
+            names = [line.split("\t")[5] for line in f if line[0] != "#"]
+        self.assertEqual(["Key"], names)
+
     def test_load_cookies_external(self):
         """Verify our cookies can be read by default python cookie jars"""
         from http.cookiejar import MozillaCookieJar
@@ -1005,6 +1509,35 @@ class MediaReaderTest(BaseUnitTestClass):
         self.media_reader.sync_progress()
         self.assertFalse(any(map(lambda x: x["progress"], media_list)))
 
+    def test_for_each_as_completed_error(self):
+        def func(server):
+            if server.id == TestServer.id:
+                raise ValueError()
+            return [server.id]
+        server_list = [self.test_server, self.test_anime_server]
+        results = {server.id: results for server, results, _ in self.media_reader.for_each_as_completed(func, server_list)}
+        # servers that fail have no results
+        self.assertEqual({TestServer.id: [], TestAnimeServer.id: [TestAnimeServer.id]}, results)
+        self.assertRaises(ValueError, list, self.media_reader.for_each_as_completed(func, server_list, raiseException=True))
+
+    def test_profile_worker_threads(self):
+        def work_in_worker_thread():
+            return sum(range(1000))
+        profiler = Profiler().start()
+        try:
+            Job(2, [work_in_worker_thread] * 2).run()
+        finally:
+            profiler.stop()
+        self.assertTrue(any(func[2] == "work_in_worker_thread" for func in profiler.get_stats().stats))
+
+        if Profiler.PER_THREAD:
+            # what the hook does at the start of each thread; called directly since coverage can't trace profile hooks
+            num_profiles = len(profiler.profiles)
+            thread = threading.Thread(target=lambda: profiler._start_thread_profile() or work_in_worker_thread())
+            thread.start()
+            thread.join()
+            self.assertEqual(num_profiles + 1, len(profiler.profiles))
+
     def test_mark_read(self):
         media_list = self.add_test_media(TestServer.id, no_update=True)
         self.media_reader.mark_read(self.test_server.id)
@@ -1111,12 +1644,133 @@ class MediaReaderTest(BaseUnitTestClass):
         assert(media_data)
         assert media_data in list(self.media_reader.get_media())
 
+    def test_search_add_does_not_wait_on_slow_servers(self):
+        server = self.media_reader.get_server(TestServer.id)
+        media_data = server.list_media()[0]
+        slow_server = next(filter(lambda x: x.id != server.id, self.media_reader.get_servers()))
+        event = threading.Event()
+        self.addCleanup(event.set)
+        slow_server.search = lambda *args, **kwargs: event.wait() and []
+
+        self.settings.threads = len(self.media_reader.get_servers())
+        self.settings.search_timeout_sec = .1
+        self.assertEqual(media_data["name"], self.media_reader.search_add(media_data["name"], exact=True, no_add=True)["name"])
+        self.assertIsNone(self.media_reader.search_timings[slow_server.id])
+        self.assertIsNotNone(self.media_reader.search_timings[server.id])
+
+        # finding the requested media doesn't require a deadline
+        self.settings.search_timeout_sec = 0
+        self.assertEqual(media_data, self.media_reader.search_add(media_data["name"], media_id=media_data.global_id, no_add=True))
+        self.settings.search_stop_at_first_match = True
+        self.assertEqual(media_data["name"], self.media_reader.search_add(media_data["name"], exact=True, no_add=True)["name"])
+
+    def test_mount_http_adapters(self):
+        domain = self.test_server.domain
+        self.settings.set_field("threads", 32, TestServer.id)
+        self.media_reader.mount_http_adapters()
+        self.assertEqual(32, self.media_reader.session.get_adapter(f"https://{domain}/path")._pool_maxsize)
+        self.assertEqual(32, self.media_reader.session.get_adapter("https://cdn.example.com/1.jpg")._pool_maxsize)
+
+        self.settings.set_field("http_pool_size", 4, TestServer.id)
+        self.media_reader.mount_http_adapters()
+        self.assertEqual(4, self.media_reader.session.get_adapter(f"https://{domain}/path")._pool_maxsize)
+
+    def test_mount_http2_adapters(self):
+        self.settings.http2_domains = ["cdn.example.com"]
+        with patch.dict(sys.modules, {"httpx": None}):
+            self.media_reader.mount_http_adapters()
+        self.assertIsInstance(self.media_reader.session.get_adapter("https://cdn.example.com/1.jpg"), PooledHTTPAdapter)
+        if HAS_HTTP2:
+            self.media_reader.mount_http_adapters()
+            self.assertIsInstance(self.media_reader.session.get_adapter("https://cdn.example.com/1.jpg"), HTTP2Adapter)
+
+    @unittest.skipUnless(HAS_HTTP2, "httpx[http2] is needed to test")
+    def test_http2_adapter(self):
+        import httpx
+        requests_sent = []
+
+        def handler(request):
+            requests_sent.append(request)
+            if request.url.path == "/timeout":
+                raise httpx.ReadTimeout("timed out", request=request)
+            if request.url.path == "/error":
+                raise httpx.ConnectError("failed", request=request)
+            return httpx.Response(200, headers=[("Set-Cookie", "k1=v1"), ("Set-Cookie", "k2=v2"), ("Content-Type", "text/plain; charset=utf-8")], content=bytes(100))
+        adapter = HTTP2Adapter(transport=httpx.MockTransport(handler))
+        session = requests.Session()
+        session.mount("https://cdn.example.com/", adapter)
+        url = "https://cdn.example.com/1.jpg"
+        r = session.get(url, timeout=(1, 2))
+        self.assertEqual(bytes(100), r.content)
+        self.assertEqual("utf-8", r.encoding)
+        # cookies set by the response are sent with the next request
+        self.assertEqual({"k1": "v1", "k2": "v2"}, session.cookies.get_dict())
+        session.get(url)
+        self.assertEqual("k1=v1; k2=v2", requests_sent[-1].headers["Cookie"])
+
+        r = session.get(url, stream=True)
+        self.assertEqual(bytes(10), r.raw.read(10))
+        self.assertEqual(90, sum(map(len, r.iter_content(16))))
+        r.close()
+
+        # verify, cert and proxies get their own client
+        session.get(url, verify=False)
+        self.assertEqual(2, len(adapter.clients))
+        with patch.object(adapter, "get_client", return_value=adapter.get_client(True, None, None)) as get_client:
+            session.get(url, proxies={"https": "http://proxy.example.com:8080"}, cert=("cert", "key"))
+            get_client.assert_called_once_with(True, ("cert", "key"), "http://proxy.example.com:8080")
+
+        self.assertRaises(requests.exceptions.ReadTimeout, session.get, "https://cdn.example.com/timeout")
+        self.assertRaises(requests.exceptions.ConnectionError, session.get, "https://cdn.example.com/error")
+        adapter.close()
+        self.assertFalse(adapter.clients)
+
+    def test_http2_adapter_needs_h2(self):
+        with patch.dict(sys.modules, {"httpx": None}):
+            self.assertRaises(ImportError, HTTP2Adapter)
+        if HAS_HTTP2:
+            with patch("importlib.util.find_spec", return_value=None):
+                self.assertRaises(ImportError, HTTP2Adapter)
+
+    def test_http_stats_connection_reuse(self):
+        stats = self.test_server.http_stats
+        stats.pop()
+        stats.record_new_connection()
+        stats.record_request(self.test_server.id, "https://example.com/api/1", 200, 0)
+        stats.record_request(self.test_server.id, "https://example.com/api/2", 200, 0)
+        # connections opened outside of a recorded request aren't attributed to the next one
+        stats.record_new_connection()
+        stats.start_request()
+        stats.record_request(self.test_server.id, "https://example.com/api/3", 200, 0)
+        entry = stats.pop()[self.test_server.id]["example.com/api"]
+        self.assertEqual((3, 1), (entry["requests"], entry["connections"]))
+
+        for pool_class in (CountingHTTPConnectionPool, CountingHTTPSConnectionPool):
+            pool_class("example.com")._new_conn()
+        stats.record_request(self.test_server.id, "https://example.com/api/4", 200, 0)
+        self.assertEqual(2, stats.pop()[self.test_server.id]["example.com/api"]["connections"])
+
     def test_load_from_tracker(self):
         n = self.media_reader.load_from_tracker(1)
         self.assertTrue(n)
         self.assertEqual(n, len(self.media_reader.get_media_ids()))
         self.assertEqual(0, self.media_reader.load_from_tracker(1))
 
+    def test_load_from_tracker_skips_unchanged_entries(self):
+        self.media_reader.load_from_tracker(1)
+        tracker = self.media_reader.get_tracker()
+        media_data = next(iter(self.media_reader.get_tracked_media_index(tracker.id).values()))[0]
+        tracking_id = self.media_reader.get_tracker_info(media_data)[0]
+        self.media_reader.mark_chapters_until_n_as_read(media_data, -1, force=True)
+
+        # the entry hasn't changed so the local progress is left alone
+        self.media_reader.load_from_tracker(1)
+        self.assertFalse(media_data.get_last_read_chapter_number())
+
+        tracker.update([(tracking_id, 2, False)])
+        self.media_reader.load_from_tracker(1)
+        self.assertEqual(media_data.get_last_read_chapter_number(), 2)
+
     def test_play_with_env_list(self):
         self.add_test_media(server_id=TestServer.id, limit=1)
 
@@ -1831,6 +2485,27 @@ class ArgsTest(CliUnitTestClass):
         parse_args(media_reader=self.media_reader, args=["stats"])
         parse_args(media_reader=self.media_reader, args=["stats-update"])
 
+    def test_stats_http(self):
+        self.add_test_media()
+        parse_args(media_reader=self.media_reader, args=["stats-http"])
+        parse_args(media_reader=self.media_reader, args=["stats-http", "--prometheus"])
+        parse_args(media_reader=self.media_reader, args=["stats-http", "--no-header", TestServer.id])
+
+    def test_profile(self):
+        self.add_test_media()
+        for command, phase in (("update", "update_media"), ("download-unread", "download_chapter")):
+            with self.subTest(command=command):
+                parse_args(media_reader=self.media_reader, args=["--profile", command])
+                profile_dir = os.path.dirname(self.settings.get_profile_file(command))
+                base_names = {os.path.splitext(name)[0] for name in os.listdir(profile_dir) if name.startswith(command + "-")}
+                self.assertEqual(1, len(base_names))
+                base_path = os.path.join(profile_dir, base_names.pop())
+                self.assertTrue(os.path.exists(base_path + ".prof"))
+                with open(base_path + ".txt") as f:
+                    report = f.read()
+                for name in (phase, "state_save", "cumulative"):
+                    self.assertIn(name, report)
+
     def test_mark_read(self):
         media_list = self.add_test_media()
         media_data = media_list[0]
@@ -1871,6 +2546,38 @@ class ArgsTest(CliUnitTestClass):
                 self.assertEqual(media_data["progress"], media_data.get_last_read_chapter_number())
             self.reload()
 
+    def test_sync_progress_failed_entries(self):
+        parse_args(media_reader=self.media_reader, args=["--auto", "load"])
+        parse_args(media_reader=self.media_reader, args=["mark-read"])
+        media_list = list(self.media_reader.get_media())
+        progress = [media_data["progress"] for media_data in media_list]
+        tracking_ids = [self.media_reader.get_tracker_info(media_data)[0] for media_data in media_list]
+        with patch.object(TestTracker, "update", return_value=(1, tracking_ids[1:])):
+            self.assertEqual(self.media_reader.sync_progress(), 1)
+        self.assertEqual(media_list[0]["progress"], media_list[0].get_last_read_chapter_number())
+        self.assertEqual([media_data["progress"] for media_data in media_list[1:]], progress[1:])
+        self.assertEqual(self.media_reader.sync_progress(), 1)
+        self.assertEqual(self.media_reader.sync_progress(), 0)
+
+    def test_anilist_update_errors(self):
+        from requests.exceptions import HTTPError
+
+        from ..trackers.anilist import Anilist
+        tracker = Anilist(self.media_reader.session, self.settings)
+        updates = [(1, 1, False), (2, 1, False)]
+
+        def post_error(data):
+            return patch.object(tracker, "session_post", side_effect=HTTPError(response=Mock(json=Mock(return_value=data))))
+        with patch.object(tracker, "get_auth_header", return_value={}):
+            with patch.object(tracker, "session_post", return_value=Mock(json=Mock(return_value={"data": {"u0": {"id": 1}, "u1": {"id": 2}}}))):
+                self.assertEqual(tracker.update(updates), (1, []))
+            # only the entries the response reports as failed are failed
+            with post_error({"data": {"u0": {"id": 1}, "u1": None}, "errors": [{"message": "error"}]}):
+                self.assertEqual(tracker.update(updates), (1, [2]))
+            # a request that failed as a whole isn't turned into failed entries
+            with post_error({"data": None, "errors": [{"message": "Invalid token"}]}):
+                self.assertRaises(HTTPError, tracker.update, updates)
+
     def test_download(self):
         self.add_test_media(server_id=TestServer.id, limit=1)
         parse_args(media_reader=self.media_reader, args=["download-unread"])
@@ -1931,6 +2638,9 @@ class ArgsTest(CliUnitTestClass):
         self.assertEqual(offset_list, sorted([chapter_data["number"] for chapter_data in chapters.values()]))
         parse_args(media_reader=self.media_reader, args=["update"])
         self.assertEqual(offset_list, sorted([chapter_data["number"] for chapter_data in chapters.values()]))
+        # dirs of chapters that haven't been downloaded follow the new numbers
+        for chapter_data in chapters.values():
+            self.assertEqual(self.settings.get_chapter_dir_name(media_data, dict(chapter_data, dir_name=None)), chapter_data["dir_name"])
 
     def test_offset_none(self):
         def update_media_data(media_data, **kwargs):
@@ -2043,7 +2753,114 @@ class ArgsTest(CliUnitTestClass):
         media_data["chapters"].clear()
         self.media_reader.state.save()
         parse_args(media_reader=self.media_reader, args=["clean"])
-        self.assertEqual(1, len(os.listdir(self.settings.get_media_dir(media_data))))
+        self.assertEqual(1, len([x for x in os.listdir(self.settings.get_media_dir(media_data)) if x[0] != "."]))
+        self.assertFalse(self.test_server.get_download_manifest(media_data).chapters)
+
+    def test_reconcile(self):
+        media_data = self.add_test_media(TestServer.id, limit=1)[0]
+        self.media_reader.download_unread_chapters()
+        chapter_data = media_data.get_sorted_chapters()[0]
+        manifest = self.test_server.get_download_manifest(media_data)
+        self.assertTrue(all(self.test_server.is_fully_downloaded(media_data, chapter) for chapter in media_data.get_sorted_chapters()))
+        self.assertFalse(any(info["sha256"] for info in manifest.get_entry(chapter_data["id"])["files"].values()))
+
+        parse_args(media_reader=self.media_reader, args=["reconcile", "--checksums"])
+        self.assertTrue(all(info["sha256"] for info in manifest.get_entry(chapter_data["id"])["files"].values()))
+
+        # pages removed outside of amt are noticed by the change to the dir's mtime
+        chapter_dir = self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True)
+        mtime = os.stat(chapter_dir).st_mtime_ns
+        os.remove(self.test_server.get_children(media_data, chapter_data)[0])
+        # as if the page was removed a second later; the dir's mtime may not have changed on a coarse clock
+        os.utime(chapter_dir, ns=(mtime, mtime + 10**9))
+        self.assertFalse(self.test_server.is_fully_downloaded(media_data, chapter_data))
+        self.assertFalse(manifest.get_entry(chapter_data["id"]))
+        self.assertFalse(os.path.exists(self.test_server.get_download_marker(media_data, chapter_data)))
+        self.assertEqual(0, self.media_reader.reconcile())
+
+        # as are removed chapter dirs
+        chapter_data = media_data.get_sorted_chapters()[1]
+        shutil.rmtree(self.settings.get_chapter_dir(media_data, chapter_data, skip_create=True))
+        self.assertFalse(self.test_server.is_fully_downloaded(media_data, chapter_data))
+        self.assertTrue(self.test_server.download_chapter(media_data, chapter_data))
+        self.verify_download(media_data, chapter_data)
+
+        # other changes are picked up by reconcile
+        manifest.get_entry(chapter_data["id"])["files"]["missing_file"] = {"size": 0, "sha256": None}
+        self.assertEqual(1, self.media_reader.reconcile())
+        self.assertEqual(0, self.media_reader.reconcile())
+
+    def test_reconcile_legacy_download_markers(self):
+        media_data = self.add_test_media(TestServer.id, limit=1)[0]
+        self.media_reader.download_unread_chapters()
+        chapter_data = media_data.get_sorted_chapters()[0]
+        # markers are still written for older versions
+        for chapter in media_data.get_sorted_chapters():
+            marker = os.path.join(self.settings.get_chapter_dir(media_data, chapter), Server.DOWNLOAD_MARKER)
+            self.assertTrue(os.path.exists(marker))
+            if chapter is not chapter_data:
+                os.remove(marker)
+        os.remove(self.settings.get_download_manifest_file(media_data))
+        self.reload(save_state=True)
+        server = self.media_reader.get_server(TestServer.id)
+        media_data = self.media_reader.get_single_media(name=media_data.global_id)
+        self.assertEqual([chapter_data["id"]], [chapter["id"] for chapter in media_data.get_sorted_chapters() if server.is_fully_downloaded(media_data, chapter)])
+        self.assertEqual(3, len(server.get_children(media_data, chapter_data)))
+
+    def test_page_store(self):
+        self.settings.page_store = True
+        media_data = self.add_test_media(TestServer.id, limit=1)[0]
+        self.test_server.stable_page_ids = True
+        get_media_chapter_data = self.test_server.get_media_chapter_data
+
+        def get_pages_with_ids(media_data, chapter_data, **kwargs):
+            pages = get_media_chapter_data(media_data, chapter_data, **kwargs)
+            for i, page_data in enumerate(pages):
+                page_data["id"] = f"{chapter_data['id']}/{i}"
+            return pages
+        self.test_server.get_media_chapter_data = get_pages_with_ids
+        self.media_reader.download_unread_chapters()
+
+        # every test page is empty so they are all stored once
+        files = [path for server, media_data, chapter_data in self.get_all_chapters() for path in server.get_children(media_data, chapter_data)]
+        self.assertEqual(1, len({os.stat(path).st_ino for path in files}))
+        self.assertEqual(len(files) + 1, os.stat(files[0]).st_nlink)
+
+        # re-downloading pages with known ids just links them
+        chapter_data = media_data.get_sorted_chapters()[0]
+        self.test_server.remove_chapter_download(media_data, chapter_data)
+        with patch.object(self.test_server, "save_chapter_page", side_effect=AssertionError("Page was downloaded again")):
+            self.assertTrue(self.test_server.download_chapter(media_data, chapter_data))
+        self.verify_download(media_data, chapter_data)
+
+        self.media_reader.mark_read()
+        parse_args(media_reader=self.media_reader, args=["clean", "--remove-read"])
+        self.assertFalse(os.path.exists(files[0]))
+        store_files = [name for _, _, names in os.walk(self.settings.get_page_store_dir()) for name in names if name != "ids.json"]
+        self.assertFalse(store_files)
+
+    def test_page_store_fallbacks(self):
+        store_dir = os.path.join(TEST_HOME, "store")
+        store = PageStore(store_dir)
+        self.assertEqual(0, store.prune())
+        path = os.path.join(TEST_HOME, "page")
+        with open(path, "w") as f:
+            f.write("data")
+        # pages whose stored copy is gone have to be downloaded
+        self.assertFalse(store.link(get_file_checksum(path), os.path.join(TEST_HOME, "copy")))
+        # pages are left as they are if they can't be linked into the store
+        with patch("os.link", side_effect=OSError()):
+            checksum = store.add(path)
+        self.assertFalse(os.path.exists(store.get_blob_path(checksum)))
+        self.assertEqual(1, os.stat(path).st_nlink)
+
+        self.assertEqual(checksum, store.add(path))
+        store.set_id_checksum(TestServer.id, "page_id", checksum)
+        store.save()
+        self.assertEqual(checksum, PageStore(store_dir).get_id_checksum(TestServer.id, "page_id"))
+        os.remove(path)
+        self.assertEqual(1, store.prune())
+        self.assertIsNone(store.get_id_checksum(TestServer.id, "page_id"))
 
     def test_clean_servers(self):
         self.add_test_media(TestServer.id)
@@ -2202,6 +3019,14 @@ class ArgsTest(CliUnitTestClass):
         parse_args(media_reader=self.media_reader, args=["import", "--name", media_name, path_file])
         self.verify_import_test(media_name, chapter_title)
 
+    def test_import_multiple_media(self):
+        for i in range(2):
+            media_name = f"Media{i}"
+            path_file = os.path.join(TEST_HOME, f"{media_name} 01.txt")
+            open(path_file, "w").close()
+            parse_args(media_reader=self.media_reader, args=["import", "--name", media_name, path_file])
+            self.verify_import_test(media_name, f"{media_name} 01.txt")
+
     def test_import_directory(self):
         media_name, chapter_title, path, path_file = self.import_test_setup()
         self.assertTrue(os.path.exists(path_file))
@@ -38,6 +38,7 @@ class TestServer(Server):
     offset_chapter_num = 0
     use_real_cloud_scraper = False
     redirect_suffix = "/redirect"
+    cache_catalog = True
     version = 1
 
     def upgrade_state(self, media_data):
@@ -197,6 +198,7 @@ class TestServerLoginAlias(TestServerLogin):
 class TestServerLib(TestServerLogin):
     id = "test_server_lib"
     need_to_login_to_list = True
+    cache_catalog = False
 
     def get_media_list(self, **kwargs):
         assert not self.needs_authentication()
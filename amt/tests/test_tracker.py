@@ -10,6 +10,7 @@ class TestTracker(Tracker):
     def __init__(self, session, settings=None):
         super().__init__(session, settings)
         self.media_list = []
+        self.updated_at = {}
         for media_type in list(MediaType):
             self.media_list.extend([
                 [media_type, f"{media_type.name}1", 0, 0, tuple(), tuple(), None],
@@ -33,9 +34,11 @@ class TestTracker(Tracker):
     def update(self, list_of_updates):
         for id, progress, _ in list_of_updates:
             self.media_list[id][2] = progress
+            self.updated_at[id] = self.updated_at.get(id, 0) + 1
+        return 1, []
 
-    def get_tracker_list(self, user_name=None, id=None, status="CURRENT"):
-        return [self.get_media_dict(id=i, media_type=item[0], names={"English": item[1]}, progress=item[2], score=item[3], year=i, year_end=i, external_links=item[4], streaming_links=item[5], nextTimeStamp=item[6]) for i, item in enumerate(self.media_list)] if self.customList is None else self.customList
+    def get_tracker_list(self, user_name=None, id=None, status="CURRENT", full=False):
+        return [self.get_media_dict(id=i, media_type=item[0], names={"English": item[1]}, progress=item[2], score=item[3], year=i, year_end=i, external_links=item[4], streaming_links=item[5], nextTimeStamp=item[6], updated_at=self.updated_at.get(i, 0)) for i, item in enumerate(self.media_list)] if self.customList is None else self.customList
 
     def set_custom_anime_list(self, l, media_type=MediaType.ANIME):
         self.customList = [self.get_media_dict(i, media_type, {"English": item}, 1) for i, item in enumerate(l)]
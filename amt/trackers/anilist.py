@@ -1,5 +1,7 @@
 import logging
 
+from requests.exceptions import HTTPError
+
 from ..server import Tracker
 from ..util.media_type import MediaType
 
@@ -8,7 +10,7 @@ class Anilist(Tracker):
     id = "anilist"
     url = "https://graphql.anilist.co"
 
-    get_list_query = """
+    list_query = """
     query ($name: String, $id: Int, $pageIndex: Int, $status: MediaListStatus) { # Define which variables will be used in the query (id)
         Page(page: $pageIndex, perPage: 50) {
             pageInfo {
@@ -20,49 +22,56 @@ class Anilist(Tracker):
             }
         mediaList(userName: $name, userId: $id, status: $status) {
             id
-            mediaId
-            status
-            score
             progress
             progressVolumes
-            repeat
+            updatedAt%s
             media {
-                seasonYear
-                seasonInt
-                startDate{year}
-                endDate{year}
-                season
-                episodes
-                duration
-                nextAiringEpisode {
-                  airingAt
-                }
-                genres
-                tags {
-                    name
-                    rank
-                }
-                studios {
-                    nodes { name }
-                    edges { isMain }
-                }
                 type
                 format
                 title {
                     english
                     romaji
                 }
+                nextAiringEpisode {
+                  airingAt
+                }
                 externalLinks {
                   url
                 }
                 streamingEpisodes {
                   url
-                }
+                }%s
             }
         }
     }
 }
     """
+    # Only needed for stats
+    full_list_entry_fields = """
+            mediaId
+            status
+            score
+            repeat"""
+    full_list_media_fields = """
+                seasonYear
+                seasonInt
+                startDate{year}
+                endDate{year}
+                season
+                episodes
+                duration
+                genres
+                tags {
+                    name
+                    rank
+                }
+                studios {
+                    nodes { name }
+                    edges { isMain }
+                }"""
+    get_list_query = list_query % ("", "")
+    get_full_list_query = list_query % (full_list_entry_fields, full_list_media_fields)
+
     viewer_query = """
     query{
       Viewer{
@@ -72,23 +81,9 @@ class Anilist(Tracker):
     }
     """
 
-    update_list_query = """
-    mutation($id: Int, $progress: Int) {
-      SaveMediaListEntry(id: $id, progress: $progress) {
-        id
-        progress
-      }
-    }
-    """
-
-    update_list_query_volumes = """
-    mutation($id: Int, $progress: Int) {
-      SaveMediaListEntry(id: $id, progressVolumes: $progress) {
-        id
-        progressVolumes
-      }
-    }
-    """
+    update_list_mutation = "u{index}: SaveMediaListEntry(id: $id{index}, {field}: $progress{index}) {{ id {field} }}"
+    # max number of entries updated per request
+    update_batch_size = 50
 
     auth_url = "https://anilist.co/api/v2/oauth/authorize?client_id={}&response_type=token"
     client_id = 3793
@@ -115,51 +110,87 @@ class Anilist(Tracker):
             variables["id"] = user_info["id"]
         return variables
 
-    def get_full_list_data(self, user_name=None, id=None):
-        return self.get_tracker_list(user_name, id, status=None)
+    def get_stats_fields(self, x):
+        return dict(
+            score=x["score"],
+            time_spent=x["progress"] * x["media"]["duration"] if x["media"]["duration"] else x["progress"] or x["progressVolumes"] or 0,
+            year=x["media"]["startDate"]["year"],
+            year_end=x["media"]["endDate"]["year"],
+            season="{} {}".format(x["media"]["season"], x["media"]["seasonYear"]) if x["media"]["season"] else str(x["media"]["startDate"]["year"]),
+            genres=x["media"]["genres"],
+            tags=[x["name"] for x in x["media"]["tags"] if x["rank"] > 70],
+            studio=[n["name"] for n, e in zip(x["media"]["studios"]["nodes"], x["media"]["studios"]["edges"]) if e["isMain"]] if x["media"]["studios"]["nodes"] else []
+        )
 
-    def get_tracker_list(self, user_name=None, id=None, status="CURRENT"):
+    def get_tracker_list(self, user_name=None, id=None, status="CURRENT", full=False):
         variables = self._get_variables(user_name, id)
         if status:
             variables["status"] = status
-        # Make the HTTP Api request
-        pageIndex = 1
-        while True:
+        query = self.get_full_list_query if full else self.get_list_query
+        response_sizes = []
+
+        def get_page(pageIndex):
+            pageIndex = pageIndex or 1
             self.logger.info(f"Loading page {pageIndex}")
-            variables["pageIndex"] = pageIndex
-            response = self.session_post(self.url, json={"query": self.get_list_query, "variables": variables})
-            data = response.json()
+            response = self.session_post(self.url, json={"query": query, "variables": dict(variables, pageIndex=pageIndex)})
+            response_sizes.append(len(response.content))
+            return response.json()
+
+        pages = self.get_all_pages(get_page, lambda data: range(2, data["data"]["Page"]["pageInfo"]["lastPage"] + 1))
+        # lastPage is only an estimate so keep going until there are no more pages
+        while pages[-1]["data"]["Page"]["pageInfo"]["hasNextPage"]:
+            pages.append(get_page(pages[-1]["data"]["Page"]["pageInfo"]["currentPage"] + 1))
+        self.logger.info("Loaded %d pages of %s list data totaling %d bytes (avg %d bytes per page)", len(pages), "full" if full else "minimal", sum(response_sizes), sum(response_sizes) / len(response_sizes))
+        for data in pages:
             yield from [self.get_media_dict(
                 id=x["id"],
                 media_type=MediaType.ANIME if x["media"]["type"] == "ANIME" else MediaType.get(x["media"]["format"], MediaType.MANGA),
                 progress=x["progress"],
                 progress_volumes=x["progressVolumes"],
                 names=x["media"]["title"],
-                score=x["score"],
                 nextTimeStamp=x["media"]["nextAiringEpisode"]["airingAt"] if x["media"]["nextAiringEpisode"] else None,
-                time_spent=x["progress"] * x["media"]["duration"] if x["media"]["duration"] else x["progress"] or x["progressVolumes"] or 0,
-                year=x["media"]["startDate"]["year"],
-                year_end=x["media"]["endDate"]["year"],
-                season="{} {}".format(x["media"]["season"], x["media"]["seasonYear"]) if x["media"]["season"] else str(x["media"]["startDate"]["year"]),
                 external_links=[url["url"] for url in x["media"]["externalLinks"]],
                 streaming_links=[url["url"] for url in x["media"]["streamingEpisodes"]],
-                genres=x["media"]["genres"],
-                tags=[x["name"] for x in x["media"]["tags"] if x["rank"] > 70],
-                studio=[n["name"] for n, e in zip(x["media"]["studios"]["nodes"], x["media"]["studios"]["edges"]) if e["isMain"]] if x["media"]["studios"]["nodes"] else []
+                updated_at=x["updatedAt"],
+                **(self.get_stats_fields(x) if full else {})
             ) for x in data["data"]["Page"]["mediaList"]]
-            if data["data"]["Page"]["pageInfo"]["hasNextPage"]:
-                pageIndex += 1
-            else:
-                break
+
+    def get_update_query(self, list_of_updates):
+        """ Returns a single document that updates every entry with an aliased mutation per entry """
+        params, mutations, variables = [], [], {}
+        for index, (id, progress, progress_volumes) in enumerate(list_of_updates):
+            params.append(f"$id{index}: Int, $progress{index}: Int")
+            mutations.append(self.update_list_mutation.format(index=index, field="progressVolumes" if progress_volumes else "progress"))
+            variables[f"id{index}"] = id
+            variables[f"progress{index}"] = int(progress)
+        return "mutation({}) {{\n{}\n}}".format(", ".join(params), "\n".join(mutations)), variables
 
     def update(self, list_of_updates):
         headers = self.get_auth_header()
-        for id, progress, progress_volumes in list_of_updates:
-            variables = {"id": id, "progress": int(progress)}
-            logging.debug("Updating %d to %d, Volume: %d", id, int(progress), progress_volumes)
-            query = self.update_list_query_volumes if progress_volumes else self.update_list_query
-            response = self.session_post(self.url, json={"query": query, "variables": variables}, headers=headers)
-            logging.debug(response.text)
+        num_requests, failed = 0, []
+        for start in range(0, len(list_of_updates), self.update_batch_size):
+            batch = list_of_updates[start:start + self.update_batch_size]
+            for id, progress, progress_volumes in batch:
+                logging.debug("Updating %d to %d, Volume: %d", id, int(progress), progress_volumes)
+            query, variables = self.get_update_query(batch)
+            num_requests += 1
+            try:
+                data = self.session_post(self.url, json={"query": query, "variables": variables}, headers=headers).json()
+            except HTTPError as e:
+                # entries that could be saved are still returned along with the errors for the rest
+                try:
+                    data = e.response.json()
+                except ValueError:
+                    data = {}
+                # the whole request failed (like on an auth or server error) so nothing can be said about the entries
+                if not isinstance(data, dict) or not data.get("data"):
+                    raise
+            logging.debug(data)
+            for error in data.get("errors", []):
+                self.logger.error("Failed to update entry: %s", error.get("message"))
+            results = data.get("data") or {}
+            failed.extend(id for index, (id, _, _) in enumerate(batch) if not results.get(f"u{index}"))
+        return num_requests, failed
 
     def get_auth_url(self):
         return self.auth_url.format(self.client_id)
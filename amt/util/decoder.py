@@ -1,8 +1,15 @@
+import atexit
 import functools
+import json
 import logging
+import os
+import tempfile
+import time
 
-from PIL import Image
+from PIL import Image, ImageChops
+from collections import Counter
 from heapq import heappop, heappush
+from io import BytesIO
 from threading import Lock
 
 CACHE_SIZE = 60000
@@ -46,6 +53,73 @@ class Cell:
         return avg([compute_diff(self.pixels[self.x + n, self.y + self.h - offset + index], self.pixels[start_x + n, start_y + index]) for n in range(0, self.w, 2) for index in range(0, offset, 2)])
 
 
+class EdgeCosts:
+    """
+    Vectorized version of Cell.get_vert_diff/get_hor_diff
+
+    The image is converted to an array once and the cost of placing each cell
+    next to a given position is computed for all cells at the same time. The
+    costs for positions corresponding to other cells are computed eagerly;
+    other positions (like the edges of the image) are computed on demand.
+    """
+
+    def __init__(self, img, cells, offset):
+        import numpy
+        arr = numpy.asarray(img, dtype=numpy.float64)
+        if arr.ndim == 3:
+            # like compute_diff, ignore any alpha channel
+            arr = arr[:, :, :3]
+        self.arr = arr
+        W, H = cells[0].w, cells[0].h
+        self.rows, self.cols = numpy.arange(0, H, 2), numpy.arange(0, W, 2)
+        self.offset_cols, self.offset_rows = numpy.arange(0, offset[0], 2), numpy.arange(0, offset[1], 2)
+        self.right_strips = numpy.stack([arr[numpy.ix_(cell.y + self.rows, cell.x + W - offset[0] + self.offset_cols)] for cell in cells])
+        self.bottom_strips = numpy.stack([arr[numpy.ix_(cell.y + H - offset[1] + self.offset_rows, cell.x + self.cols)] for cell in cells])
+        self.vert_costs = {}
+        self.hor_costs = {}
+        for cell in cells:
+            self.get_vert_costs(cell.x, cell.y)
+            self.get_hor_costs(cell.x, cell.y)
+
+    @staticmethod
+    def compute_costs(strips, target):
+        import numpy
+        diff = strips - target
+        dist = numpy.sqrt(numpy.square(diff).sum(axis=-1)) if diff.ndim == 4 else numpy.abs(diff)
+        # lists are much faster to index into from python than arrays
+        return dist.reshape(len(strips), -1).mean(axis=1).tolist()
+
+    def get_vert_costs(self, start_x, start_y):
+        key = start_x, start_y
+        if key not in self.vert_costs:
+            import numpy
+            target = self.arr[numpy.ix_(start_y + self.rows, start_x + self.offset_cols)]
+            self.vert_costs[key] = EdgeCosts.compute_costs(self.right_strips, target)
+        return self.vert_costs[key]
+
+    def get_hor_costs(self, start_x, start_y):
+        key = start_x, start_y
+        if key not in self.hor_costs:
+            import numpy
+            target = self.arr[numpy.ix_(start_y + self.offset_rows, start_x + self.cols)]
+            self.hor_costs[key] = EdgeCosts.compute_costs(self.bottom_strips, target)
+        return self.hor_costs[key]
+
+
+class ArrayCell(Cell):
+    """ Cell whose edge costs are looked up from a shared EdgeCosts object """
+
+    def __init__(self, edge_costs, x, y, w, h, index):
+        super().__init__(None, x, y, w, h, index)
+        self.edge_costs = edge_costs
+
+    def get_vert_diff(self, start_x, start_y, offset):
+        return self.edge_costs.get_vert_costs(start_x, start_y)[self.index]
+
+    def get_hor_diff(self, start_x, start_y, offset):
+        return self.edge_costs.get_hor_costs(start_x, start_y)[self.index]
+
+
 @functools.lru_cache(maxsize=CACHE_SIZE)
 def find_neighbors(cells, right, bottom, offset, branch_factor=4):
     results = []
@@ -139,14 +213,41 @@ def paste(ref: Image.Image, img: Image.Image, orig_box, ref_box, offset_x=0, off
 
 class GenericDecoder:
 
+    # guards the solution caches and executor
     _lock = Lock()
     _cache = {}
     _pending_cache = {}
+    _executor = None
+    # the TOGGLES the worker processes of _executor were started with
+    _executor_toggles = None
+    # image size -> tile size of the last solution found for an image of that size; ordered from least to most recently used
+    _tile_sizes = {}
+    # super_key -> time the cached solution was last added or used
+    _cache_last_used = {}
+    _cache_file = None
+    # number of changes since the cache was last persisted
+    _unsaved_changes = 0
 
     # How many times we have to detect a solution before it is cached
     # 0 disables, 1 always adds a solution to cache
     PENDING_CACHE_NUM = 3
 
+    # Compute edge costs with numpy (if installed) instead of pixel by pixel
+    USE_NUMPY = True
+
+    # Max number of solutions (and tile sizes) persisted to disk; the least recently used are evicted first
+    MAX_PERSISTED_SOLUTIONS = 1000
+    # Number of changes batched before the cache is persisted; the rest are saved by save_cache at exit
+    SAVE_CACHE_EVERY = 10
+
+    # Try tile sizes whose boundaries line up with sharp changes in the image first
+    RANK_TILE_SIZES = True
+    # number of tile sizes tried before finding a solution -> number of images
+    candidates_tried = Counter()
+
+    # class attributes that change how images are solved; spawned worker processes are started with their values
+    TOGGLES = ("USE_NUMPY", "RANK_TILE_SIZES")
+
     @staticmethod
     def load_cells(pixels, num_rows, num_cols, W, H):
         cells = []
@@ -157,6 +258,12 @@ class GenericDecoder:
                 i += 1
         return cells
 
+    @staticmethod
+    def load_array_cells(img, num_rows, num_cols, W, H, offset):
+        cells = GenericDecoder.load_cells(None, num_rows, num_cols, W, H)
+        edge_costs = EdgeCosts(img, cells, offset)
+        return [ArrayCell(edge_costs, cell.x, cell.y, W, H, cell.index) for cell in cells]
+
     @staticmethod
     def descramble(cells, num_rows, num_cols, offset, max_iters=None, branch_factor=None):
         sorted_cells = find_solution(cells, num_rows, num_cols, offset, max_iters=max_iters, branch_factor=branch_factor)
@@ -175,27 +282,161 @@ class GenericDecoder:
         grid = tuple(grid)
         return grid
 
+    @staticmethod
+    def load_cache(cache_file):
+        """ Loads solutions persisted by previous processes and persists new ones to cache_file """
+        with GenericDecoder._lock:
+            if GenericDecoder._cache_file == cache_file:
+                return
+            if GenericDecoder._unsaved_changes:
+                GenericDecoder._save_cache()
+            GenericDecoder._cache_file = cache_file
+            try:
+                with open(cache_file, "r") as f:
+                    data = json.load(f)
+                solutions = [((key, tuple(size)), (tuple(map(tuple, grid)), W, H), last_used) for key, size, grid, W, H, last_used in data["solutions"]]
+                tile_sizes = [(tuple(size), (W, H)) for size, W, H in data["tile_sizes"]]
+            except FileNotFoundError:
+                return
+            except (KeyError, TypeError, ValueError) as e:
+                # solutions will just be searched for again
+                logging.warning("Ignoring malformed decoder cache %s: %s", cache_file, e)
+                return
+            for super_key, solution, last_used in solutions:
+                if super_key not in GenericDecoder._cache:
+                    GenericDecoder._cache[super_key] = solution
+                    GenericDecoder._cache_last_used[super_key] = last_used
+            for size, tile_size in tile_sizes:
+                GenericDecoder._tile_sizes.setdefault(size, tile_size)
+            GenericDecoder._evict_tile_sizes()
+
+    @staticmethod
+    def _evict_tile_sizes():
+        """ Drops the least recently used tile sizes past MAX_PERSISTED_SOLUTIONS; Caller must hold _lock """
+        while len(GenericDecoder._tile_sizes) > GenericDecoder.MAX_PERSISTED_SOLUTIONS:
+            del GenericDecoder._tile_sizes[next(iter(GenericDecoder._tile_sizes))]
+
+    @staticmethod
+    def save_cache():
+        """ Persists any changes not saved yet """
+        with GenericDecoder._lock:
+            if GenericDecoder._unsaved_changes:
+                GenericDecoder._save_cache()
+
+    @staticmethod
+    def _save_cache():
+        """ Persists the cache, evicting the least recently used solutions; Caller must hold _lock """
+        GenericDecoder._unsaved_changes = 0
+        if not GenericDecoder._cache_file:
+            return
+        super_keys = sorted(GenericDecoder._cache, key=lambda x: GenericDecoder._cache_last_used.get(x, 0), reverse=True)
+        for super_key in super_keys[GenericDecoder.MAX_PERSISTED_SOLUTIONS:]:
+            del GenericDecoder._cache[super_key]
+            GenericDecoder._cache_last_used.pop(super_key, None)
+        data = {
+            "solutions": [[super_key[0], super_key[1], *GenericDecoder._cache[super_key], GenericDecoder._cache_last_used.get(super_key, 0)] for super_key in super_keys[:GenericDecoder.MAX_PERSISTED_SOLUTIONS]],
+            "tile_sizes": [[size, W, H] for size, (W, H) in GenericDecoder._tile_sizes.items()]
+        }
+        os.makedirs(os.path.dirname(GenericDecoder._cache_file), exist_ok=True)
+        # a unique temp file so processes sharing the cache don't write over each other's
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(GenericDecoder._cache_file), prefix=".decoder_cache", delete=False) as f:
+            json.dump(data, f)
+        os.replace(f.name, GenericDecoder._cache_file)
+
+    @staticmethod
+    def get_cached_solution(super_key):
+        with GenericDecoder._lock:
+            solution = GenericDecoder._cache.get(super_key)
+            if solution:
+                GenericDecoder._cache_last_used[super_key] = time.time()
+            return solution
+
+    @staticmethod
+    def get_cached_tile_size(img_size):
+        with GenericDecoder._lock:
+            tile_size = GenericDecoder._tile_sizes.pop(img_size, None)
+            if tile_size:
+                # re-inserted to mark it as the most recently used
+                GenericDecoder._tile_sizes[img_size] = tile_size
+            return tile_size
+
+    @staticmethod
+    def add_solution_to_cache(super_key, grid, W, H):
+        with GenericDecoder._lock:
+            changed = GenericDecoder._tile_sizes.pop(super_key[1], None) != (W, H)
+            GenericDecoder._tile_sizes[super_key[1]] = W, H
+            GenericDecoder._evict_tile_sizes()
+            if super_key[0]:
+                GenericDecoder._pending_cache[super_key, grid] = GenericDecoder._pending_cache.get((super_key, grid), 0) + 1
+                if GenericDecoder.PENDING_CACHE_NUM and GenericDecoder._pending_cache[super_key, grid] >= GenericDecoder.PENDING_CACHE_NUM:
+                    GenericDecoder._cache[super_key] = grid, W, H
+                    GenericDecoder._cache_last_used[super_key] = time.time()
+                    changed = True
+            if changed:
+                GenericDecoder._unsaved_changes += 1
+                if GenericDecoder._unsaved_changes >= GenericDecoder.SAVE_CACHE_EVERY:
+                    GenericDecoder._save_cache()
+
+    @staticmethod
+    def record_candidates_tried(num):
+        with GenericDecoder._lock:
+            GenericDecoder.candidates_tried[num] += 1
+
+    @staticmethod
+    def get_edge_energy(img: Image):
+        """ Returns the mean absolute difference between each column (and row) of pixels and the previous one """
+        gray = img.convert("L")
+        col_diff = ImageChops.difference(gray, ImageChops.offset(gray, 1, 0)).convert("F")
+        row_diff = ImageChops.difference(gray, ImageChops.offset(gray, 0, 1)).convert("F")
+        return list(col_diff.resize((img.width, 1), Image.BOX).getdata()), list(row_diff.resize((1, img.height), Image.BOX).getdata())
+
+    @staticmethod
+    def rank_tile_sizes(img: Image, candidates):
+        """ Sorts candidates by how strongly the image changes along the tile boundaries they imply
+        The tiles are scrambled so the true boundaries have much more energy than the average row/column
+        """
+        col_energy, row_energy = GenericDecoder.get_edge_energy(img)
+
+        def boundary_score(energy, size):
+            boundaries = [energy[i] for i in range(size, len(energy), size)]
+            avg_energy = avg(energy)
+            return avg(boundaries) / avg_energy if boundaries and avg_energy else 0
+
+        return sorted(candidates, key=lambda x: boundary_score(col_energy, x[0]) + boundary_score(row_energy, x[1]), reverse=True)
+
+    @staticmethod
+    def search_for_solution(img: Image, W=201, H=192, max_iters=None, branch_factor=None, tile_size=None):
+        """ Tries tile sizes around W, H and returns the solution, grid and tile size of the first one that works
+        along with the number of tile sizes tried. If tile_size is given, it is tried first
+        """
+        candidates = [(w, h) for w in range(W - 16, W + 17, 8) for h in range(H - 16, H + 17, 8)]
+        if GenericDecoder.RANK_TILE_SIZES:
+            candidates = GenericDecoder.rank_tile_sizes(img, candidates)
+        if tile_size:
+            candidates.insert(0, tuple(tile_size))
+        candidates = list(dict.fromkeys(candidates))
+        for i, (w, h) in enumerate(candidates):
+            solution, sorted_cells = GenericDecoder.solve_image_helper(img, w, h, max_iters=max_iters, branch_factor=branch_factor)
+            if solution:
+                logging.debug("Found solution with tile size %dx%d after trying %d candidates", w, h, i + 1)
+                return solution, GenericDecoder.cells_to_int_matrix(sorted_cells), w, h, i + 1
+        return None, None, W, H, len(candidates)
+
     @staticmethod
     def solve_image(img: Image, W=201, H=192, key=None, max_iters=None, branch_factor=None) -> Image.Image:
         super_key = (key, img.size)
-        if key and super_key in GenericDecoder._cache:
+        cached_solution = GenericDecoder.get_cached_solution(super_key) if key else None
+        if cached_solution:
             logging.debug("Using cache; super_key %s", super_key)
-            grid, W, H = GenericDecoder._cache[super_key]
+            grid, W, H = cached_solution
             solution, _ = GenericDecoder.solve_image_helper(img, W, H, grid=grid)
             return solution
 
-        for w in range(W - 16, W + 17, 8):
-            for h in range(H - 16, H + 17, 8):
-                solution, sorted_cells = GenericDecoder.solve_image_helper(img, w, h, max_iters=max_iters, branch_factor=branch_factor)
-                if solution:
-                    if key:
-                        grid = GenericDecoder.cells_to_int_matrix(sorted_cells)
-
-                        GenericDecoder._pending_cache[super_key, grid] = GenericDecoder._pending_cache.get((super_key, grid), 0) + 1
-                        if GenericDecoder._pending_cache[super_key, grid] == GenericDecoder.PENDING_CACHE_NUM:
-                            GenericDecoder._cache[super_key] = grid, w, h
-                    return solution
-        return None
+        solution, grid, w, h, num_tried = GenericDecoder.search_for_solution(img, W, H, max_iters=max_iters, branch_factor=branch_factor, tile_size=GenericDecoder.get_cached_tile_size(img.size))
+        GenericDecoder.record_candidates_tried(num_tried)
+        if solution:
+            GenericDecoder.add_solution_to_cache(super_key, grid, w, h)
+        return solution
 
     @staticmethod
     def solve_image_helper(img: Image, W, H, grid=None, max_iters=None, branch_factor=None, offset=(16, 16)) -> Image.Image:
@@ -204,9 +445,14 @@ class GenericDecoder:
         num_rows = int((img_height) / H)
         if img_width - num_cols * W <= offset[0] or img_height - num_rows * H <= offset[1]:
             return None, None
-        pixels = img.load()
-
-        cells = GenericDecoder.load_cells(pixels, num_rows, num_cols, W, H)
+        cells = None
+        if GenericDecoder.USE_NUMPY and not grid:
+            try:
+                cells = GenericDecoder.load_array_cells(img, num_rows, num_cols, W, H, offset)
+            except ImportError:
+                pass
+        if not cells:
+            cells = GenericDecoder.load_cells(img.load(), num_rows, num_cols, W, H)
         assert cells
         sorted_cells = []
         if grid:
@@ -240,10 +486,78 @@ class GenericDecoder:
         return ref, sorted_cells
 
     @staticmethod
-    def descramble_and_save_img(data, path, key=None, max_iters=None, branch_factor=None):
-        orig = Image.open(data)
+    def get_executor(processes):
+        """ Returns the process pool used to solve images or None if images should be solved in the calling thread """
+        if processes == 0:
+            return None
+        toggles = get_toggles()
+        replaced_executor = None
+        with GenericDecoder._lock:
+            if GenericDecoder._executor is None or GenericDecoder._executor_toggles != toggles:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                replaced_executor = GenericDecoder._executor
+                GenericDecoder._executor = ProcessPoolExecutor(max_workers=processes if processes > 0 else None, mp_context=multiprocessing.get_context("spawn"), initializer=set_toggles, initargs=(toggles,))
+                GenericDecoder._executor_toggles = toggles
+            executor = GenericDecoder._executor
+        if replaced_executor:
+            # outside of the lock since it waits for the images still being solved with the old toggles
+            replaced_executor.shutdown()
+        return executor
+
+    @staticmethod
+    def shutdown_executor():
+        """ Stops the worker processes; the next call to get_executor starts new ones """
         with GenericDecoder._lock:
-            solution = GenericDecoder.solve_image(orig, key=key, max_iters=max_iters, branch_factor=None)
-            if solution and path:
-                solution.save(path)
-            return bool(solution)
+            executor, GenericDecoder._executor = GenericDecoder._executor, None
+        if executor:
+            executor.shutdown()
+
+    @staticmethod
+    def descramble_and_save_img(data, path, key=None, max_iters=None, branch_factor=None, W=201, H=192, processes=-1, cache_file=None):
+        """ Descrambles the image read from data and saves it to path
+
+        Solving is CPU bound so unless processes is 0, the search is done in a
+        separate process. Only the raw bytes are sent to the worker and only
+        the solved grid is sent back so the solution cache stays in this
+        process and is shared by all callers.
+        If cache_file is specified, solutions are persisted there across runs
+        """
+        if cache_file:
+            GenericDecoder.load_cache(cache_file)
+        img_bytes = data.read() if hasattr(data, "read") else data
+        orig = Image.open(BytesIO(img_bytes))
+        super_key = (key, orig.size)
+        executor = GenericDecoder.get_executor(processes)
+        if executor and not (key and GenericDecoder.get_cached_solution(super_key)):
+            grid, w, h, num_tried = executor.submit(search_for_solution_from_bytes, img_bytes, W, H, max_iters, branch_factor, GenericDecoder.get_cached_tile_size(orig.size)).result()
+            GenericDecoder.record_candidates_tried(num_tried)
+            solution = None
+            if grid:
+                GenericDecoder.add_solution_to_cache(super_key, grid, w, h)
+                solution, _ = GenericDecoder.solve_image_helper(orig, w, h, grid=grid)
+        else:
+            solution = GenericDecoder.solve_image(orig, W=W, H=H, key=key, max_iters=max_iters, branch_factor=branch_factor)
+        if solution and path:
+            solution.save(path)
+        return bool(solution)
+
+
+def get_toggles():
+    return {name: getattr(GenericDecoder, name) for name in GenericDecoder.TOGGLES}
+
+
+def set_toggles(toggles):
+    """ Initializer of worker processes; spawned processes don't inherit class attributes changed at runtime """
+    for name, value in toggles.items():
+        setattr(GenericDecoder, name, value)
+
+
+def search_for_solution_from_bytes(img_bytes, W, H, max_iters, branch_factor, tile_size):
+    """ Entry point for worker processes; returns just the grid and tile size to avoid sending the image back """
+    _, grid, w, h, num_tried = GenericDecoder.search_for_solution(Image.open(BytesIO(img_bytes)), W, H, max_iters=max_iters, branch_factor=branch_factor, tile_size=tile_size)
+    return grid, w, h, num_tried
+
+
+atexit.register(GenericDecoder.save_cache)
+atexit.register(GenericDecoder.shutdown_executor)
@@ -0,0 +1,41 @@
+CHUNK_SIZE = 1 << 20
+
+
+def xor_bytes(data, key, offset=0):
+    """ XORs data with key repeated over its length
+    offset is the position of data in the overall stream so it can be decrypted in chunks
+    """
+    if not data:
+        return b""
+    key = bytes(key)
+    offset %= len(key)
+    key = key[offset:] + key[:offset]
+    try:
+        import numpy
+        return (numpy.frombuffer(data, dtype=numpy.uint8) ^ numpy.resize(numpy.frombuffer(key, dtype=numpy.uint8), len(data))).tobytes()
+    except ImportError:
+        key_stream = (key * (len(data) // len(key) + 1))[:len(data)]
+        return (int.from_bytes(data, "little") ^ int.from_bytes(key_stream, "little")).to_bytes(len(data), "little")
+
+
+def xor_stream(chunks, key):
+    """ Lazily XORs each chunk with key, continuing the key stream from where the previous chunk left off """
+    offset = 0
+    for chunk in chunks:
+        yield xor_bytes(chunk, key, offset)
+        offset += len(chunk)
+
+
+def decrypt_stream(fp, cipher, block_size=16, chunk_size=CHUNK_SIZE):
+    """ Lazily decrypts the file like object fp and removes the pkcs7 padding from the end
+    cipher has to decrypt each block independently of the ones after it (ie ECB or CBC)
+    """
+    from Crypto.Util import Padding
+    chunk_size -= chunk_size % block_size
+    prev = None
+    for chunk in iter(lambda: fp.read(chunk_size), b""):
+        if prev is not None:
+            yield cipher.decrypt(prev)
+        prev = chunk
+    if prev is not None:
+        yield Padding.unpad(cipher.decrypt(prev), block_size, "pkcs7")
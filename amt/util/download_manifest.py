@@ -0,0 +1,106 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+
+from threading import Lock
+
+
+def get_file_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class DownloadManifest:
+    """
+    Records what has been downloaded for each chapter of a media so listing, playing and cleaning media don't have
+    to probe the filesystem.
+
+    A chapter's entry holds the name of the chapter dir it was downloaded to and, once complete, the size and checksum
+    of every file in it. While a chapter is being downloaded it instead holds the pages of the chapter along with
+    what is needed to resume pages that were cut off (see Server.save_chapter_page), so an interrupted download
+    can pick up where it left off without listing the chapter again.
+    Saved as json in the media's dir; chapters are keyed by id
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        try:
+            with open(path, "r") as f:
+                self.chapters = json.load(f)
+            self.exists = True
+        except (json.decoder.JSONDecodeError, FileNotFoundError):
+            self.chapters = {}
+            self.exists = False
+
+    def get_entry(self, chapter_id):
+        return self.chapters.get(str(chapter_id))
+
+    def is_complete(self, chapter_id, dir_name):
+        entry = self.chapters.get(str(chapter_id))
+        return bool(entry and entry.get("complete") and entry["dir"] == dir_name)
+
+    def get_files(self, chapter_id, dir_name):
+        """ Returns the names of the files of the chapter or None if it isn't completely downloaded to dir_name """
+        return sorted(self.chapters[str(chapter_id)]["files"]) if self.is_complete(chapter_id, dir_name) else None
+
+    def get_pages(self, chapter_id, dir_name, stream_index=0):
+        entry = self.chapters.get(str(chapter_id))
+        return entry["pages"] if entry and entry["dir"] == dir_name and entry.get("pages") and entry.get("stream_index", 0) == stream_index else None
+
+    def set_pages(self, chapter_id, dir_name, pages, stream_index=0):
+        """ Records pages, a list of page data, and returns False if they can't be saved """
+        try:
+            json.dumps(pages)
+        except TypeError:
+            # like m3u8 segments whose encryption key is an object
+            return False
+        with self.lock:
+            self.chapters[str(chapter_id)] = {"dir": dir_name, "complete": False, "pages": pages, "stream_index": stream_index}
+        self.save()
+        return True
+
+    def set_complete(self, chapter_id, dir_name, files, mtime=None, save=True):
+        """
+        files maps the name of each file of the chapter to its size and sha256 checksum (or None).
+        mtime is that of the chapter dir (in ns) once everything was written to it
+        """
+        with self.lock:
+            self.chapters[str(chapter_id)] = {"dir": dir_name, "complete": True, "files": files, "mtime": mtime}
+        if save:
+            self.save()
+
+    def remove(self, chapter_id, save=True):
+        with self.lock:
+            if self.chapters.pop(str(chapter_id), None) is None:
+                return
+        if save:
+            self.save()
+
+    def prune(self, chapter_ids):
+        """ Drops the entries of chapters other than chapter_ids """
+        with self.lock:
+            stale = self.chapters.keys() - set(map(str, chapter_ids))
+            for chapter_id in stale:
+                del self.chapters[chapter_id]
+        if stale:
+            self.save()
+
+    def save(self, force=False):
+        """ Writes the manifest; an empty manifest is only written if it already exists or force is set """
+        with self.lock:
+            if not self.chapters and not self.exists and not force:
+                return
+            # page data can be updated by download threads while this is written
+            chapters = copy.deepcopy(self.chapters)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # a unique temp file so processes updating the same media don't write over each other's
+            with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(self.path), prefix=".manifest", delete=False) as f:
+                json.dump(chapters, f)
+            os.replace(f.name, self.path)
+            self.exists = True
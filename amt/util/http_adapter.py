@@ -0,0 +1,122 @@
+import importlib.util
+
+from http.client import HTTPMessage
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ConnectionError, ReadTimeout
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+from threading import Lock
+from types import SimpleNamespace
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .http_stats import http_stats
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        http_stats.record_new_connection()
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        http_stats.record_new_connection()
+        return super()._new_conn()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that reports every connection it opens to http_stats so keep-alive reuse can be measured
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+
+class HTTP2Response:
+    """ Minimal file-like wrapper so requests can read the body of a httpx response """
+
+    def __init__(self, response):
+        self.response = response
+        self.chunks = response.iter_bytes()
+        self.buffer = b""
+        # requests extracts the cookies set by the response into the session from the headers of the original response
+        headers = HTTPMessage()
+        for key, value in response.headers.multi_items():
+            headers[key] = value
+        self._original_response = SimpleNamespace(msg=headers)
+
+    def read(self, amt=None, **kwargs):
+        while amt is None or len(self.buffer) < amt:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        data, self.buffer = (self.buffer, b"") if amt is None else (self.buffer[:amt], self.buffer[amt:])
+        return data
+
+    def close(self):
+        self.response.close()
+
+    def release_conn(self):
+        self.close()
+
+
+class HTTP2Adapter(BaseAdapter):
+    """
+    Sends requests over HTTP/2 with httpx, multiplexing them over a single connection per host.
+    A client is kept for every combination of verify, cert and proxy requests are sent with.
+    Raises ImportError if httpx or h2 aren't installed
+    """
+
+    def __init__(self, max_connections=10, transport=None):
+        import httpx
+        if not importlib.util.find_spec("h2"):
+            raise ImportError("h2 is needed for HTTP/2")
+        super().__init__()
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.transport = transport
+        self.clients = {}
+        self.lock = Lock()
+
+    def get_client(self, verify, cert, proxy):
+        import httpx
+        key = (verify, tuple(cert) if isinstance(cert, (list, tuple)) else cert, proxy)
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = httpx.Client(http2=True, verify=verify, cert=cert, proxy=proxy, limits=self.limits, transport=self.transport)
+            return self.clients[key]
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        import httpx
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        client = self.get_client(verify, cert, select_proxy(request.url, proxies))
+        try:
+            http2_request = client.build_request(request.method, request.url, headers=request.headers, content=request.body, timeout=timeout)
+            r = client.send(http2_request, stream=True)
+        except httpx.TimeoutException as e:
+            raise ReadTimeout(e, request=request)
+        except httpx.TransportError as e:
+            raise ConnectionError(e, request=request)
+
+        response = Response()
+        response.status_code = r.status_code
+        response.reason = r.reason_phrase
+        response.headers = CaseInsensitiveDict(r.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = HTTP2Response(r)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        if not stream:
+            response.content
+        return response
+
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
@@ -0,0 +1,164 @@
+import re
+
+from threading import Lock, local
+from urllib.parse import urlparse
+
+# upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (.1, .25, .5, 1, 2.5, 5, 10, 30)
+
+first_path_segment_regex = re.compile(r"^/?[^/?]*")
+
+
+def get_endpoint(url):
+    """ Groups urls by host and first path segment so media/chapter ids don't create a new endpoint per request """
+    parsed = urlparse(url or "")
+    return parsed.netloc + first_path_segment_regex.match(parsed.path).group(0)
+
+
+def create_entry():
+    return {"requests": 0, "status": {}, "retries": 0, "backoff_sec": 0, "bytes_in": 0, "bytes_out": 0, "cache_hits": 0, "cache_misses": 0, "connections": 0, "latency_sec": 0, "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+
+
+def merge_entries(dest, src):
+    for key, value in src.items():
+        if key == "status":
+            for status, count in value.items():
+                dest[key][status] = dest[key].get(status, 0) + count
+        elif key == "latency_buckets":
+            dest[key] = [a + b for a, b in zip(dest[key], value)]
+        else:
+            # stats saved by older versions may be missing newer keys
+            dest[key] = dest.get(key, 0) + value
+
+
+class HTTPStats:
+    """
+    Counts the requests made by each server broken down by endpoint.
+    Everything recorded since the last call to pop is merged into the saved stats when the state is saved
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.data = {}
+        # connections opened by the current thread since its last recorded request; see util.http_adapter
+        self.local = local()
+
+    def get_entry(self, server_id, url):
+        return self.data.setdefault(server_id, {}).setdefault(get_endpoint(url), create_entry())
+
+    def record_new_connection(self):
+        self.local.new_connections = getattr(self.local, "new_connections", 0) + 1
+
+    def start_request(self):
+        """ Forgets connections opened by requests that weren't recorded """
+        self.local.new_connections = 0
+
+    def record_request(self, server_id, url, status, latency, bytes_in=0, bytes_out=0):
+        connections = getattr(self.local, "new_connections", 0)
+        self.local.new_connections = 0
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+        with self.lock:
+            entry = self.get_entry(server_id, url)
+            entry["requests"] += 1
+            entry["status"][str(status)] = entry["status"].get(str(status), 0) + 1
+            entry["latency_sec"] += latency
+            entry["latency_buckets"][bucket] += 1
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+            entry["connections"] += connections
+
+    def record_retry(self, server_id, url, backoff_sec=0):
+        with self.lock:
+            entry = self.get_entry(server_id, url)
+            entry["retries"] += 1
+            entry["backoff_sec"] += backoff_sec
+
+    def record_cache(self, server_id, url, hit):
+        with self.lock:
+            self.get_entry(server_id, url)["cache_hits" if hit else "cache_misses"] += 1
+
+    def pop(self):
+        """ Returns and clears everything recorded so far """
+        with self.lock:
+            data, self.data = self.data, {}
+        return data
+
+    @staticmethod
+    def merge(saved_data, data):
+        for server_id, endpoints in data.items():
+            for endpoint, entry in endpoints.items():
+                merge_entries(saved_data.setdefault(server_id, {}).setdefault(endpoint, create_entry()), entry)
+        return saved_data
+
+    @staticmethod
+    def get_latency_percentile(entry, percentile):
+        """ Returns the upper bound of the bucket containing the given percentile """
+        target = entry["requests"] * percentile
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), entry["latency_buckets"]):
+            total += count
+            if count and total >= target:
+                return bound
+        return 0
+
+    @staticmethod
+    def get_headers():
+        return "\t".join(("Server", "Endpoint", "Requests", "Errors", "Retries", "Backoff(s)", "KB in", "KB out", "Cache hit%", "Avg(ms)", "P50(ms)", "P95(ms)", "Conns", "Reuse%"))
+
+    @staticmethod
+    def get_rows(saved_data, server_id=None):
+        for sid, endpoints in sorted(saved_data.items()):
+            if server_id and sid != server_id:
+                continue
+            for endpoint, entry in sorted(endpoints.items(), key=lambda x: -x[1]["requests"]):
+                errors = sum(count for status, count in entry["status"].items() if not status.startswith("2"))
+                cache_total = entry["cache_hits"] + entry["cache_misses"]
+                yield "\t".join(map(str, (
+                    sid, endpoint, entry["requests"], errors, entry["retries"], round(entry["backoff_sec"], 1),
+                    entry["bytes_in"] >> 10, entry["bytes_out"] >> 10,
+                    round(100 * entry["cache_hits"] / cache_total) if cache_total else "-",
+                    round(1000 * entry["latency_sec"] / entry["requests"]) if entry["requests"] else "-",
+                    *(round(1000 * HTTPStats.get_latency_percentile(entry, p)) if entry["requests"] else "-" for p in (.5, .95)),
+                    entry.get("connections", 0),
+                    max(0, round(100 * (1 - entry.get("connections", 0) / entry["requests"]))) if entry["requests"] else "-"
+                )))
+
+    @staticmethod
+    def to_prometheus(saved_data):
+        """ Returns saved_data in the Prometheus text exposition format """
+        metrics = {
+            "amt_http_requests_total": ("counter", []),
+            "amt_http_retries_total": ("counter", []),
+            "amt_http_backoff_seconds_total": ("counter", []),
+            "amt_http_received_bytes_total": ("counter", []),
+            "amt_http_sent_bytes_total": ("counter", []),
+            "amt_http_cache_requests_total": ("counter", []),
+            "amt_http_connections_opened_total": ("counter", []),
+            "amt_http_request_duration_seconds": ("histogram", []),
+        }
+        for server_id, endpoints in sorted(saved_data.items()):
+            for endpoint, entry in sorted(endpoints.items()):
+                labels = 'server="{}",endpoint="{}"'.format(server_id, endpoint.replace("\\", "\\\\").replace('"', '\\"'))
+                for status, count in sorted(entry["status"].items()):
+                    metrics["amt_http_requests_total"][1].append(f'amt_http_requests_total{{{labels},status="{status}"}} {count}')
+                metrics["amt_http_retries_total"][1].append(f"amt_http_retries_total{{{labels}}} {entry['retries']}")
+                metrics["amt_http_backoff_seconds_total"][1].append(f"amt_http_backoff_seconds_total{{{labels}}} {entry['backoff_sec']}")
+                metrics["amt_http_received_bytes_total"][1].append(f"amt_http_received_bytes_total{{{labels}}} {entry['bytes_in']}")
+                metrics["amt_http_sent_bytes_total"][1].append(f"amt_http_sent_bytes_total{{{labels}}} {entry['bytes_out']}")
+                for result, key in (("hit", "cache_hits"), ("miss", "cache_misses")):
+                    metrics["amt_http_cache_requests_total"][1].append(f'amt_http_cache_requests_total{{{labels},result="{result}"}} {entry[key]}')
+                metrics["amt_http_connections_opened_total"][1].append(f"amt_http_connections_opened_total{{{labels}}} {entry.get('connections', 0)}")
+                total = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), entry["latency_buckets"]):
+                    total += count
+                    metrics["amt_http_request_duration_seconds"][1].append(f'amt_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {total}')
+                metrics["amt_http_request_duration_seconds"][1].append(f"amt_http_request_duration_seconds_sum{{{labels}}} {entry['latency_sec']}")
+                metrics["amt_http_request_duration_seconds"][1].append(f"amt_http_request_duration_seconds_count{{{labels}}} {entry['requests']}")
+        lines = []
+        for name, (metric_type, samples) in metrics.items():
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+http_stats = HTTPStats()
@@ -1,3 +1,4 @@
+import functools
 import os
 import re
 
@@ -10,6 +11,14 @@ id_formatter_regex = re.compile(r"\W+")
 
 media_name_regex = re.compile("(, )?(Vol\.|volume|Volume|Part|) \d+\.?\d*$")
 
+# used to derive alternative names from a media name
+parenthesized_regex = re.compile(r"\([^)]*\)")
+trailing_non_word_regex = re.compile(r"\W*$")
+punctuation_regex = re.compile(r"[^\w\s]")
+trailing_punctuation_regex = re.compile(r"\s*[^\w\d\s]+.*$")
+common_prefix_regex = re.compile(r"(The |A |That |\W.*$)")
+non_word_char_regex = re.compile(r"\W+")
+
 
 def get_media_name_from_file(base_name, is_dir=True):
     match = media_dir_regex.search(base_name)
@@ -32,13 +41,75 @@ def get_number_from_file_name(file_name, media_name="", default_num=0):
     return float(max(matches, key=len)) if matches else default_num
 
 
-def get_alt_names(media_name):
-    media_name = re.sub("\([^)]*\)", "", media_name).strip()
-    return list(filter(lambda x: len(x) > min(2, len(media_name)) or x == media_name, dict.fromkeys([media_name, media_name.split(" Season")[0], re.sub(r"\W*$", "", media_name), re.sub(r"[^\w\s]", "", media_name).split()[-1], re.sub(r"\s*[^\w\d\s]+.*$", "", media_name), re.sub(r"(The |A |That |\W.*$)", "", media_name), get_media_name_from_file(media_name, is_dir=True)])))
+@functools.lru_cache(maxsize=4096)
+def normalize_name(media_name):
+    """ Returns the alternative names of media_name along with the set of lower case words in it
+    The same names are normalized once per tracker entry, search term and server, so the results are cached
+    """
+    tokens = frozenset(non_word_char_regex.split(media_name.lower()))
+    media_name = parenthesized_regex.sub("", media_name).strip()
+    alt_names = dict.fromkeys([media_name, media_name.split(" Season")[0], trailing_non_word_regex.sub("", media_name), punctuation_regex.sub("", media_name).split()[-1], trailing_punctuation_regex.sub("", media_name), common_prefix_regex.sub("", media_name), get_media_name_from_file(media_name, is_dir=True)])
+    return tuple(filter(lambda x: len(x) > min(2, len(media_name)) or x == media_name, alt_names)), tokens
 
 
-def find_media_with_similar_name_in_list(media_names, media_list):
-    media_names = list(map(str.lower, media_names))
-    for media_data in media_list:
-        if any(map(lambda name: name in media_data["name"].lower() or ("season_title" in media_data and name in media_data["season_title"].lower()) or media_data["name"].lower() in name, media_names)):
-            yield media_data
+def get_alt_names(media_name):
+    return list(normalize_name(media_name)[0])
+
+
+def get_name_tokens(media_name):
+    return normalize_name(media_name)[1]
+
+
+class MediaNameIndex:
+    """ Index over the names and season titles of a list of media
+    Used to find the media whose name contains, or is contained in, a given name
+    without comparing the name against every media
+    """
+    NGRAM_LEN = 3
+
+    def __init__(self, names):
+        self.names = [(name.lower(), season_title.lower()) for name, season_title in names]
+        self.ngrams = {}
+        self.positions_by_name = {}
+        for i, (name, season_title) in enumerate(self.names):
+            self.positions_by_name.setdefault(name, []).append(i)
+            for text in (name, season_title):
+                for ngram in self.get_ngrams(text):
+                    self.ngrams.setdefault(ngram, set()).add(i)
+        self.name_lengths = sorted({len(name) for name in self.positions_by_name})
+
+    def get_ngrams(self, text):
+        return {text[i:i + self.NGRAM_LEN] for i in range(len(text) - self.NGRAM_LEN + 1)}
+
+    def get_candidates(self, name):
+        if len(name) < self.NGRAM_LEN:
+            return range(len(self.names))
+        postings = sorted((self.ngrams.get(ngram, ()) for ngram in self.get_ngrams(name)), key=len)
+        return postings[0].intersection(*postings[1:]) if postings[0] else ()
+
+    def find(self, media_names):
+        """ Returns the sorted positions of the media similar to any of media_names """
+        matches = set()
+        for name in map(str.lower, media_names):
+            matches.update(i for i in self.get_candidates(name) if name in self.names[i][0] or name in self.names[i][1])
+            # media whose name is contained in name
+            for length in self.name_lengths:
+                if length > len(name):
+                    break
+                for i in range(len(name) - length + 1):
+                    matches.update(self.positions_by_name.get(name[i:i + length], ()))
+        return sorted(matches)
+
+
+@functools.lru_cache(maxsize=16)
+def get_media_name_index(names):
+    return MediaNameIndex(names)
+
+
+def find_media_with_similar_name_in_list(media_names, media_list, index=None):
+    media_list = list(media_list)
+    if index is None:
+        # the index is cached so repeated lookups against the same media only pay for building the key
+        index = get_media_name_index(tuple((media_data["name"], media_data.get("season_title", "")) for media_data in media_list))
+    for i in index.find(media_names):
+        yield media_list[i]
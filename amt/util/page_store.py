@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+
+from threading import Lock
+
+from .download_manifest import get_file_checksum
+
+
+class PageStore:
+    """
+    Content addressed store of downloaded files. Every file is kept once, named by its sha256, and hard linked into
+    the chapter dirs that contain it.
+    The store also remembers the checksum of pages whose ids identify their content (see Server.stable_page_ids) so
+    they can be linked from the store instead of being downloaded again
+    """
+    # instances keyed by dir; shared by all servers
+    _stores = {}
+    _stores_lock = Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self._ids = None
+        self.dirty = False
+
+    @classmethod
+    def get(clazz, path):
+        with clazz._stores_lock:
+            if path not in clazz._stores:
+                clazz._stores[path] = clazz(path)
+            return clazz._stores[path]
+
+    def get_blob_path(self, checksum):
+        return os.path.join(self.path, checksum[:2], checksum)
+
+    def get_ids_file(self):
+        return os.path.join(self.path, "ids.json")
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            try:
+                with open(self.get_ids_file(), "r") as f:
+                    self._ids = json.load(f)
+            except (json.decoder.JSONDecodeError, FileNotFoundError):
+                self._ids = {}
+        return self._ids
+
+    def add(self, path, checksum=None):
+        """
+        Adds the file at path to the store. If an identical file is already stored, path is replaced with a link to it.
+        Returns the checksum of the file
+        """
+        checksum = checksum or get_file_checksum(path)
+        blob_path = self.get_blob_path(checksum)
+        try:
+            if os.path.exists(blob_path):
+                if not os.path.samefile(blob_path, path):
+                    temp_path = path + ".tmp-link"
+                    os.link(blob_path, temp_path)
+                    os.replace(temp_path, path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.link(path, blob_path)
+        except OSError as e:
+            # like when the store is on another file system
+            logging.debug("Could not add %s to the page store: %s", path, e)
+        return checksum
+
+    def link(self, checksum, path):
+        """ Hard links the stored file with checksum to path and returns False if there isn't one """
+        try:
+            os.link(self.get_blob_path(checksum), path)
+            return True
+        except OSError:
+            return False
+
+    def get_id_checksum(self, server_id, page_id):
+        with self.lock:
+            return self.ids.get(f"{server_id}:{page_id}")
+
+    def set_id_checksum(self, server_id, page_id, checksum):
+        with self.lock:
+            if self.ids.get(f"{server_id}:{page_id}") != checksum:
+                self.ids[f"{server_id}:{page_id}"] = checksum
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            temp_path = self.get_ids_file() + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(self.ids, f)
+            os.replace(temp_path, self.get_ids_file())
+            self.dirty = False
+
+    def prune(self):
+        """ Removes stored files that are no longer linked from any chapter dir; returns the number removed """
+        if not os.path.isdir(self.path):
+            return 0
+        removed = set()
+        for entry in os.scandir(self.path):
+            if entry.is_dir():
+                for blob in os.scandir(entry.path):
+                    if blob.stat().st_nlink == 1:
+                        os.remove(blob.path)
+                        removed.add(blob.name)
+        if removed:
+            with self.lock:
+                for key, checksum in list(self.ids.items()):
+                    if checksum in removed:
+                        del self.ids[key]
+                        self.dirty = True
+            self.save()
+        return len(removed)
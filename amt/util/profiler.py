@@ -0,0 +1,104 @@
+import io
+import os
+import sys
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Spans:
+    """
+    Wall clock time spent in the major phases of a command (loading state, updating each media, downloading each chapter, ...)
+    Phases may happen once per item (ie per media) so the time is kept per phase and item
+    """
+    lock = threading.Lock()
+    timings = defaultdict(lambda: defaultdict(float))
+
+    @staticmethod
+    @contextmanager
+    def span(phase, item=""):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with Spans.lock:
+                Spans.timings[phase][item] += elapsed
+
+    @staticmethod
+    def pop():
+        with Spans.lock:
+            timings = dict(Spans.timings)
+            Spans.timings.clear()
+        return timings
+
+    @staticmethod
+    def format(timings, num_items=5):
+        lines = ["{:20}\t{:>6}\t{:>9}\t{:>9}".format("Phase", "Count", "Total(s)", "Max(s)")]
+        for phase, items in sorted(timings.items(), key=lambda x: -sum(x[1].values())):
+            lines.append("{:20}\t{:6d}\t{:9.3f}\t{:9.3f}".format(phase, len(items), sum(items.values()), max(items.values())))
+            if len(items) > 1:
+                for item, elapsed in sorted(items.items(), key=lambda x: -x[1])[:num_items]:
+                    lines.append("  {:18}\t{:6}\t{:9.3f}".format(item, "", elapsed))
+        return "\n".join(lines)
+
+
+span = Spans.span
+
+
+class Profiler:
+    """
+    Before python 3.12, cProfile only profiles the thread that enabled it, so a profiler is also started in every
+    thread spawned while this is active (ie by Job) and all of them are combined into one report.
+    Since 3.12 a single profiler sees every thread and only one can be active at a time
+    """
+    PER_THREAD = sys.version_info < (3, 12)
+
+    def __init__(self):
+        import cProfile
+        self.lock = threading.Lock()
+        self.profiles = [cProfile.Profile()]
+
+    def _start_thread_profile(self, *args):
+        # installed via threading.setprofile so this is called once at the start of each new thread
+        sys.setprofile(None)
+        profile = type(self.profiles[0])()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        if self.PER_THREAD:
+            threading.setprofile(self._start_thread_profile)
+        self.profiles[0].enable()
+        return self
+
+    def stop(self):
+        self.profiles[0].disable()
+        if self.PER_THREAD:
+            threading.setprofile(None)
+
+    def get_stats(self):
+        import pstats
+        stats = pstats.Stats(self.profiles[0])
+        with self.lock:
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        return stats
+
+    def save(self, base_path, limit=50):
+        """ Saves the raw stats to base_path.prof (for tools like snakeviz) and a text report of the phases and the slowest functions to base_path.txt """
+        stats = self.get_stats()
+        os.makedirs(os.path.dirname(base_path), exist_ok=True)
+        stats.dump_stats(base_path + ".prof")
+        output = io.StringIO()
+        stats.stream = output
+        stats.sort_stats("cumulative").print_stats(limit)
+        report = Spans.format(Spans.pop())
+        with open(base_path + ".txt", "w") as f:
+            f.write(report)
+            f.write("\n\n")
+            f.write(output.getvalue())
+        return report
@@ -0,0 +1,82 @@
+"""
+Runs every benchmarks.bench_* module (or just the named ones) and saves the
+results of their run() as JSON along with the commit they were measured on, so
+runs on different commits can be compared.
+
+Run with `python -m benchmarks [-o results.json] [--compare old.json] [names...]`
+"""
+import argparse
+import importlib
+import json
+import os
+import pkgutil
+import platform
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_benchmark_names():
+    return sorted(name[len("bench_"):] for _, name, _ in pkgutil.iter_modules([BENCHMARK_DIR]) if name.startswith("bench_"))
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """ Flattens nested results into a map of dotted keys to numbers """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(old, new):
+    old_values, new_values = flatten(old["results"]), flatten(new["results"])
+    print("{:60} {:>12} {:>12} {:>8}".format(f"{(old['commit'] or '')[:10]} -> {(new['commit'] or '')[:10]}", "old", "new", "ratio"))
+    for key in sorted(old_values.keys() & new_values.keys()):
+        ratio = new_values[key] / old_values[key] if old_values[key] else float("nan")
+        print(f"{key:60} {old_values[key]:12.4f} {new_values[key]:12.4f} {ratio:8.2f}")
+
+
+def run(names):
+    results = {}
+    for name in names:
+        print(f"Running {name}", file=sys.stderr)
+        module = importlib.import_module(f"benchmarks.bench_{name}")
+        start = time.time()
+        results[name] = module.run()
+        print(f"Finished {name} in {time.time() - start:.1f}s", file=sys.stderr)
+    return {"commit": get_commit(), "time": time.time(), "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(), "results": results}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--output", "-o", default=None, help="File to save the results to; defaults to stdout")
+    parser.add_argument("--compare", default=None, help="Results of an earlier run to compare against")
+    parser.add_argument("names", choices=get_benchmark_names(), nargs="*", help="Benchmarks to run; defaults to all")
+    namespace = parser.parse_args(args)
+
+    data = run(namespace.names or get_benchmark_names())
+    if namespace.output:
+        with open(namespace.output, "w") as f:
+            json.dump(data, f, indent=1, default=str)
+    else:
+        json.dump(data, sys.stdout, indent=1, default=str)
+        print()
+    if namespace.compare:
+        with open(namespace.compare) as f:
+            compare(json.load(f), json.loads(json.dumps(data, default=str)))
+
+
+if __name__ == "__main__":
+    main()
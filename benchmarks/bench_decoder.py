@@ -0,0 +1,136 @@
+"""
+Compares the pure python and numpy edge cost backends of GenericDecoder and
+the number of tile sizes tried with and without ranking them first. The
+parallel run also reports GenericDecoder.candidates_tried, the histogram of
+tile sizes tried per page.
+
+Uses the DecoderTest fixtures as well as a synthetic page scrambled the same
+way JNovelClubParts pages are.
+
+Run with `python -m benchmarks.bench_decoder`
+"""
+import importlib
+import random
+import time
+
+from PIL import Image
+
+from amt.tests.test import DecoderTest
+from amt.util import decoder
+from amt.util.decoder import GenericDecoder
+
+
+def create_img_from_array(array):
+    img = Image.new("I", (len(array[0]), len(array)))
+    img.putdata([col for row in array for col in row])
+    return img
+
+
+def create_scrambled_page(num_cols=4, num_rows=6, W=201, H=192, offset=(16, 16), margin=40, seed=0):
+    """ Returns a scrambled RGB image whose tiles overlap by offset and whose solution is known """
+    random.seed(seed)
+    img_width, img_height = num_cols * W + margin, num_rows * H + margin
+    offset_x, offset_y = offset[0] * num_cols, offset[1] * num_rows
+    # a smooth source image, like a real page
+    source = Image.new("RGB", (16, 16))
+    source.putdata([tuple(random.randint(0, 255) for _ in range(3)) for _ in range(16 * 16)])
+    source = source.resize((img_width - offset_x, img_height - offset_y), Image.BILINEAR)
+
+    img = Image.new("RGB", (img_width, img_height))
+    # the right and bottom margins are stored unscrambled
+    img.paste(source.crop((0, num_rows * H - offset_y, source.width, source.height)), (offset_x, num_rows * H))
+    img.paste(source.crop((num_cols * W - offset_x, img_height - num_rows * H - offset_y, source.width, source.height)), (num_cols * W, img_height - num_rows * H))
+
+    positions = [(x, y) for y in range(num_rows) for x in range(num_cols)]
+    shuffled = list(positions)
+    random.shuffle(shuffled)
+    for (x, y), (dest_x, dest_y) in zip(positions, shuffled):
+        left, top = x * (W - offset[0]), y * (H - offset[1])
+        img.paste(source.crop((left, top, left + W, top + H)), (dest_x * W, dest_y * H))
+    return img
+
+
+def clear_caches():
+    decoder.compute_diff.cache_clear()
+    decoder.Cell.get_vert_diff.cache_clear()
+    decoder.Cell.get_hor_diff.cache_clear()
+    decoder.find_neighbors.cache_clear()
+
+
+def time_backend(use_numpy, func, number):
+    GenericDecoder.USE_NUMPY = use_numpy
+    total = 0
+    for _ in range(number):
+        clear_caches()
+        start = time.time()
+        assert func()
+        total += time.time() - start
+    return total / number
+
+
+def run(number=3):
+    # import up front so the import time isn't attributed to the first fixture
+    importlib.import_module("numpy")
+    fixtures = {
+        "simple_img": lambda: GenericDecoder.solve_image_helper(create_img_from_array(DecoderTest.simple_img[0]), *DecoderTest.simple_img[1], offset=(1, 1))[0],
+        "scrambled_img": lambda: GenericDecoder.solve_image_helper(create_img_from_array(DecoderTest.scrambled_img[0]), *DecoderTest.scrambled_img[1], offset=(1, 1))[0],
+        "degenerate": lambda: GenericDecoder.solve_image(Image.new("RGB", (101, 93)), W=29, H=21),
+    }
+    page = create_scrambled_page()
+    fixtures["synthetic_page"] = lambda: GenericDecoder.solve_image_helper(page, 201, 192)[0]
+
+    results = {}
+    for name, func in fixtures.items():
+        results[name] = {backend: time_backend(backend == "numpy", func, number) for backend in ("python", "numpy")}
+    GenericDecoder.USE_NUMPY = True
+    return results
+
+
+def run_tile_size_search(number=3):
+    """ Counts the tile sizes tried (and time taken) to solve a page whose tile size isn't cached, with and without ranking """
+    page = create_scrambled_page()
+    results = {}
+    for rank in (False, True):
+        GenericDecoder.RANK_TILE_SIZES = rank
+        total = 0
+        for _ in range(number):
+            clear_caches()
+            start = time.time()
+            assert GenericDecoder.search_for_solution(page)[0]
+            total += time.time() - start
+        results[rank] = {"candidates_tried": GenericDecoder.search_for_solution(page)[-1], "time": total / number}
+    GenericDecoder.RANK_TILE_SIZES = True
+    return results
+
+
+def run_parallel(num_pages=8, threads=8):
+    """ Descrambles num_pages distinct pages from `threads` threads like a chapter download would """
+    from io import BytesIO
+
+    from amt.job import Job
+    pages = []
+    for i in range(num_pages):
+        data = BytesIO()
+        create_scrambled_page(seed=i).save(data, format="png")
+        pages.append(data.getvalue())
+    results = {}
+    for processes in (0, -1):
+        # warm up the pool so process start up isn't measured
+        GenericDecoder.descramble_and_save_img(pages[0], None, W=201, H=192, processes=processes)
+        clear_caches()
+        GenericDecoder._tile_sizes.clear()
+        GenericDecoder.candidates_tried.clear()
+        start = time.time()
+        Job(threads, [lambda data=data: GenericDecoder.descramble_and_save_img(data, None, processes=processes) for data in pages], raiseException=True).run()
+        results[processes] = {"time": time.time() - start, "candidates_tried": dict(sorted(GenericDecoder.candidates_tried.items()))}
+    return results
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(f"{name:20} python {result['python'] * 1000:10.2f}ms numpy {result['numpy'] * 1000:10.2f}ms")
+    for rank, result in run_tile_size_search().items():
+        print(f"tile size search rank={rank!s:5} tried {result['candidates_tried']:2} {result['time'] * 1000:10.2f}ms")
+    for processes, result in run_parallel().items():
+        histogram = " ".join(f"{num}:{count}" for num, count in result["candidates_tried"].items())
+        print(f"parallel pages processes={processes:2} {result['time'] * 1000:10.2f}ms candidates tried per page {histogram}")
@@ -0,0 +1,41 @@
+"""
+Compares the old per byte XOR page decryption with amt.util.decryption on a
+synthetic 5MB page, with and without numpy.
+
+Run with `python -m benchmarks.bench_decryption`
+"""
+import os
+import sys
+import timeit
+from contextlib import nullcontext
+from unittest.mock import patch
+
+from amt.util.decryption import xor_bytes, xor_stream
+
+PAGE_SIZE = 5 << 20
+CHUNK_SIZE = 1 << 20
+
+
+def xor_per_byte(data, key):
+    return bytes([int(v) ^ key[index % len(key)] for index, v in enumerate(data)])
+
+
+def run(number=3):
+    data = os.urandom(PAGE_SIZE)
+    key = os.urandom(64)
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    expected = xor_per_byte(data, key)
+
+    results = {"per_byte": timeit.timeit(lambda: xor_per_byte(data, key), number=number) / number}
+    for backend in ("numpy", "python"):
+        with nullcontext() if backend == "numpy" else patch.dict(sys.modules, {"numpy": None}):
+            assert xor_bytes(data, key) == expected
+            assert b"".join(xor_stream(chunks, key)) == expected
+            results[f"{backend}_bytes"] = timeit.timeit(lambda: xor_bytes(data, key), number=number) / number
+            results[f"{backend}_stream"] = timeit.timeit(lambda: b"".join(xor_stream(chunks, key)), number=number) / number
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:20} {value * 1000:10.2f}ms per {PAGE_SIZE >> 20}MB page")
@@ -0,0 +1,58 @@
+"""
+Compares parsing whole pages with parsing just the element servers need
+(RequestServer.soupify with parse_only) for each available bs4 parser.
+
+The pages are synthetic stand-ins shaped like a Nyaa search result and a
+Webtoons series list: the wanted table/list surrounded by navigation, scripts
+and other markup.
+
+Run with `python -m benchmarks.bench_html_parsing`
+"""
+import importlib.util
+import timeit
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from amt.server import RequestServer
+
+FILLER = "".join(f'<div class="nav-item col-{i % 4}"><a href="/section/{i}"><span>Section {i}</span></a><p>{"Lorem ipsum dolor sit amet " * 4}</p></div>' for i in range(400))
+SCRIPT = "<script>var data = {};</script>".format("[" + ",".join(str(i) for i in range(2000)) + "]")
+
+
+def create_nyaa_page(num_rows=75):
+    rows = "".join(f'<tr class="default"><td><a href="/?c=1_2" title="Anime"><img src="/cat.png"></a></td><td colspan="2"><a href="/view/{i}#comments">1</a><a href="/view/{i}" title="[Group] Some Anime - {i:02d} [1080p].mkv">[Group] Some Anime - {i:02d} [1080p].mkv</a></td><td class="text-center">1.2 GiB</td><td class="text-center">2021-01-01</td><td class="text-center">{i}</td></tr>' for i in range(num_rows))
+    return f'<html><head>{SCRIPT}</head><body><nav>{FILLER}</nav><div class="table-responsive"><table class="table torrent-list table-bordered"><tbody>{rows}</tbody></table></div><footer>{FILLER}</footer></body></html>'
+
+
+def create_webtoon_page(num_items=500):
+    items = "".join(f'<li><a href="/en/genre/title/list?title_no={i}"><div class="info"><p class="subj">Title {i}</p><p class="genre">Drama</p></div></a></li>' for i in range(num_items))
+    return f'<html><head>{SCRIPT}</head><body><header>{FILLER}</header><ul class="card_lst lst_type1">{items}</ul><footer>{FILLER}</footer></body></html>'
+
+
+PAGES = {
+    "nyaa": (create_nyaa_page(), SoupStrainer("table", class_=RequestServer.class_matcher("torrent-list")), lambda soup: len(soup.find("table", {"class": "torrent-list"}).find_all("tr"))),
+    "webtoon": (create_webtoon_page(), SoupStrainer("ul", class_=RequestServer.class_matcher("lst_type1")), lambda soup: len(soup.find("ul", class_="lst_type1").find_all("li"))),
+}
+
+
+def get_parsers():
+    parsers = ["html.parser"]
+    if importlib.util.find_spec("lxml"):
+        parsers.append("lxml")
+    return parsers
+
+
+def run(number=5):
+    results = {}
+    for name, (page, strainer, extract) in PAGES.items():
+        results[name] = {"page_kb": len(page) >> 10}
+        for parser in get_parsers():
+            assert extract(BeautifulSoup(page, parser)) == extract(BeautifulSoup(page, parser, parse_only=strainer))
+            results[name][f"{parser}_full"] = timeit.timeit(lambda: extract(BeautifulSoup(page, parser)), number=number) / number
+            results[name][f"{parser}_scoped"] = timeit.timeit(lambda: extract(BeautifulSoup(page, parser, parse_only=strainer)), number=number) / number
+    return results
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(f"{name:10} {result.pop('page_kb')}KB", " ".join(f"{key}={value * 1000:.2f}ms" for key, value in result.items()))
@@ -0,0 +1,56 @@
+"""
+Matches 500 tracker names against a 10k entry catalog with
+find_media_with_similar_name_in_list and compares it with the old nested
+substring scan and with querying an already built MediaNameIndex.
+
+Run with `python -m benchmarks.bench_name_matching`
+"""
+import random
+import time
+
+from amt.util.name_parser import find_media_with_similar_name_in_list, get_alt_names, get_media_name_index
+
+CATALOG_SIZE = 10000
+NUM_NAMES = 500
+
+SYLLABLES = ["ka", "ri", "to", "ma", "shi", "ne", "ro", "yu", "ha", "zo", "mi", "ku", "sa", "te", "no", "ra"]
+
+
+def find_media_with_similar_name_in_list_scan(media_names, media_list):
+    media_names = list(map(str.lower, media_names))
+    for media_data in media_list:
+        if any(map(lambda name: name in media_data["name"].lower() or ("season_title" in media_data and name in media_data["season_title"].lower()) or media_data["name"].lower() in name, media_names)):
+            yield media_data
+
+
+def create_name(rng):
+    return " ".join("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize() for _ in range(rng.randint(2, 5)))
+
+
+def run():
+    rng = random.Random(0)
+    catalog = [{"name": create_name(rng), "season_title": rng.choice(["", "", "Season 2", "Final Arc"])} for _ in range(CATALOG_SIZE)]
+    # half the names are in the catalog, the rest are unknown
+    names = [rng.choice(catalog)["name"] if i % 2 else create_name(rng) for i in range(NUM_NAMES)]
+    alt_names = [get_alt_names(name) for name in names]
+
+    results = {}
+    for label, func in (("scan", find_media_with_similar_name_in_list_scan), ("index", find_media_with_similar_name_in_list)):
+        get_media_name_index.cache_clear()
+        start = time.time()
+        matches = [list(func(alt, catalog)) for alt in alt_names]
+        results[label] = time.time() - start
+        results[f"{label}_matches"] = sum(map(len, matches))
+    # what callers holding on to the index pay per lookup
+    index = get_media_name_index(tuple((media_data["name"], media_data["season_title"]) for media_data in catalog))
+    start = time.time()
+    results["prebuilt_index_matches"] = sum(len(index.find(alt)) for alt in alt_names)
+    results["prebuilt_index"] = time.time() - start
+    assert results["scan_matches"] == results["index_matches"] == results["prebuilt_index_matches"]
+    return results
+
+
+if __name__ == "__main__":
+    results = run()
+    for label in ("scan", "index", "prebuilt_index"):
+        print(f"{label:15} {results[label] * 1000:10.2f}ms for {NUM_NAMES} names against {CATALOG_SIZE} media ({results[label + '_matches']} matches)")
@@ -0,0 +1,101 @@
+"""
+Measures whole workflows against the local stand-in in benchmarks.standin:
+updating every media, downloading every unread chapter (images and AES
+encrypted m3u8 episodes), loading and saving a large library and starting the
+cli.
+
+Run with `python -m benchmarks.bench_scenarios`
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from .standin import StandInAnimeServer, StandInConfig, StandInServer, start_standin
+
+LIBRARY_SIZE = 2000
+LIBRARY_CHAPTERS = 50
+
+
+def create_media_reader(home):
+    os.environ["AMT_HOME"] = home
+    from amt.media_reader import MediaReader
+    from amt.settings import Settings
+    from amt.state import State
+    settings = Settings(no_load=True)
+    settings.post_process_cmd = ""
+    return MediaReader(State(settings), server_list=[StandInServer, StandInAnimeServer], tracker_list=[])
+
+
+def time_func(func):
+    start = time.time()
+    value = func()
+    return time.time() - start, value
+
+
+def run_update():
+    media_reader = create_media_reader(tempfile.mkdtemp())
+    server = media_reader.get_server(StandInServer.id)
+    for media_data in server.get_media_list():
+        media_reader.add_media(media_data, no_update=True)
+    elapsed, num_chapters = time_func(lambda: media_reader.update(no_shuffle=True))
+    assert num_chapters == StandInConfig.num_media * StandInConfig.num_chapters
+    return {"time": elapsed, "media": StandInConfig.num_media, "chapters_per_sec": num_chapters / elapsed}
+
+
+def run_download(server_id, unit_size):
+    media_reader = create_media_reader(tempfile.mkdtemp())
+    server = media_reader.get_server(server_id)
+    for media_data in server.get_media_list():
+        media_reader.add_media(media_data)
+    server.http_stats.pop()
+    elapsed, num_chapters = time_func(media_reader.download_unread_chapters)
+    assert num_chapters == StandInConfig.num_media * StandInConfig.num_chapters
+    entries = [entry for endpoints in server.http_stats.pop().values() for entry in endpoints.values()]
+    return {"time": elapsed, "chapters": num_chapters, "chapters_per_sec": num_chapters / elapsed, "mb_per_sec": num_chapters * unit_size / elapsed / (1 << 20),
+            "requests": sum(entry["requests"] for entry in entries), "connections": sum(entry["connections"] for entry in entries)}
+
+
+def run_state():
+    home = tempfile.mkdtemp()
+    media_reader = create_media_reader(home)
+    server = media_reader.get_server(StandInServer.id)
+    for i in range(LIBRARY_SIZE):
+        media_data = server.create_media_data(id=i, name=f"Library Media {i}")
+        for n in range(LIBRARY_CHAPTERS):
+            server.update_chapter_data(media_data, id=f"{i}-{n}", title=f"Chapter {n}", number=n)
+        media_reader.add_media(media_data, no_update=True)
+    save_time, _ = time_func(media_reader.state.save)
+    load_time, media_reader = time_func(lambda: create_media_reader(home))
+    assert len(media_reader.media) == LIBRARY_SIZE
+    return {"save": save_time, "load": load_time, "media": LIBRARY_SIZE, "chapters": LIBRARY_SIZE * LIBRARY_CHAPTERS}
+
+
+def run_cli_startup(number=3):
+    """ Best of `number` runs of a readonly command and of one that instantiates every server """
+    env = dict(os.environ, AMT_HOME=tempfile.mkdtemp(), PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = {}
+    for name, args in (("readonly", ["list"]), ("all_servers", ["--no-save", "get_remaining_chapters"])):
+        cmd = [sys.executable, "-c", f"import sys; from amt.args import parse_args; sys.exit(parse_args({args!r}))"]
+        results[name] = min(time_func(lambda: subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))[0] for _ in range(number))
+    return results
+
+
+def run():
+    httpd = start_standin()
+    try:
+        return {
+            "update": run_update(),
+            "download_pages": run_download(StandInServer.id, StandInConfig.num_pages * StandInConfig.page_size),
+            "download_m3u8": run_download(StandInAnimeServer.id, StandInConfig.num_segments * StandInConfig.segment_size),
+            "state": run_state(),
+            "cli_startup": run_cli_startup(),
+        }
+    finally:
+        httpd.shutdown()
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(f"{name:15}", " ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in result.items()))
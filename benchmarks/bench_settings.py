@@ -0,0 +1,47 @@
+"""
+Measures the overhead of resolving settings along the download_pages path.
+
+Run with `python -m benchmarks.bench_settings`
+"""
+import os
+import tempfile
+import timeit
+
+from amt.settings import Settings
+from amt.tests.test_server import TestServer
+
+NUM_PAGES = 1000
+
+
+class BenchServer(TestServer):
+    id = "bench_server"
+
+    def get_media_chapter_data(self, media_data, chapter_data, stream_index=0):
+        return [self.create_page_data(url=f"https://some_url.com/{i}.png") for i in range(NUM_PAGES)]
+
+    def save_chapter_page(self, page_data, path):
+        open(path, "w").close()
+
+
+def run(number=20):
+    os.environ["AMT_HOME"] = tempfile.mkdtemp()
+    settings = Settings(no_load=True)
+    settings.threads = 0
+    from requests import Session
+    server = BenchServer(Session(), settings)
+    media_data = server.get_media_list()[0]
+    server.update_media_data(media_data)
+    chapter_data = next(iter(media_data["chapters"].values()))
+    # download once so subsequent runs only measure the overhead of walking the pages
+    server.download_pages(media_data, chapter_data)
+
+    results = {}
+    results["get_field"] = timeit.timeit(lambda: settings.get_threads(media_data), number=number * NUM_PAGES) / number
+    results["get_page_file_name"] = timeit.timeit(lambda: settings.get_page_file_name(media_data, chapter_data, ext="png", page_number=1), number=number * NUM_PAGES) / number
+    results["download_pages"] = timeit.timeit(lambda: server.download_pages(media_data, chapter_data), number=number) / number
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:20} {value * 1000:8.3f}ms per {NUM_PAGES} pages")
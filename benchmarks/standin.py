@@ -0,0 +1,145 @@
+"""
+A local HTTP stand-in for the sites servers talk to and amt servers that use it.
+
+The stand-in serves a synthetic catalog, chapter lists, image pages and AES-128
+encrypted m3u8 playlists so whole workflows (update, download, ...) can be
+measured without the network. Sizes are controlled by StandInConfig.
+"""
+import json
+import os
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from amt.server import Server
+from amt.util.media_type import MediaType
+
+AES_KEY = bytes(range(16))
+AES_IV = 1
+
+
+class StandInConfig:
+    num_media = 20
+    num_chapters = 10
+    num_pages = 10
+    page_size = 64 << 10
+    num_segments = 10
+    segment_size = 64 << 10
+    # seconds added to every response to mimic a remote server
+    latency = 0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # send the headers and body in one write; otherwise delayed ACKs dominate every keep-alive request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    routes = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, content_type="application/octet-stream"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data).encode(), "application/json")
+
+    def do_GET(self):
+        if StandInConfig.latency:
+            threading.Event().wait(StandInConfig.latency)
+        for regex, func in self.routes:
+            match = regex.fullmatch(self.path.split("?")[0])
+            if match:
+                return func(self, *match.groups())
+        self.send_error(404)
+
+    def get_catalog(self):
+        self.send_json([{"id": i, "name": f"Stand-in Media {i}"} for i in range(StandInConfig.num_media)])
+
+    def get_chapters(self, media_id):
+        self.send_json([{"id": f"{media_id}-{i}", "number": i + 1, "title": f"Chapter {i + 1}"} for i in range(StandInConfig.num_chapters)])
+
+    def get_pages(self, chapter_id):
+        self.send_json([f"/page/{chapter_id}/{i}.jpg" for i in range(StandInConfig.num_pages)])
+
+    def get_page(self, chapter_id, page):
+        self.send_body(get_payload(StandInConfig.page_size), "image/jpeg")
+
+    def get_playlist(self, chapter_id):
+        host = "http://{}:{}".format(*self.server.server_address)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:10", f'#EXT-X-KEY:METHOD=AES-128,URI="{host}/key",IV=0x{AES_IV:032x}']
+        for i in range(StandInConfig.num_segments):
+            lines.extend(["#EXTINF:10.0,", f"{host}/segment/{chapter_id}/{i}.ts"])
+        lines.append("#EXT-X-ENDLIST")
+        self.send_body("\n".join(lines).encode(), "application/vnd.apple.mpegurl")
+
+    def get_key(self):
+        self.send_body(AES_KEY)
+
+    def get_segment(self, chapter_id, segment):
+        self.send_body(get_encrypted_payload(StandInConfig.segment_size), "video/mp2t")
+
+
+StandInHandler.routes = [
+    (re.compile(r"/catalog"), StandInHandler.get_catalog),
+    (re.compile(r"/media/([^/]+)/chapters"), StandInHandler.get_chapters),
+    (re.compile(r"/chapter/([^/]+)/pages"), StandInHandler.get_pages),
+    (re.compile(r"/page/([^/]+)/(\d+)\.jpg"), StandInHandler.get_page),
+    (re.compile(r"/stream/([^/]+)\.m3u8"), StandInHandler.get_playlist),
+    (re.compile(r"/key"), StandInHandler.get_key),
+    (re.compile(r"/segment/([^/]+)/(\d+)\.ts"), StandInHandler.get_segment),
+]
+
+_payloads = {}
+
+
+def get_payload(size):
+    if size not in _payloads:
+        _payloads[size] = os.urandom(size)
+    return _payloads[size]
+
+
+def get_encrypted_payload(size):
+    if ("aes", size) not in _payloads:
+        from Crypto.Cipher import AES
+        _payloads["aes", size] = AES.new(AES_KEY, AES.MODE_CBC, AES_IV.to_bytes(16, "big")).encrypt(get_payload(size - size % 16))
+    return _payloads["aes", size]
+
+
+def start_standin():
+    """ Starts the stand-in on a free port in a background thread and points the stand-in servers at it """
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    StandInServer.base_url = "http://{}:{}".format(*httpd.server_address)
+    return httpd
+
+
+class StandInServer(Server):
+    id = "standin_manga"
+    base_url = None
+
+    def get_media_list(self, limit=None, media_type=None):
+        return [self.create_media_data(id=x["id"], name=x["name"]) for x in self.session_get(f"{self.base_url}/catalog").json()][:limit]
+
+    def update_media_data(self, media_data, limit=None):
+        for chapter in self.session_get(f"{self.base_url}/media/{media_data['id']}/chapters").json():
+            self.update_chapter_data(media_data, id=chapter["id"], title=chapter["title"], number=chapter["number"])
+
+    def get_media_chapter_data(self, media_data, chapter_data, stream_index=0):
+        return [self.create_page_data(url=self.base_url + url) for url in self.session_get(f"{self.base_url}/chapter/{chapter_data['id']}/pages").json()]
+
+
+class StandInAnimeServer(StandInServer):
+    id = "standin_anime"
+    media_type = MediaType.ANIME
+    get_media_chapter_data = Server.get_media_chapter_data
+
+    def get_stream_urls(self, media_data, chapter_data):
+        return [[f"{self.base_url}/stream/{chapter_data['id']}.m3u8"]]